@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+"""
+A1 Dental Lab - Command line interface
+Features:
+- Headless access to DatabaseManager and AuthManager (no Streamlit import)
+- Backup/restore, CSV import, exports, statistics and balance reconciliation
+- Maintenance and account statement runs for cron
+- Run from the application folder: python -m a1lab --help
+"""
@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+"""Entry point for python -m a1lab"""
+
+import sys
+
+from a1lab.cli import main
+
+sys.exit(main())
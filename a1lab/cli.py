@@ -0,0 +1,418 @@
+# -*- coding: utf-8 -*-
+"""
+A1 Dental Lab - Command line interface
+Features:
+- One subcommand per operation, argparse only at start-up
+- Database modules (and pandas) imported by the command that needs them
+- Exit status 0 on success, 1 on failure or findings (cron mails the output)
+- Paths (backups/, uploads/) relative to the working directory, like the app
+"""
+
+import argparse
+import getpass
+import json
+import os
+import sys
+from typing import List, Optional
+
+DEFAULT_DB = os.environ.get("A1LAB_DB", "lab_database.db")
+
+# The app's price and entity caches are per process and only invalidated by its own writes
+RESTART_HINT = "restart the running app: its caches still hold the old data"
+
+# Export name -> (query, date column for --from/--to)
+EXPORTS = {
+    'cases': ("SELECT * FROM cases", "entry_date"),
+    'invoices': ("SELECT * FROM invoices", "issue_date"),
+    'payments': ("SELECT * FROM payments", "payment_date"),
+    'balances': ("SELECT * FROM balances", None),
+    'prices': ("SELECT * FROM doctors_prices WHERE is_active = 1", None),
+    'entities': ("SELECT * FROM doctors_list", None),
+    'audit': ("SELECT * FROM audit_log", "timestamp"),
+}
+
+
+def _open_db(args):
+    """DatabaseManager for --db, created on demand (it runs the migrations)"""
+    if not os.path.exists(args.db):
+        raise SystemExit(f"a1lab: database not found: {args.db}")
+    from database import DatabaseManager
+    return DatabaseManager(args.db)
+
+
+def _open_auth(args):
+    """AuthManager for --db"""
+    if not os.path.exists(args.db):
+        raise SystemExit(f"a1lab: database not found: {args.db}")
+    from auth_manager import get_auth_manager
+    return get_auth_manager(args.db)
+
+
+def _resolve_entity(db, value: str) -> int:
+    """Doctor/center/branch by id or exact name"""
+    if value.isdigit() and db.get_entity(int(value)):
+        return int(value)
+    entity_id = db.get_entity_id(value)
+    if entity_id is None:
+        raise SystemExit(f"a1lab: unknown doctor/center: {value}")
+    return entity_id
+
+
+def _write_frame(df, out: str):
+    """Write a DataFrame by extension (.csv, .xlsx, .json), '-' prints CSV"""
+    if out == "-":
+        df.to_csv(sys.stdout, index=False)
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    extension = os.path.splitext(out)[1].lower()
+    if extension == ".xlsx":
+        df.to_excel(out, index=False)
+    elif extension == ".json":
+        df.to_json(out, orient="records", force_ascii=False, indent=2)
+    else:
+        # BOM so Excel opens the Arabic names correctly
+        df.to_csv(out, index=False, encoding="utf-8-sig")
+
+
+def _print_frame(df):
+    """Plain table for the terminal / cron mail"""
+    import pandas as pd
+    with pd.option_context("display.max_rows", None, "display.max_columns", None, "display.width", 200):
+        print(df.to_string(index=False))
+
+
+# =============================================================================
+#                               COMMANDS
+# =============================================================================
+
+def cmd_backup(args) -> int:
+    """Online backup into backups/ (keeps the newest 30)"""
+    path = _open_db(args).backup_database()
+    if not path:
+        return 1
+    print(path)
+    return 0
+
+
+def cmd_restore(args) -> int:
+    """Replace the database with a backup, after backing up the current one"""
+    if not args.yes:
+        answer = input(f"Replace {args.db} with {args.backup}? [y/N] ")
+        if answer.strip().lower() not in ("y", "yes"):
+            print("aborted")
+            return 1
+    safety_backup = _open_db(args).restore_database(args.backup)
+    if not safety_backup:
+        return 1
+    print(f"restored {args.backup} (previous database saved as {safety_backup})")
+    print(RESTART_HINT)
+    return 0
+
+
+def cmd_import_prices(args) -> int:
+    """Price list of one entity from a CSV with material, price[, cost_price]"""
+    import pandas as pd
+    db = _open_db(args)
+    entity_id = _resolve_entity(db, args.entity)
+
+    rows = pd.read_csv(args.csv).to_dict("records")
+    missing = {'material', 'price'} - set(rows[0]) if rows else set()
+    if missing:
+        print(f"a1lab: {args.csv} lacks column(s): {', '.join(sorted(missing))}", file=sys.stderr)
+        return 1
+    if not args.replace:
+        # bulk_upsert_prices takes the complete list: keep materials the file leaves out
+        listed = {str(row['material']).strip() for row in rows}
+        current = db.get_all_prices_for_entity(entity_id).to_dict("records")
+        rows += [row for row in current if row['material'] not in listed]
+
+    result = db.bulk_upsert_prices(entity_id, rows, user=args.user)
+    if result is None:
+        return 1
+    print(f"inserted={result['inserted']}, updated={result['updated']}, deleted={result['deleted']}")
+    if any(result.values()):
+        print(RESTART_HINT)
+    return 0
+
+
+def cmd_import_entities(args) -> int:
+    """Doctors, centers and branches from a CSV with name, type[, center, phone, email]"""
+    import pandas as pd
+    db = _open_db(args)
+    frame = pd.read_csv(args.csv, dtype=str).fillna("")
+    if not {'name', 'type'} <= set(frame.columns):
+        print(f"a1lab: {args.csv} needs name and type columns", file=sys.stderr)
+        return 1
+
+    added, failed = 0, 0
+    # Centers first so branches in the same file find their parent
+    order = {'center': 0, 'doctor': 1, 'branch': 2}
+    for row in sorted(frame.to_dict("records"), key=lambda r: order.get(r['type'].strip().lower(), 3)):
+        name, kind = row['name'].strip(), row['type'].strip().lower()
+        phone, email = row.get('phone') or None, row.get('email') or None
+        if kind == 'doctor':
+            ok = db.add_doctor(name, phone, email)
+        elif kind == 'center':
+            ok = db.add_dental_center(name, phone, email)
+        elif kind == 'branch' and db.get_entity_id(row.get('center', '').strip()):
+            ok = db.add_branch(name, db.get_entity_id(row['center'].strip()))
+        else:
+            print(f"a1lab: skipped {name!r}: bad type or unknown center", file=sys.stderr)
+            ok = False
+        added, failed = added + bool(ok), failed + (not ok)
+    print(f"processed={added}, skipped={failed}")
+    if added:
+        print(RESTART_HINT)
+    return 1 if failed else 0
+
+
+def cmd_export(args) -> int:
+    """One table (optionally a date range) to CSV/XLSX/JSON"""
+    db = _open_db(args)
+    query, date_column = EXPORTS[args.table]
+    conditions, params = [], []
+    if date_column and args.date_from:
+        conditions.append(f"date({date_column}) >= date(?)")
+        params.append(args.date_from)
+    if date_column and args.date_to:
+        conditions.append(f"date({date_column}) <= date(?)")
+        params.append(args.date_to)
+    if conditions:
+        query += (" AND " if " WHERE " in query else " WHERE ") + " AND ".join(conditions)
+
+    # Nullable ints so id columns with gaps are not written as 7.0
+    frame = db.run_query(query, tuple(params)).convert_dtypes()
+    _write_frame(frame, args.out)
+    if args.out != "-":
+        print(f"{len(frame)} rows -> {args.out}")
+    return 0
+
+
+def cmd_stats(args) -> int:
+    """Dashboard figures, optionally the revenue trend"""
+    db = _open_db(args)
+    stats = {key: value.item() if hasattr(value, "item") else value
+             for key, value in db.get_database_stats().items()}
+    trend = db.get_monthly_revenue_trend(args.months) if args.months else None
+
+    if args.json:
+        if trend is not None:
+            stats['revenue_trend'] = trend.to_dict("records")
+        print(json.dumps(stats, ensure_ascii=False, indent=2, default=str))
+        return 0
+    width = max(len(key) for key in stats)
+    for key, value in stats.items():
+        print(f"{key:<{width}}  {value}")
+    if trend is not None and not trend.empty:
+        print()
+        _print_frame(trend)
+    return 0
+
+
+def cmd_reconcile(args) -> int:
+    """Balance totals vs. the invoice/payment ledger; status 1 on unfixed mismatches"""
+    mismatches = _open_db(args).reconcile_balances(fix=args.fix)
+    if mismatches.empty:
+        print("balances match the ledger")
+        return 0
+    _print_frame(mismatches.drop(columns=['balance_id']))
+    print(f"{len(mismatches)} account(s) {'fixed' if args.fix else 'differ'}")
+    return 0 if args.fix else 1
+
+
+def cmd_maintenance(args) -> int:
+    """ANALYZE, WAL checkpoint, incremental vacuum and attachment GC, once"""
+    # The one-off VACUUM locks the whole file: only on request, the app's idle window does it otherwise
+    log = _open_db(args).maintenance.run_now(full_vacuum=args.vacuum)
+    if log.empty:
+        print("maintenance already running")
+        return 1
+    _print_frame(log[['task', 'duration_ms', 'pages_before', 'pages_after', 'details', 'error']])
+    return 1 if log['error'].notna().any() else 0
+
+
+def cmd_statement(args) -> int:
+    """Account statements: one account to a file/stdout, or --all into a folder"""
+    import pandas as pd
+    db = _open_db(args)
+    if args.all:
+        if not args.out:
+            print("a1lab: --all needs --out DIRECTORY", file=sys.stderr)
+            return 1
+        accounts = db.run_query("""
+            SELECT DISTINCT entity_id, branch_id, entity_name, branch_name FROM (
+                SELECT entity_id, branch_id, entity_name, branch_name FROM payments
+                UNION ALL
+                SELECT entity_id, branch_id, COALESCE(NULLIF(dental_center, ''), doctor_name), branch_name
+                FROM invoices WHERE COALESCE(is_cancelled, 0) = 0
+            ) WHERE entity_id IS NOT NULL
+        """)
+        extension = args.format
+        written = 0
+        for account in accounts.itertuples(index=False):
+            branch_id = None if pd.isna(account.branch_id) else int(account.branch_id)
+            statement = db.get_account_statement(int(account.entity_id), branch_id, args.date_from, args.date_to)
+            if len(statement) <= 1 and not statement['debit'].any():
+                continue  # Nothing owed and no movement in the period
+            suffix = f"_{int(account.branch_id)}" if branch_id else ""
+            _write_frame(statement, os.path.join(args.out, f"statement_{int(account.entity_id)}{suffix}.{extension}"))
+            written += 1
+        print(f"{written} statement(s) -> {args.out}")
+        return 0
+
+    if not args.entity:
+        print("a1lab: give an ENTITY or --all", file=sys.stderr)
+        return 1
+    entity_id = _resolve_entity(db, args.entity)
+    branch_id = _resolve_entity(db, args.branch) if args.branch else None
+    statement = db.get_account_statement(entity_id, branch_id, args.date_from, args.date_to)
+    if args.out:
+        _write_frame(statement, args.out)
+    else:
+        _print_frame(statement)
+    return 0
+
+
+def cmd_users(args) -> int:
+    """User administration through AuthManager"""
+    auth = _open_auth(args)
+    if args.action == 'list':
+        for user in auth.get_all_users():
+            state = "active" if user['is_active'] else "disabled"
+            print(f"{user['username']:<20} {user['role']:<12} {state:<9} {user['full_name']}")
+        return 0
+    if args.action == 'cleanup-sessions':
+        print(f"{auth.cleanup_sessions(force=True)} session(s) cleaned up")
+        return 0
+
+    if not args.username:
+        print(f"a1lab: users {args.action} needs a USERNAME", file=sys.stderr)
+        return 1
+    if args.action in ('add', 'passwd'):
+        password = sys.stdin.readline().rstrip("\n") if args.password_stdin else getpass.getpass()
+        if not password:
+            print("a1lab: empty password", file=sys.stderr)
+            return 1
+        if args.action == 'add':
+            ok, message = auth.create_user(args.username, password, args.full_name or args.username,
+                                           args.role, created_by=args.user)
+        else:
+            ok, message = auth.update_user(args.username, password=password, updated_by=args.user)
+    else:
+        ok, message = auth.delete_user(args.username, args.user)
+    print(message)
+    return 0 if ok else 1
+
+
+def cmd_seed(args) -> int:
+    """Fill a new database with a seeded synthetic history (scale testing)"""
+    from synthetic_data import SyntheticDataGenerator, SYNTHETIC_USERS, SYNTHETIC_PASSWORD
+    generator = SyntheticDataGenerator(args.db, seed=args.seed, years=args.years)
+    try:
+        stats = generator.generate(
+            doctors=args.doctors, centers=args.centers, max_branches=args.branches, cases=args.cases,
+            attachment_files=args.attachment_files, attachment_ratio=args.attachment_ratio
+        )
+    except ValueError as e:
+        print(f"a1lab: {e}", file=sys.stderr)
+        return 1
+    width = max(len(key) for key in stats)
+    for key, value in stats.items():
+        print(f"{key:<{width}}  {value}")
+    users = ", ".join(username for username, _, _ in SYNTHETIC_USERS)
+    print(f"users {users} (password {SYNTHETIC_PASSWORD}), admin unchanged")
+    return 0
+
+
+# =============================================================================
+#                               PARSER
+# =============================================================================
+
+def build_parser() -> argparse.ArgumentParser:
+    """Argument parser with one subparser per command"""
+    parser = argparse.ArgumentParser(
+        prog="python -m a1lab",
+        description="A1 Dental Lab command line tools (run from the application folder)"
+    )
+    parser.add_argument("--db", default=DEFAULT_DB, help="database file (default: $A1LAB_DB or lab_database.db)")
+    parser.add_argument("--user", default="cli", help="name recorded in audit and activity logs")
+    commands = parser.add_subparsers(dest="command", required=True, metavar="COMMAND")
+
+    sub = commands.add_parser("backup", help="back up the database into backups/")
+    sub.set_defaults(func=cmd_backup)
+
+    sub = commands.add_parser("restore", help="restore a backup (the current database is backed up first)")
+    sub.add_argument("backup")
+    sub.add_argument("-y", "--yes", action="store_true", help="do not ask for confirmation")
+    sub.set_defaults(func=cmd_restore)
+
+    sub = commands.add_parser("import", help="import prices or doctors/centers from CSV")
+    kinds = sub.add_subparsers(dest="kind", required=True, metavar="KIND")
+    prices = kinds.add_parser("prices", help="price list of one doctor/center/branch (material, price[, cost_price])")
+    prices.add_argument("entity", help="id or name")
+    prices.add_argument("csv")
+    prices.add_argument("--replace", action="store_true", help="delete prices of materials missing from the file")
+    prices.set_defaults(func=cmd_import_prices)
+    entities = kinds.add_parser("entities", help="doctors/centers/branches (name, type[, center, phone, email])")
+    entities.add_argument("csv")
+    entities.set_defaults(func=cmd_import_entities)
+
+    sub = commands.add_parser("export", help="export a table to .csv/.xlsx/.json")
+    sub.add_argument("table", choices=sorted(EXPORTS))
+    sub.add_argument("out", help="output file, '-' for CSV on stdout")
+    sub.add_argument("--from", dest="date_from", metavar="YYYY-MM-DD")
+    sub.add_argument("--to", dest="date_to", metavar="YYYY-MM-DD")
+    sub.set_defaults(func=cmd_export)
+
+    sub = commands.add_parser("stats", help="dashboard statistics")
+    sub.add_argument("--months", type=int, default=0, help="also show the revenue of the last N months")
+    sub.add_argument("--json", action="store_true")
+    sub.set_defaults(func=cmd_stats)
+
+    sub = commands.add_parser("reconcile", help="check balance totals against invoices and payments")
+    sub.add_argument("--fix", action="store_true", help="rewrite the totals from the ledger")
+    sub.set_defaults(func=cmd_reconcile)
+
+    sub = commands.add_parser("maintenance", help="run database maintenance now")
+    sub.add_argument("--vacuum", action="store_true",
+                     help="allow the one-off full VACUUM that enables incremental vacuum "
+                          "(locks the database, stop the app first)")
+    sub.set_defaults(func=cmd_maintenance)
+
+    sub = commands.add_parser("statement", help="account statements with running balance")
+    sub.add_argument("entity", nargs="?", help="id or name")
+    sub.add_argument("--branch", help="branch id or name")
+    sub.add_argument("--all", action="store_true", help="every account with invoices or payments")
+    sub.add_argument("--from", dest="date_from", metavar="YYYY-MM-DD")
+    sub.add_argument("--to", dest="date_to", metavar="YYYY-MM-DD")
+    sub.add_argument("--out", help="output file (folder with --all)")
+    sub.add_argument("--format", choices=["csv", "xlsx", "json"], default="csv", help="file type with --all")
+    sub.set_defaults(func=cmd_statement)
+
+    sub = commands.add_parser("users", help="user administration")
+    sub.add_argument("action", choices=["list", "add", "passwd", "disable", "cleanup-sessions"])
+    sub.add_argument("username", nargs="?")
+    sub.add_argument("--full-name")
+    sub.add_argument("--role", choices=["technician", "accountant", "manager", "admin"], default="technician")
+    sub.add_argument("--password-stdin", action="store_true", help="read the password from stdin")
+    sub.set_defaults(func=cmd_users)
+
+    sub = commands.add_parser("seed", help="fill a new database (--db) with synthetic data for scale tests")
+    sub.add_argument("--cases", type=int, default=100_000)
+    sub.add_argument("--doctors", type=int, default=200)
+    sub.add_argument("--centers", type=int, default=40)
+    sub.add_argument("--branches", type=int, default=5, help="at most this many branches per center")
+    sub.add_argument("--years", type=int, default=5, help="history length, ending today")
+    sub.add_argument("--attachment-files", type=int, default=200, help="distinct files shared by the cases")
+    sub.add_argument("--attachment-ratio", type=float, default=0.3, help="share of cases with an attachment")
+    sub.add_argument("--seed", type=int, default=42)
+    sub.set_defaults(func=cmd_seed)
+
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Parse arguments and run the command, returns the exit status"""
+    args = build_parser().parse_args(argv)
+    # Database errors are printed where they happen (run_query / run_action), like in the app
+    return args.func(args)
@@ -6,7 +6,7 @@ Activity Log Viewer - Complete System Audit Trail
 
 import streamlit as st
 import pandas as pd
-from auth_manager import AuthManager, require_permission
+from auth_manager import get_auth_manager, require_permission
 from datetime import datetime, timedelta
 import json
 
@@ -17,7 +17,7 @@ def show_activity_log_page():
     
     st.header("📋 سجل النشاطات - Activity Log")
     
-    auth = AuthManager()
+    auth = get_auth_manager()
     current_user = st.session_state.username
     current_role = st.session_state.role
     
@@ -117,7 +117,7 @@ def show_activity_log_page():
         
         with col_limit:
             limit = st.number_input(
-                "عدد السجلات",
+                "عدد السجلات في الصفحة",
                 min_value=10,
                 max_value=1000,
                 value=100,
@@ -143,37 +143,44 @@ def show_activity_log_page():
     
     st.divider()
     
-    # Get activity log
-    activities = auth.get_activity_log(
+    filters = dict(
         username=selected_user,
         module=selected_module,
+        action_type=selected_action,
         start_date=str(start_date),
-        end_date=str(end_date),
-        limit=limit
+        end_date=str(end_date)
     )
     
-    # Filter by action type if selected
-    if selected_action:
-        activities = [a for a in activities if a['action_type'] == selected_action]
+    # Keyset pagination: a stack of (timestamp, id) cursors, reset when filters change
+    filters_key = (tuple(filters.items()), limit)
+    if st.session_state.get('activity_filters_key') != filters_key:
+        st.session_state.activity_filters_key = filters_key
+        st.session_state.activity_cursors = [None]
+    cursors = st.session_state.activity_cursors
     
-    if not activities:
+    # Get activity log (every filter runs in SQL)
+    activities = auth.get_activity_log(limit=limit, before=cursors[-1], **filters)
+    
+    # Totals come from the daily rollup, not from the current page
+    daily_rollup = pd.DataFrame(auth.get_activity_rollup('daily', **filters))
+    
+    if not activities or daily_rollup.empty:
         st.info("لا توجد سجلات تطابق الفلاتر المحددة")
         return
     
     # Statistics
-    st.subheader(f"📊 الإحصائيات - وجد {len(activities)} سجل")
+    total_count = int(daily_rollup['event_count'].sum())
+    st.subheader(f"📊 الإحصائيات - وجد {total_count} سجل")
     
     col_stat1, col_stat2, col_stat3, col_stat4 = st.columns(4)
     
     df_activities = pd.DataFrame(activities)
+    today_rows = daily_rollup[daily_rollup['bucket'] == str(datetime.now().date())]
     
-    # Count by action type
-    action_counts = df_activities['action_type'].value_counts()
-    
-    col_stat1.metric("إجمالي الإجراءات", len(activities))
-    col_stat2.metric("المستخدمون", df_activities['username'].nunique())
-    col_stat3.metric("الأقسام", df_activities['module'].nunique())
-    col_stat4.metric("اليوم", len(df_activities[df_activities['timestamp'].str.contains(str(datetime.now().date()))]))
+    col_stat1.metric("إجمالي الإجراءات", total_count)
+    col_stat2.metric("المستخدمون", daily_rollup['username'].nunique())
+    col_stat3.metric("الأقسام", daily_rollup['module'].nunique())
+    col_stat4.metric("اليوم", int(today_rows['event_count'].sum()))
     
     # Export functionality
     if st.session_state.get('export_log', False):
@@ -212,84 +219,62 @@ def show_activity_log_page():
     st.divider()
     
     # Display activities
-    st.subheader("📜 السجلات")
+    page_number = len(cursors)
+    st.subheader(f"📜 السجلات - صفحة {page_number}")
     
-    # Group by date
-    df_activities['date'] = pd.to_datetime(df_activities['timestamp']).dt.date
+    full_names = {u['username']: u['full_name'] for u in all_users}
+    action_icons = {
+        'create': '🟢', 'update': '🟡', 'delete': '🔴', 'login': '🔵', 'logout': '⚪'
+    }
     
-    for date in sorted(df_activities['date'].unique(), reverse=True):
-        date_activities = df_activities[df_activities['date'] == date]
-        
-        with st.expander(f"📅 {date} - {len(date_activities)} إجراء", expanded=(date == datetime.now().date())):
-            for _, activity in date_activities.iterrows():
-                with st.container(border=True):
-                    # Parse timestamp
-                    timestamp = datetime.fromisoformat(activity['timestamp'])
-                    
-                    # Create columns
-                    col_time, col_user, col_action, col_module = st.columns([2, 2, 2, 2])
-                    
-                    # Time
-                    with col_time:
-                        st.markdown(f"**⏰ {timestamp.strftime('%H:%M:%S')}**")
-                    
-                    # User
-                    with col_user:
-                        user_info = next((u for u in all_users if u['username'] == activity['username']), None)
-                        user_display = user_info['full_name'] if user_info else activity['username']
-                        st.markdown(f"👤 **{user_display}**")
-                    
-                    # Action
-                    with col_action:
-                        action_display = action_names.get(activity['action_type'], activity['action_type'])
-                        
-                        # Color code by action type
-                        if activity['action_type'] == 'create':
-                            st.markdown(f"🟢 {action_display}")
-                        elif activity['action_type'] == 'update':
-                            st.markdown(f"🟡 {action_display}")
-                        elif activity['action_type'] == 'delete':
-                            st.markdown(f"🔴 {action_display}")
-                        elif activity['action_type'] == 'login':
-                            st.markdown(f"🔵 {action_display}")
-                        elif activity['action_type'] == 'logout':
-                            st.markdown(f"⚪ {action_display}")
-                        else:
-                            st.markdown(f"⚫ {action_display}")
-                    
-                    # Module
-                    with col_module:
-                        module_display = module_names.get(activity['module'], activity['module'])
-                        st.markdown(f"📁 {module_display}")
-                    
-                    # Description
-                    st.markdown(f"**الوصف:** {activity['description']}")
-                    
-                    # Show details if available
-                    if activity.get('old_data') or activity.get('new_data'):
-                        with st.expander("📝 التفاصيل"):
-                            col_old, col_new = st.columns(2)
-                            
-                            if activity.get('old_data'):
-                                with col_old:
-                                    st.markdown("**البيانات القديمة:**")
-                                    try:
-                                        old_data = json.loads(activity['old_data'])
-                                        st.json(old_data)
-                                    except:
-                                        st.text(activity['old_data'])
-                            
-                            if activity.get('new_data'):
-                                with col_new:
-                                    st.markdown("**البيانات الجديدة:**")
-                                    try:
-                                        new_data = json.loads(activity['new_data'])
-                                        st.json(new_data)
-                                    except:
-                                        st.text(activity['new_data'])
+    # One table for the page instead of a container per row
+    display_df = pd.DataFrame({
+        'الوقت': df_activities['timestamp'],
+        'المستخدم': df_activities['username'].map(lambda u: full_names.get(u, u)),
+        'الإجراء': df_activities['action_type'].map(
+            lambda a: f"{action_icons.get(a, '⚫')} {action_names.get(a, a)}"
+        ),
+        'القسم': df_activities['module'].map(lambda m: module_names.get(m, m)),
+        'الوصف': df_activities['description'],
+    })
+    st.dataframe(display_df, use_container_width=True, hide_index=True)
+    
+    # Pagination
+    col_prev, col_page, col_next = st.columns([1, 2, 1])
+    if col_prev.button("⬅️ السابق", disabled=page_number == 1, use_container_width=True):
+        cursors.pop()
+        st.rerun()
+    col_page.caption(f"صفحة {page_number} - {len(activities)} سجل")
+    if col_next.button("التالي ➡️", disabled=len(activities) < limit, use_container_width=True):
+        last = activities[-1]
+        cursors.append((last['timestamp'], last['id']))
+        st.rerun()
+    
+    # Details of rows with old/new data
+    detailed = df_activities[df_activities['old_data'].notna() | df_activities['new_data'].notna()]
+    if not detailed.empty:
+        with st.expander("📝 التفاصيل"):
+            detail_id = st.selectbox(
+                "اختر السجل",
+                detailed['id'].tolist(),
+                format_func=lambda i: f"{detailed.loc[detailed['id'] == i, 'timestamp'].iloc[0]} - "
+                                      f"{detailed.loc[detailed['id'] == i, 'description'].iloc[0]}"
+            )
+            activity = detailed[detailed['id'] == detail_id].iloc[0]
+            col_old, col_new = st.columns(2)
+            
+            for col, key, title in ((col_old, 'old_data', "**البيانات القديمة:**"),
+                                    (col_new, 'new_data', "**البيانات الجديدة:**")):
+                if pd.notna(activity[key]) and activity[key]:
+                    with col:
+                        st.markdown(title)
+                        try:
+                            st.json(json.loads(activity[key]))
+                        except:
+                            st.text(activity[key])
     
     # =========================================================================
-    #                    SUMMARY CHARTS
+    #                    SUMMARY CHARTS (from rollups)
     # =========================================================================
     
     st.divider()
@@ -299,25 +284,22 @@ def show_activity_log_page():
     
     with col_chart1:
         st.markdown("**الإجراءات حسب النوع**")
-        action_counts_arabic = action_counts.copy()
-        action_counts_arabic.index = action_counts_arabic.index.map(action_names)
-        st.bar_chart(action_counts_arabic)
+        action_counts = daily_rollup.groupby('action_type')['event_count'].sum().sort_values(ascending=False)
+        action_counts.index = action_counts.index.map(lambda a: action_names.get(a, a))
+        st.bar_chart(action_counts)
     
     with col_chart2:
         st.markdown("**النشاط حسب المستخدم**")
-        user_counts = df_activities['username'].value_counts().head(10)
+        user_counts = daily_rollup.groupby('username')['event_count'].sum().nlargest(10)
         
         # Map to full names
-        user_counts_named = user_counts.copy()
-        for username in user_counts_named.index:
-            user_info = next((u for u in all_users if u['username'] == username), None)
-            if user_info:
-                user_counts_named = user_counts_named.rename({username: user_info['full_name']})
-        
-        st.bar_chart(user_counts_named)
+        user_counts.index = user_counts.index.map(lambda u: full_names.get(u, u))
+        st.bar_chart(user_counts)
     
     # Timeline chart
     st.markdown("**📈 النشاط بمرور الوقت**")
-    df_activities['hour'] = pd.to_datetime(df_activities['timestamp']).dt.hour
-    hourly_counts = df_activities.groupby('hour').size()
-    st.line_chart(hourly_counts)
+    hourly_rollup = pd.DataFrame(auth.get_activity_rollup('hourly', **filters))
+    if not hourly_rollup.empty:
+        hourly_counts = hourly_rollup.groupby('bucket')['event_count'].sum()
+        hourly_counts.index = pd.to_datetime(hourly_counts.index)
+        st.line_chart(hourly_counts)
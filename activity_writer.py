@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+"""
+Activity Writer - Background batched writes for activity and audit events
+Features:
+- Events are queued in memory instead of written on the UI thread
+- One executemany per table per batch, flushed on a size or time trigger
+- Back-pressure: producers wait briefly when the queue is full, then write synchronously
+- A failed batch is retried row by row; rows the database could not take are spilled
+  to a JSON-lines file and replayed after the next good write
+- Rows rejected on their own (constraint or type errors) are quarantined, never replayed
+- Graceful flush on interpreter shutdown
+"""
+
+import atexit
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, List, Tuple
+
+from constants import (
+    ACTIVITY_QUEUE_SIZE,
+    ACTIVITY_BATCH_SIZE,
+    ACTIVITY_FLUSH_SECONDS,
+    ACTIVITY_PUT_TIMEOUT_SECONDS,
+    ACTIVITY_SPILL_SUFFIX,
+    ACTIVITY_QUARANTINE_SUFFIX,
+)
+
+# Tables the writer may insert into
+ALLOWED_TABLES = ('activity_log', 'audit_log')
+
+# activity_log rollups maintained on write: table -> (timestamp prefix length, bucket suffix)
+ACTIVITY_ROLLUPS = {
+    'activity_rollup_hourly': (13, ':00:00'),  # 'YYYY-MM-DD HH:00:00'
+    'activity_rollup_daily': (10, ''),         # 'YYYY-MM-DD'
+}
+
+# Rollup key value of a missing username/module/action_type (the rollup key columns are NOT NULL)
+ROLLUP_UNKNOWN = 'unknown'
+
+# Queued by close() to end the writer's idle wait, never written
+_WAKE = object()
+
+_REGISTRY: Dict[str, "ActivityWriter"] = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+class ActivityWriter:
+    """Queue activity/audit rows and insert them in batches on a background thread"""
+
+    def __init__(self, db_name: str):
+        self.db_name = db_name
+        self.spill_path = db_name + ACTIVITY_SPILL_SUFFIX
+        self.quarantine_path = db_name + ACTIVITY_QUARANTINE_SUFFIX
+        self._spill_lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=ACTIVITY_QUEUE_SIZE)
+        self._flush_requested = threading.Event()
+        self._flushed = threading.Condition()
+        self._submitted = 0
+        self._written = 0
+        self._closed = False
+        # Wall-clock time of the last write attempt, used for idle detection
+        self.last_activity = 0.0
+        self._thread = threading.Thread(target=self._loop, name="a1-activity-writer", daemon=True)
+        self._thread.start()
+
+    # =========================================================================
+    #                         PRODUCERS
+    # =========================================================================
+
+    def submit(self, table: str, row: Dict[str, Any]):
+        """Queue one row for insertion; never drops the event"""
+        if table not in ALLOWED_TABLES:
+            raise ValueError(f"Unknown activity table: {table}")
+
+        item = (table, tuple(row.keys()), tuple(row.values()))
+        if self._closed:
+            self._write([item])
+            return
+
+        try:
+            self._queue.put(item, timeout=ACTIVITY_PUT_TIMEOUT_SECONDS)
+        except queue.Full:
+            # Back-pressure: the writer is behind, write this event ourselves
+            self._write([item])
+            return
+        with self._flushed:
+            self._submitted += 1
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Wait until everything queued so far has been written"""
+        with self._flushed:
+            target = self._submitted
+        deadline = time.monotonic() + timeout
+        self._flush_requested.set()
+        with self._flushed:
+            while self._written < target:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._flushed.wait(remaining)
+        return True
+
+    def close(self):
+        """Stop accepting queued events and write whatever is left"""
+        if self._closed:
+            return
+        self._closed = True
+        self._flush_requested.set()
+        try:
+            # Wake the writer from its idle wait instead of joining for up to ACTIVITY_FLUSH_SECONDS
+            self._queue.put_nowait(_WAKE)
+        except queue.Full:
+            pass
+        self._thread.join(timeout=10)
+        self._write(self._drain())
+
+    # =========================================================================
+    #                         WRITER THREAD
+    # =========================================================================
+
+    def _drain(self, limit: int = None) -> List[Tuple]:
+        """Take up to limit queued items without blocking"""
+        items = []
+        while limit is None or len(items) < limit:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _WAKE:
+                items.append(item)
+        return items
+
+    def _loop(self):
+        """Collect a batch until it is full or ACTIVITY_FLUSH_SECONDS passed, then write it"""
+        self._replay_spilled()
+        while not self._closed:
+            try:
+                first = self._queue.get(timeout=ACTIVITY_FLUSH_SECONDS)
+            except queue.Empty:
+                continue
+            if first is _WAKE:
+                continue
+
+            batch = [first]
+            deadline = time.monotonic() + ACTIVITY_FLUSH_SECONDS
+            while len(batch) < ACTIVITY_BATCH_SIZE and not self._flush_requested.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=min(remaining, 0.05))
+                except queue.Empty:
+                    continue
+                if item is not _WAKE:
+                    batch.append(item)
+            batch.extend(self._drain(ACTIVITY_BATCH_SIZE - len(batch)))
+            if self._queue.empty():
+                self._flush_requested.clear()
+
+            if self._write(batch):
+                self._replay_spilled()
+            with self._flushed:
+                self._written += len(batch)
+                self._flushed.notify_all()
+
+    def _write(self, items: List[Tuple]) -> bool:
+        """
+        Insert items grouped by table and columns, one executemany per group
+
+        When the batch fails it is retried row by row: good rows are written,
+        rows rejected on their own go to quarantine_path (never replayed), and
+        rows that could not reach the database are spilled to spill_path.
+        Returns whether the database took the items (nothing was spilled).
+        """
+        if not items:
+            return True
+
+        self.last_activity = time.time()
+        try:
+            with sqlite3.connect(self.db_name, timeout=30) as conn:
+                self._insert(conn, items)
+                conn.commit()
+        except Exception as e:
+            print(f"Activity writer error: {e} (retrying {len(items)} event(s) one by one)")
+            return self._write_each(items)
+        return True
+
+    def _write_each(self, items: List[Tuple]) -> bool:
+        """Insert items one transaction each; returns whether none of them had to be spilled"""
+        written = 0
+        rejected: List[Tuple] = []
+        unwritten: List[Tuple] = []
+        try:
+            conn = sqlite3.connect(self.db_name, timeout=30)
+        except sqlite3.Error as e:
+            print(f"Activity writer error: {e} ({len(items)} event(s) kept in {self.spill_path})")
+            self._spill(items)
+            return False
+
+        try:
+            for item in items:
+                try:
+                    self._insert(conn, [item])
+                    conn.commit()
+                    written += 1
+                except sqlite3.OperationalError as e:
+                    # Locked, busy or I/O: the database, not the row, is at fault
+                    conn.rollback()
+                    unwritten.append((item, e))
+                except Exception as e:
+                    conn.rollback()
+                    rejected.append((item, e))
+        finally:
+            conn.close()
+
+        if written and unwritten:
+            # Other rows went through, so these failed on their own
+            rejected.extend(unwritten)
+            unwritten = []
+        if rejected:
+            print(f"Activity writer rejected {len(rejected)} event(s), kept in {self.quarantine_path}")
+            self._quarantine(rejected)
+        if unwritten:
+            print(f"Activity writer error: {unwritten[0][1]} "
+                  f"({len(unwritten)} event(s) kept in {self.spill_path})")
+            self._spill([item for item, _ in unwritten])
+        return not unwritten
+
+    def _insert(self, conn, items: List[Tuple]):
+        """Run the inserts and rollup updates of items on conn without committing"""
+        groups: Dict[Tuple[str, Tuple], List[Tuple]] = {}
+        for table, columns, values in items:
+            groups.setdefault((table, columns), []).append(values)
+
+        for (table, columns), rows in groups.items():
+            placeholders = ", ".join("?" * len(columns))
+            conn.executemany(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
+                rows
+            )
+            if table == 'activity_log':
+                self._update_rollups(conn, columns, rows)
+
+    def _spill(self, items: List[Tuple]):
+        """Append items to the spill file, one JSON object per line"""
+        self._append_jsonl(self.spill_path, [
+            {'table': table, 'columns': columns, 'values': values}
+            for table, columns, values in items
+        ])
+
+    def _quarantine(self, rejected: List[Tuple]):
+        """Append rejected items and their errors to the quarantine file, which is never replayed"""
+        self._append_jsonl(self.quarantine_path, [
+            {'table': table, 'columns': columns, 'values': values, 'error': str(error)}
+            for (table, columns, values), error in rejected
+        ])
+
+    def _append_jsonl(self, path: str, records: List[Dict[str, Any]]):
+        """Append records to path, one JSON object per line"""
+        lines = "".join(json.dumps(record, ensure_ascii=False, default=str) + "\n" for record in records)
+        try:
+            with self._spill_lock, open(path, "a", encoding="utf-8") as f:
+                f.write(lines)
+        except OSError as e:
+            # Last resort: the events end up in the server log
+            print(f"Activity writer could not save events to {path} ({e}):\n{lines}")
+
+    def _replay_spilled(self):
+        """Write spilled events back to the database (rows that still cannot reach it are spilled again)"""
+        if not os.path.exists(self.spill_path):
+            return
+        # Claim the file so another process replaying it does not write the events twice
+        claimed = f"{self.spill_path}.{os.getpid()}"
+        try:
+            with self._spill_lock:
+                os.replace(self.spill_path, claimed)
+        except OSError:
+            return
+        with open(claimed, encoding="utf-8") as f:
+            items = [(row['table'], tuple(row['columns']), tuple(row['values']))
+                     for row in map(json.loads, filter(str.strip, f))]
+        self._write(items)
+        os.remove(claimed)
+
+    @staticmethod
+    def _update_rollups(conn, columns: Tuple, rows: List[Tuple]):
+        """Add a batch of activity_log rows to the hourly and daily rollups, one executemany each"""
+        for table, (prefix, suffix) in ACTIVITY_ROLLUPS.items():
+            counts: Dict[Tuple, int] = {}
+            for values in rows:
+                row = dict(zip(columns, values))
+                # A row without timestamp gets the column default, datetime('now') in UTC
+                timestamp = row.get('timestamp') or time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+                bucket = timestamp[:prefix] + suffix
+                key = (bucket,) + tuple(
+                    row.get(column) or ROLLUP_UNKNOWN for column in ('username', 'module', 'action_type')
+                )
+                counts[key] = counts.get(key, 0) + 1
+
+            conn.executemany(f"""
+                INSERT INTO {table} (bucket, username, module, action_type, event_count)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(bucket, username, module, action_type) DO UPDATE SET
+                    event_count = event_count + excluded.event_count
+            """, [key + (count,) for key, count in counts.items()])
+
+
+def get_activity_writer(db_name: str) -> ActivityWriter:
+    """Return the process-wide activity writer of a database file"""
+    key = os.path.abspath(db_name)
+    with _REGISTRY_LOCK:
+        writer = _REGISTRY.get(key)
+        if writer is None:
+            writer = _REGISTRY[key] = ActivityWriter(db_name)
+            atexit.register(writer.close)
+        return writer
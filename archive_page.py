@@ -2,35 +2,70 @@
 import streamlit as st
 import json
 import os
-from fpdf import FPDF
 from datetime import datetime
-from arabic_reshaper import reshape
-from bidi.algorithm import get_display
+
+import pandas as pd
+
+from constants import ARCHIVE_PAGE_SIZE, ARCHIVE_ATTACHMENT_BATCH, get_max_file_size_mb
 
 
 def show_archive_page(db):
     st.header("📂 أرشيف الحالات")
 
-    df = db.run_query("SELECT * FROM cases ORDER BY id DESC")
-    
-    if df.empty:
-        st.info("لا توجد حالات مسجلة حالياً.")
-        return
-
     col1, col2 = st.columns(2)
     search_patient = col1.text_input("🔍 بحث باسم المريض")
     search_doctor = col2.text_input("👨‍⚕️ بحث باسم الدكتور أو المركز")
 
+    query = "SELECT * FROM cases WHERE 1=1"
+    params = []
     if search_patient:
-        df = df[df['patient'].str.contains(search_patient, case=False, na=False)]
+        query += " AND patient LIKE ?"
+        params.append(f"%{search_patient}%")
     if search_doctor:
-        df = df[
-            df['doctor'].str.contains(search_doctor, case=False, na=False) | 
-            df['dental_center'].fillna('').str.contains(search_doctor, case=False, na=False)
-        ]
+        query += " AND (doctor LIKE ? OR dental_center LIKE ?)"
+        params.extend([f"%{search_doctor}%"] * 2)
+
+    # Keyset pagination: a stack of case id cursors, reset when the search changes
+    filters_key = (search_patient, search_doctor)
+    if st.session_state.get('archive_filters_key') != filters_key:
+        st.session_state.archive_filters_key = filters_key
+        st.session_state.archive_cursors = [None]
+    cursors = st.session_state.archive_cursors
+
+    if cursors[-1] is not None:
+        query += " AND id < ?"
+        params.append(cursors[-1])
+    query += " ORDER BY id DESC LIMIT ?"
+    params.append(ARCHIVE_PAGE_SIZE)
+    df = db.run_query(query, tuple(params))
+
+    if df.empty and len(cursors) == 1:
+        st.info("لا توجد حالات مسجلة حالياً.")
+        return
 
     st.divider()
 
+    # Attachments of this page's cases only, in bounded batches instead of one query per expander
+    batches = []
+    before_id = None
+    while True:
+        batch = db.attachments.get_case_attachments(
+            case_codes=list(df['case_code']), limit=ARCHIVE_ATTACHMENT_BATCH, before_id=before_id
+        )
+        batches.append(batch)
+        if len(batch) < ARCHIVE_ATTACHMENT_BATCH:
+            break
+        before_id = int(batch['id'].iloc[-1])
+    all_attachments = pd.concat(batches, ignore_index=True)
+    attachments_by_case = {
+        code: group for code, group in all_attachments.groupby('case_code')
+    }
+    # Thumbnails already rendered by the preview worker, missing ones show as names only
+    thumbnails = db.attachments.previews.get_previews(all_attachments['sha256'].unique(), 'thumb')
+    scan_metadata = db.attachments.meshes.get_metadata(all_attachments['sha256'].unique())
+    # For scans the 'pdf' preview is the strip of fixed-angle views
+    scan_views = db.attachments.previews.get_previews(list(scan_metadata), 'pdf')
+
     for index, row in df.iterrows():
         entity_display = row['dental_center'] if row['dental_center'] else row['doctor']
         branch_info = f" - {row['branch_name']}" if row.get('branch_name') else ""
@@ -100,18 +135,44 @@ def show_archive_page(db):
                     key=f"file_{row['case_code']}"
                 )
                 if new_file and st.button("حفظ الملف", key=f"btn_{row['case_code']}"):
-                    path = os.path.abspath(os.path.join("uploads", f"{row['case_code']}_{new_file.name}"))
-                    with open(path, "wb") as f:
-                        f.write(new_file.getbuffer())
-                    db.run_action(
-                        "UPDATE cases SET attachment = ? WHERE case_code = ?",
-                        (path, row['case_code'])
-                    )
-                    st.rerun()
+                    try:
+                        blob = db.attachments.store(new_file, new_file.name)
+                    except ValueError:
+                        st.error(f"❌ حجم الملف أكبر من {get_max_file_size_mb(new_file.name)} ميجابايت")
+                    else:
+                        db.attachments.link(
+                            row['case_code'], blob, new_file.name, st.session_state.get('username')
+                        )
+                        st.rerun()
                 
-                if row['attachment'] and os.path.exists(row['attachment']):
-                    st.write("**📎 ملف مرفق:**")
-                    st.write(os.path.basename(row['attachment']))
+                attachments = attachments_by_case.get(row['case_code'])
+                if attachments is not None:
+                    st.write("**📎 ملفات مرفقة:**")
+                    gallery = attachments[attachments['sha256'].isin(thumbnails)]
+                    if not gallery.empty:
+                        st.image(
+                            [thumbnails[sha256] for sha256 in gallery['sha256']],
+                            caption=list(gallery['original_name']),
+                            width=120
+                        )
+                    for _, att in attachments.iterrows():
+                        st.write(f"{att['original_name']} ({att['size'] / 1024:,.0f} KB)")
+                        # Read only after an explicit click; files in cold storage are unpacked then
+                        prepared_key = f"download_ready_{att['id']}"
+                        if st.session_state.get(prepared_key):
+                            st.download_button(
+                                "⬇️ تحميل",
+                                data=db.attachments.read_blob(att['sha256']),
+                                file_name=att['original_name'] or os.path.basename(att['path']),
+                                key=f"download_{att['id']}"
+                            )
+                        elif st.button("📦 تجهيز التحميل", key=f"prepare_{att['id']}"):
+                            st.session_state[prepared_key] = True
+                            st.rerun()
+                        if att['sha256'] in scan_metadata:
+                            show_scan_metadata(scan_metadata[att['sha256']])
+                            if att['sha256'] in scan_views:
+                                st.image(scan_views[att['sha256']])
 
             st.divider()
 
@@ -133,9 +194,48 @@ def show_archive_page(db):
                 db.run_action("DELETE FROM cases WHERE case_code = ?", (row['case_code'],))
                 st.rerun()
 
+    # Pagination
+    col_prev, col_page, col_next = st.columns([1, 2, 1])
+    if col_prev.button("⬅️ السابق", disabled=len(cursors) == 1, use_container_width=True):
+        cursors.pop()
+        st.rerun()
+    col_page.caption(f"صفحة {len(cursors)} - {len(df)} حالة")
+    if col_next.button("التالي ➡️", disabled=len(df) < ARCHIVE_PAGE_SIZE, use_container_width=True):
+        cursors.append(int(df['id'].iloc[-1]))
+        st.rerun()
+
+
+def show_scan_metadata(meta):
+    """Quality summary of an analyzed STL/OBJ scan"""
+    if meta['error']:
+        st.caption(f"⚠️ تعذر تحليل الملف: {meta['error']}")
+        return
+    if not meta['triangle_count']:
+        st.caption("⚠️ الملف لا يحتوي على مثلثات")
+        return
+
+    size_x = meta['max_x'] - meta['min_x']
+    size_y = meta['max_y'] - meta['min_y']
+    size_z = meta['max_z'] - meta['min_z']
+    if meta['is_watertight']:
+        closed = "✅ مغلق (Watertight)"
+    else:
+        closed = f"⚠️ غير مغلق ({meta['boundary_edges']} حافة مفتوحة، {meta['nonmanifold_edges']} غير منتظمة)"
+
+    st.caption(
+        f"🧊 {meta['triangle_count']:,} مثلث | "
+        f"الأبعاد: {size_x:.1f} × {size_y:.1f} × {size_z:.1f} مم | "
+        f"المساحة: {meta['surface_area']:,.0f} مم² | "
+        f"الحجم: {meta['volume']:,.0f} مم³ | {closed}"
+    )
+
 
 def generate_detailed_pdf(row, db):
     """Generate comprehensive PDF report with all case details"""
+    # The PDF stack is only loaded once a report is actually requested
+    from fpdf import FPDF
+    from arabic_reshaper import reshape
+    from bidi.algorithm import get_display
     
     pdf = FPDF()
     pdf.add_page()
@@ -357,7 +457,13 @@ def generate_detailed_pdf(row, db):
         pdf.ln(5)
 
     # IMAGE
-    if row['attachment'] and os.path.exists(row['attachment']):
+    # Small pre-rendered JPEG instead of decoding the original upload, looked up once
+    # (cold-stored attachments have no file on disk but keep their previews)
+    try:
+        preview = db.attachments.previews.ensure_for_path(row['attachment'], 'pdf') if row['attachment'] else None
+    except Exception:
+        preview = None
+    if row['attachment'] and (preview or os.path.exists(row['attachment'])):
         if font_loaded:
             pdf.set_font("DejaVu", 'B', 11)
         else:
@@ -367,11 +473,13 @@ def generate_detailed_pdf(row, db):
         pdf.ln(2)
         
         try:
-            if row['attachment'].lower().endswith(('.jpg', '.jpeg', '.png', '.gif')):
+            if preview:
+                # Width fixed, height from the preview's aspect (scan previews are wide strips)
+                top = pdf.get_y()
+                info = pdf.image(preview, x=11, y=top+1, w=80)
                 pdf.set_draw_color(0, 0, 0)
-                pdf.rect(10, pdf.get_y(), 82, 62)
-                pdf.image(row['attachment'], x=11, y=pdf.get_y()+1, w=80, h=60)
-                pdf.ln(65)
+                pdf.rect(10, top, 82, info.rendered_height + 2)
+                pdf.ln(info.rendered_height + 5)
             else:
                 pdf.cell(0, 7, f"File attached: {os.path.basename(row['attachment'])}", 0, 1, 'L')
         except:
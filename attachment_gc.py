@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+Attachment GC - Garbage collection and cold storage for uploads
+Features:
+- Links of deleted cases dropped, unreferenced blobs deleted after a grace period
+- Stray files in the upload folder (pre-store uploads, failed temp files) removed
+- Attachments of long-delivered cases moved into compressed monthly bundles
+- Runs as a task of the scheduled database maintenance (maintenance.py)
+"""
+
+import os
+import sqlite3
+import time
+import zipfile
+from datetime import datetime
+from typing import Dict, List, Set
+
+from constants import (
+    UPLOAD_FOLDER,
+    STATUS_DELIVERED,
+    ATTACHMENT_GC_GRACE_DAYS,
+    ATTACHMENT_COLD_AFTER_MONTHS,
+    ATTACHMENT_COLD_FOLDER,
+)
+from attachment_previews import PreviewGenerator
+from mesh_analyzer import MeshMetadata
+
+
+class AttachmentGC:
+    """Reclaim and tier the files behind the attachment store"""
+
+    def __init__(self, db_name: str, root: str = UPLOAD_FOLDER):
+        self.db_name = db_name
+        self.root = root
+        self.cold_folder = os.path.join(root, ATTACHMENT_COLD_FOLDER)
+        self.grace_seconds = ATTACHMENT_GC_GRACE_DAYS * 24 * 60 * 60
+
+    @staticmethod
+    def _norm(path: str) -> str:
+        """Comparable form of stored paths (relative or absolute, either separator)"""
+        return os.path.normcase(os.path.abspath(path.replace("\\", "/")))
+
+    def _has_store(self, conn) -> bool:
+        """The store creates its tables on first use; nothing to do before that"""
+        return conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'attachment_blobs'"
+        ).fetchone() is not None
+
+    # =========================================================================
+    #                         GARBAGE COLLECTION
+    # =========================================================================
+
+    def _unlink_deleted_cases(self, conn) -> int:
+        """Drop attachment links of cases that no longer exist"""
+        cursor = conn.execute("""
+            DELETE FROM attachments
+            WHERE NOT EXISTS (SELECT 1 FROM cases c WHERE c.case_code = attachments.case_code)
+        """)
+        return cursor.rowcount
+
+    def _collect_blobs(self, conn) -> int:
+        """
+        Mark unreferenced blobs, delete the ones unreferenced for the grace period
+
+        The blob file, its previews and its scan metadata go; a member in a
+        cold bundle stays until the bundle itself is removed.
+        """
+        conn.execute("""
+            UPDATE attachment_blobs SET orphaned_at = NULL
+            WHERE orphaned_at IS NOT NULL
+              AND EXISTS (SELECT 1 FROM attachments a WHERE a.sha256 = attachment_blobs.sha256)
+        """)
+        conn.execute("""
+            UPDATE attachment_blobs SET orphaned_at = datetime('now')
+            WHERE orphaned_at IS NULL
+              AND NOT EXISTS (SELECT 1 FROM attachments a WHERE a.sha256 = attachment_blobs.sha256)
+        """)
+        expired = conn.execute("""
+            SELECT sha256, path FROM attachment_blobs
+            WHERE orphaned_at < datetime('now', ?)
+        """, (f"-{ATTACHMENT_GC_GRACE_DAYS} days",)).fetchall()
+
+        removed = 0
+        for sha256, path in expired:
+            # Re-checked in the delete itself: an upload may have linked it meanwhile
+            deleted = conn.execute("""
+                DELETE FROM attachment_blobs
+                WHERE sha256 = ?
+                  AND NOT EXISTS (SELECT 1 FROM attachments a WHERE a.sha256 = ?)
+            """, (sha256, sha256)).rowcount
+            if not deleted:
+                continue
+            preview_paths = [row[0] for row in conn.execute(
+                "SELECT path FROM attachment_previews WHERE sha256 = ?", (sha256,)
+            ).fetchall()]
+            conn.execute("DELETE FROM attachment_previews WHERE sha256 = ?", (sha256,))
+            conn.execute("DELETE FROM attachment_metadata WHERE sha256 = ?", (sha256,))
+            conn.commit()
+            for file_path in [path] + preview_paths:
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+            removed += 1
+        conn.commit()
+        return removed
+
+    def _known_files(self, conn) -> Set[str]:
+        """Every file the database still points at"""
+        paths = [row[0] for row in conn.execute("""
+            SELECT path FROM attachment_blobs
+            UNION ALL SELECT bundle FROM attachment_blobs WHERE bundle IS NOT NULL
+            UNION ALL SELECT path FROM attachment_previews
+            UNION ALL SELECT attachment FROM cases WHERE attachment IS NOT NULL AND attachment != ''
+        """).fetchall()]
+        return {self._norm(path) for path in paths}
+
+    def _collect_stray_files(self, conn) -> int:
+        """Delete files under the upload folder that nothing references and that are past the grace period"""
+        known = self._known_files(conn)
+        cutoff = time.time() - self.grace_seconds
+        removed = 0
+        for dirpath, dirnames, filenames in os.walk(self.root, topdown=False):
+            for filename in filenames:
+                file_path = os.path.join(dirpath, filename)
+                if self._norm(file_path) in known or os.path.getmtime(file_path) > cutoff:
+                    continue
+                os.remove(file_path)
+                removed += 1
+            # Empty shard directories left behind by deleted blobs
+            if dirpath != self.root and not os.listdir(dirpath) and os.path.basename(dirpath) != "tmp":
+                os.rmdir(dirpath)
+        return removed
+
+    # =========================================================================
+    #                         COLD STORAGE
+    # =========================================================================
+
+    def _cold_candidates(self, conn) -> List[Dict]:
+        """
+        Hot blobs whose every case was delivered more than ATTACHMENT_COLD_AFTER_MONTHS ago
+
+        Blobs still waiting for previews or scan analysis stay hot, the
+        workers read the original.
+        """
+        rows = conn.execute("""
+            SELECT b.sha256, b.path, b.extension,
+                   EXISTS (SELECT 1 FROM attachment_previews p WHERE p.sha256 = b.sha256),
+                   EXISTS (SELECT 1 FROM attachment_metadata m WHERE m.sha256 = b.sha256)
+            FROM attachment_blobs b
+            WHERE b.bundle IS NULL
+              AND EXISTS (SELECT 1 FROM attachments a WHERE a.sha256 = b.sha256)
+              AND NOT EXISTS (
+                  SELECT 1 FROM attachments a
+                  LEFT JOIN cases c ON c.case_code = a.case_code
+                  WHERE a.sha256 = b.sha256
+                    AND NOT (COALESCE(c.status, '') = ?
+                             AND COALESCE(c.delivery_date, '9999-12-31') < date('now', ?))
+              )
+        """, (STATUS_DELIVERED, f"-{ATTACHMENT_COLD_AFTER_MONTHS} months")).fetchall()
+
+        candidates = []
+        for sha256, path, extension, has_previews, has_metadata in rows:
+            if PreviewGenerator.has_previews(extension) and not has_previews:
+                continue
+            if MeshMetadata.is_mesh(extension) and not has_metadata:
+                continue
+            if os.path.exists(path):
+                candidates.append({"sha256": sha256, "path": path})
+        return candidates
+
+    def _archive_cold(self, conn) -> int:
+        """Move cold candidates into this month's bundle, then drop the hot copies"""
+        candidates = self._cold_candidates(conn)
+        if not candidates:
+            return 0
+
+        os.makedirs(self.cold_folder, exist_ok=True)
+        bundle_path = "/".join([
+            self.cold_folder.replace("\\", "/"), f"attachments_{datetime.now().strftime('%Y%m')}.zip"
+        ])
+        with zipfile.ZipFile(bundle_path, "a", compression=zipfile.ZIP_DEFLATED, compresslevel=9) as bundle:
+            existing = set(bundle.namelist())
+            for blob in candidates:
+                member = os.path.basename(blob['path'])
+                if member not in existing:
+                    bundle.write(blob['path'], arcname=member)
+
+        # Only once the bundle is closed: record it, then remove the hot files
+        conn.executemany(
+            "UPDATE attachment_blobs SET bundle = ? WHERE sha256 = ?",
+            [(bundle_path, blob['sha256']) for blob in candidates]
+        )
+        conn.commit()
+        for blob in candidates:
+            os.remove(blob['path'])
+        return len(candidates)
+
+    def _evict_restored(self, conn) -> int:
+        """Remove hot copies that were unpacked from a bundle on access, once past the grace period"""
+        cutoff = time.time() - self.grace_seconds
+        removed = 0
+        for path, bundle in conn.execute(
+            "SELECT path, bundle FROM attachment_blobs WHERE bundle IS NOT NULL"
+        ).fetchall():
+            if os.path.exists(path) and os.path.exists(bundle) and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        return removed
+
+    def run(self) -> str:
+        """One full pass; returns a summary for the maintenance log"""
+        with sqlite3.connect(self.db_name) as conn:
+            if not self._has_store(conn):
+                return "no attachment store"
+            unlinked = self._unlink_deleted_cases(conn)
+            conn.commit()
+            blobs = self._collect_blobs(conn)
+            cold = self._archive_cold(conn)
+            evicted = self._evict_restored(conn)
+            stray = self._collect_stray_files(conn)
+        return (
+            f"unlinked={unlinked}, blobs_deleted={blobs}, stray_files_deleted={stray}, "
+            f"moved_to_cold={cold}, restored_evicted={evicted}"
+        )
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+Attachment Previews - Downscaled renders of attachments, made once per blob
+Features:
+- JPEG thumbnails for the archive gallery and PDF-sized images for reports
+- Decimated fixed-angle PNG renders of STL/OBJ scans (mesh_preview.py)
+- Rendered on a background worker, never on the upload request
+- Cached by content hash: identical uploads share their previews
+- attachment_previews table so pages find previews without touching the originals
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+from typing import Dict, Iterable, Optional
+
+from PIL import Image, ImageOps
+
+from mesh_analyzer import MeshMetadata
+from constants import (
+    ALLOWED_IMAGE_EXTENSIONS,
+    THUMBNAIL_SIZE,
+    PDF_PREVIEW_SIZE,
+    PREVIEW_JPEG_QUALITY,
+)
+
+# Preview kinds rendered for image attachments: kind -> bounding box
+IMAGE_PREVIEW_SIZES = {
+    'thumb': THUMBNAIL_SIZE,
+    'pdf': PDF_PREVIEW_SIZE,
+}
+
+IMAGE_EXTENSIONS = tuple(f".{ext}" for ext in ALLOWED_IMAGE_EXTENSIONS)
+
+
+class PreviewGenerator:
+    """Queue blobs and render their previews on a worker thread"""
+
+    def __init__(self, db_name: str, root: str):
+        self.db_name = db_name
+        self.root = os.path.join(root, "previews")
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self._init_tables()
+        self._thread = threading.Thread(target=self._loop, name="a1-preview-worker", daemon=True)
+        self._thread.start()
+
+    def _init_tables(self):
+        """Create the preview table"""
+        with sqlite3.connect(self.db_name) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS attachment_previews (
+                    sha256 TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    width INTEGER,
+                    height INTEGER,
+                    created_at TEXT DEFAULT (datetime('now')),
+                    PRIMARY KEY (sha256, kind)
+                )
+            """)
+            conn.commit()
+
+    @staticmethod
+    def has_previews(extension: str) -> bool:
+        """Whether blobs of this extension get previews"""
+        return (extension or "").lower() in IMAGE_EXTENSIONS or MeshMetadata.is_mesh(extension)
+
+    # =========================================================================
+    #                         QUEUE
+    # =========================================================================
+
+    def submit(self, sha256: str, source_path: str, extension: str):
+        """Queue a blob for rendering; duplicates and unsupported types are ignored"""
+        if not self.has_previews(extension):
+            return
+        with self._pending_lock:
+            if sha256 in self._pending:
+                return
+            self._pending.add(sha256)
+        self._queue.put((sha256, source_path, extension))
+
+    def submit_missing(self):
+        """Queue every stored blob that has no previews yet"""
+        with sqlite3.connect(self.db_name) as conn:
+            rows = conn.execute("""
+                SELECT b.sha256, b.path, b.extension
+                FROM attachment_blobs b
+                WHERE NOT EXISTS (SELECT 1 FROM attachment_previews p WHERE p.sha256 = b.sha256)
+            """).fetchall()
+        for sha256, path, extension in rows:
+            self.submit(sha256, path, extension)
+
+    def _loop(self):
+        """Render queued blobs one at a time"""
+        while True:
+            sha256, source_path, extension = self._queue.get()
+            try:
+                self.render(sha256, source_path, extension)
+            except Exception as e:
+                print(f"Preview error ({sha256[:12]}): {e}")
+            finally:
+                with self._pending_lock:
+                    self._pending.discard(sha256)
+
+    # =========================================================================
+    #                         RENDERING
+    # =========================================================================
+
+    def preview_path(self, sha256: str, kind: str, extension: str = ".jpg") -> str:
+        """Location of a preview: <root>/previews/ab/<sha256>_<kind><ext>"""
+        return "/".join([self.root.replace("\\", "/"), sha256[:2], f"{sha256}_{kind}{extension}"])
+
+    @staticmethod
+    def _image_previews(source_path: str) -> Dict[str, Image.Image]:
+        """Downscaled copies of an image attachment, kind -> image"""
+        with Image.open(source_path) as original:
+            # Decode JPEGs at reduced size straight away, the largest preview is enough
+            original.draft("RGB", max(IMAGE_PREVIEW_SIZES.values()))
+            image = ImageOps.exif_transpose(original)
+            if image.mode != "RGB":
+                # Flatten transparency onto white instead of black
+                background = Image.new("RGB", image.size, (255, 255, 255))
+                rgba = image.convert("RGBA")
+                background.paste(rgba, mask=rgba.getchannel("A"))
+                image = background
+
+            previews = {}
+            for kind, size in IMAGE_PREVIEW_SIZES.items():
+                previews[kind] = image.copy()
+                previews[kind].thumbnail(size, Image.LANCZOS)
+        return previews
+
+    def render(self, sha256: str, source_path: str, extension: str) -> Dict[str, str]:
+        """Render all preview kinds of a blob and record them, kind -> path"""
+        if not self.has_previews(extension) or not os.path.exists(source_path):
+            return {}
+
+        if MeshMetadata.is_mesh(extension):
+            # matplotlib is only imported once a scan actually needs rendering
+            from mesh_preview import render_mesh_previews
+            # Fixed-angle renders of 3D scans are kept lossless
+            previews, file_extension = render_mesh_previews(source_path), ".png"
+        else:
+            previews, file_extension = self._image_previews(source_path), ".jpg"
+
+        rendered = {}
+        rows = []
+        for kind, preview in previews.items():
+            path = self.preview_path(sha256, kind, file_extension)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            if file_extension == ".png":
+                preview.save(tmp_path, "PNG", optimize=True)
+            else:
+                preview.save(tmp_path, "JPEG", quality=PREVIEW_JPEG_QUALITY, optimize=True)
+            os.replace(tmp_path, path)
+            rendered[kind] = path
+            rows.append((sha256, kind, path, preview.width, preview.height))
+
+        with sqlite3.connect(self.db_name) as conn:
+            conn.executemany("""
+                INSERT INTO attachment_previews (sha256, kind, path, width, height)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(sha256, kind) DO UPDATE SET
+                    path = excluded.path, width = excluded.width, height = excluded.height
+            """, rows)
+            conn.commit()
+        return rendered
+
+    # =========================================================================
+    #                         LOOKUP
+    # =========================================================================
+
+    def get_previews(self, sha256s: Iterable[str], kind: str) -> Dict[str, str]:
+        """sha256 -> preview path for the blobs whose preview of this kind is ready"""
+        sha256s = list(sha256s)
+        if not sha256s:
+            return {}
+        placeholders = ", ".join("?" * len(sha256s))
+        with sqlite3.connect(self.db_name) as conn:
+            rows = conn.execute(
+                f"SELECT sha256, path FROM attachment_previews WHERE kind = ? AND sha256 IN ({placeholders})",
+                [kind] + sha256s
+            ).fetchall()
+        return {sha256: path for sha256, path in rows if os.path.exists(path)}
+
+    def ensure_for_path(self, source_path: str, kind: str) -> Optional[str]:
+        """
+        Preview of the blob stored at source_path, rendered now if the worker
+        has not got to it yet; None for unknown blobs and non-image files
+        """
+        with sqlite3.connect(self.db_name) as conn:
+            row = conn.execute(
+                "SELECT sha256, extension FROM attachment_blobs WHERE path = ?", (source_path,)
+            ).fetchone()
+        if not row:
+            return None
+
+        sha256, extension = row
+        ready = self.get_previews([sha256], kind)
+        if sha256 in ready:
+            return ready[sha256]
+        return self.render(sha256, source_path, extension).get(kind)
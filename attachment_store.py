@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+Attachment Store - Content-addressed storage for case attachments
+Features:
+- Uploads streamed to disk in chunks while being hashed (SHA-256)
+- One copy per content hash under a sharded directory (uploads/ab/cd/<sha256>.ext)
+- Size limit (larger for 3D scans) enforced while streaming, never on a fully loaded file
+- attachments table linking cases to blobs, blob paths stored relative
+- One-off import of legacy per-case upload paths
+- New blobs handed to the preview worker (attachment_previews.py) and,
+  for 3D scans, the mesh analyzer (mesh_analyzer.py)
+- Blobs moved to cold bundles (attachment_gc.py) unpacked transparently on access
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import uuid
+import zipfile
+from typing import Any, BinaryIO, Dict, Optional, Sequence
+
+import pandas as pd
+
+from attachment_previews import PreviewGenerator
+from mesh_analyzer import MeshMetadata
+from constants import UPLOAD_FOLDER, ATTACHMENT_CHUNK_BYTES, get_max_file_size_mb
+
+_REGISTRY: Dict[str, "AttachmentStore"] = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+class AttachmentStore:
+    """Deduplicating blob store plus the case -> attachment links"""
+
+    def __init__(self, db_name: str, root: str = UPLOAD_FOLDER):
+        self.db_name = db_name
+        self.root = root
+        os.makedirs(os.path.join(self.root, "tmp"), exist_ok=True)
+        self._init_tables()
+        self.previews = PreviewGenerator(db_name, root)
+        self.meshes = MeshMetadata(db_name)
+        self._import_legacy()
+        self.previews.submit_missing()
+        self.meshes.submit_missing()
+
+    def _init_tables(self):
+        """Create blob and link tables"""
+        with sqlite3.connect(self.db_name) as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS attachment_blobs (
+                    sha256 TEXT PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    extension TEXT,
+                    created_at TEXT DEFAULT (datetime('now'))
+                )
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS attachments (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    case_code TEXT NOT NULL,
+                    sha256 TEXT NOT NULL REFERENCES attachment_blobs(sha256),
+                    original_name TEXT,
+                    uploaded_by TEXT,
+                    created_at TEXT DEFAULT (datetime('now'))
+                )
+            """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_attachments_case ON attachments(case_code)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_attachments_sha ON attachments(sha256)")
+            
+            # Garbage collection / cold storage state (attachment_gc.py)
+            for col_name in ("orphaned_at", "bundle"):
+                try:
+                    cursor.execute(f"ALTER TABLE attachment_blobs ADD COLUMN {col_name} TEXT")
+                except sqlite3.OperationalError:
+                    pass
+            conn.commit()
+
+    def _import_legacy(self):
+        """Copy cases.attachment files written before the store into it (once per case)"""
+        with sqlite3.connect(self.db_name) as conn:
+            rows = conn.execute("""
+                SELECT c.case_code, c.attachment
+                FROM cases c
+                WHERE c.attachment IS NOT NULL AND c.attachment != ''
+                  AND NOT EXISTS (SELECT 1 FROM attachments a WHERE a.case_code = c.case_code)
+            """).fetchall()
+
+        for case_code, legacy_path in rows:
+            # Older uploads were saved with Windows separators or absolute paths
+            path = legacy_path.replace("\\", "/")
+            if not os.path.exists(path):
+                continue
+            try:
+                with open(path, "rb") as f:
+                    blob = self.store(f, os.path.basename(path))
+                self.link(case_code, blob, os.path.basename(path))
+            except (OSError, ValueError) as e:
+                print(f"Attachment import error ({case_code}): {e}")
+
+    # =========================================================================
+    #                         BLOBS
+    # =========================================================================
+
+    def blob_path(self, sha256: str, extension: str = "") -> str:
+        """Sharded location of a blob: <root>/ab/cd/<sha256><ext>"""
+        return "/".join([self.root.replace("\\", "/"), sha256[:2], sha256[2:4], sha256 + extension])
+
+    def store(self, fileobj: BinaryIO, original_name: str = "") -> Dict[str, Any]:
+        """
+        Stream a file object into the store
+
+        Returns {sha256, path, size, is_new}; is_new is False when identical
+        content was already stored. Raises ValueError as soon as more than
+        get_max_file_size_mb(original_name) has been read, the partial temp
+        file is removed.
+        """
+        extension = os.path.splitext(original_name)[1].lower()
+        max_mb = get_max_file_size_mb(original_name)
+        digest = hashlib.sha256()
+        size = 0
+        tmp_path = os.path.join(self.root, "tmp", uuid.uuid4().hex)
+
+        try:
+            with open(tmp_path, "wb") as out:
+                while True:
+                    chunk = fileobj.read(ATTACHMENT_CHUNK_BYTES)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > max_mb * 1024 * 1024:
+                        raise ValueError(f"{original_name or 'file'} is larger than {max_mb} MB")
+                    digest.update(chunk)
+                    out.write(chunk)
+
+            sha256 = digest.hexdigest()
+            existing = self.get_blob(sha256)
+            if existing and os.path.exists(existing['path']):
+                return {"sha256": sha256, "path": existing['path'], "size": existing['size'], "is_new": False}
+
+            path = self.blob_path(sha256, extension)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Atomic: a concurrent upload of the same content simply overwrites identical bytes
+            os.replace(tmp_path, path)
+            # Known content that only survived in a cold bundle (or was about to be
+            # collected) is hot again: otherwise the next GC run evicts this copy
+            with sqlite3.connect(self.db_name) as conn:
+                conn.execute("""
+                    INSERT INTO attachment_blobs (sha256, path, size, extension)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(sha256) DO UPDATE SET
+                        path = excluded.path,
+                        bundle = NULL,
+                        orphaned_at = NULL
+                """, (sha256, path, size, extension))
+                conn.commit()
+            self.previews.submit(sha256, path, extension)
+            self.meshes.submit(sha256, path, extension)
+            return {"sha256": sha256, "path": path, "size": size, "is_new": True}
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def local_path(self, sha256: str) -> Optional[str]:
+        """
+        Path of a blob on disk, unpacking it from its cold bundle if needed
+
+        The unpacked copy stays until the next cold storage run removes it
+        again; the bundle keeps its member either way.
+        """
+        blob = self.get_blob(sha256)
+        if not blob:
+            return None
+        if os.path.exists(blob['path']):
+            return blob['path']
+        if not blob['bundle'] or not os.path.exists(blob['bundle']):
+            return None
+
+        member = os.path.basename(blob['path'])
+        tmp_path = os.path.join(self.root, "tmp", uuid.uuid4().hex)
+        try:
+            with zipfile.ZipFile(blob['bundle']) as bundle, bundle.open(member) as src, open(tmp_path, "wb") as out:
+                while True:
+                    chunk = src.read(ATTACHMENT_CHUNK_BYTES)
+                    if not chunk:
+                        break
+                    out.write(chunk)
+            os.makedirs(os.path.dirname(blob['path']), exist_ok=True)
+            os.replace(tmp_path, blob['path'])
+        except (OSError, KeyError, zipfile.BadZipFile) as e:
+            print(f"Attachment restore error ({sha256[:12]}): {e}")
+            return None
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return blob['path']
+
+    def read_blob(self, sha256: str) -> bytes:
+        """Contents of a blob (for downloads), empty if it is gone"""
+        path = self.local_path(sha256)
+        if not path:
+            return b""
+        with open(path, "rb") as f:
+            return f.read()
+
+    def get_blob(self, sha256: str) -> Optional[Dict]:
+        """Blob row by hash, None if unknown"""
+        with sqlite3.connect(self.db_name) as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute("SELECT * FROM attachment_blobs WHERE sha256 = ?", (sha256,)).fetchone()
+        return dict(row) if row else None
+
+    # =========================================================================
+    #                         CASE LINKS
+    # =========================================================================
+
+    def link(self, case_code: str, blob: Dict[str, Any], original_name: str = None,
+             uploaded_by: str = None) -> int:
+        """
+        Attach a blob to a case and make it the case's current attachment
+
+        cases.attachment keeps pointing at the latest file so existing
+        readers (archive page, PDF reports) work unchanged.
+        """
+        with sqlite3.connect(self.db_name) as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO attachments (case_code, sha256, original_name, uploaded_by)
+                VALUES (?, ?, ?, ?)
+            """, (case_code, blob['sha256'], original_name, uploaded_by))
+            attachment_id = cursor.lastrowid
+            cursor.execute(
+                "UPDATE cases SET attachment = ? WHERE case_code = ?",
+                (blob['path'], case_code)
+            )
+            # Referenced again: no longer a garbage collection candidate
+            cursor.execute(
+                "UPDATE attachment_blobs SET orphaned_at = NULL WHERE sha256 = ?", (blob['sha256'],)
+            )
+            conn.commit()
+        return attachment_id
+
+    def get_case_attachments(self, case_code: str = None, case_codes: Sequence[str] = None,
+                             limit: int = None, before_id: int = None) -> pd.DataFrame:
+        """
+        Attachments of a case, or of a list of cases (all cases when both are None), newest first
+
+        Pagination is keyset based: pass the id of the last row of a page as
+        before_id to get the next limit rows.
+        """
+        query = """
+            SELECT a.id, a.case_code, a.sha256, a.original_name, a.uploaded_by,
+                   a.created_at, b.path, b.size, b.extension
+            FROM attachments a
+            JOIN attachment_blobs b ON b.sha256 = a.sha256
+            WHERE 1=1
+        """
+        params = []
+        if case_code is not None:
+            query += " AND a.case_code = ?"
+            params.append(case_code)
+        if case_codes is not None:
+            query += f" AND a.case_code IN ({', '.join('?' * len(case_codes))})"
+            params.extend(case_codes)
+        if before_id is not None:
+            query += " AND a.id < ?"
+            params.append(before_id)
+        query += " ORDER BY a.id DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        with sqlite3.connect(self.db_name) as conn:
+            return pd.read_sql_query(query, conn, params=params)
+
+
+def get_attachment_store(db_name: str) -> AttachmentStore:
+    """Return the process-wide attachment store of a database file"""
+    key = os.path.abspath(db_name)
+    with _REGISTRY_LOCK:
+        store = _REGISTRY.get(key)
+        if store is None:
+            store = _REGISTRY[key] = AttachmentStore(db_name)
+        return store
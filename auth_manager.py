@@ -9,26 +9,67 @@ Features:
 - Admin user management
 """
 
-import streamlit as st
 import sqlite3
 import hashlib
 import secrets
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from typing import Optional, Dict, List, Tuple
 import json
+import os
+import threading
+import time
+
+from activity_writer import get_activity_writer, ROLLUP_UNKNOWN
+from maintenance import get_maintenance_scheduler
+from constants import (
+    SESSION_TTL_HOURS,
+    SESSION_CACHE_SECONDS,
+    SESSION_CLEANUP_INTERVAL_SECONDS,
+    SESSION_RETENTION_DAYS,
+)
+
+
+_AUTH_MANAGERS: Dict[str, "AuthManager"] = {}
+_AUTH_MANAGERS_LOCK = threading.Lock()
 
 
 class AuthManager:
     """Manage user authentication and authorization"""
     
+    # Permission action -> permissions table column
+    ACTION_COLUMNS = {
+        'view': 'can_view',
+        'create': 'can_create',
+        'edit': 'can_edit',
+        'delete': 'can_delete',
+        'export': 'can_export'
+    }
+    
     def __init__(self, db_name="lab_database.db"):
         self.db_name = db_name
+        self._cache_lock = threading.Lock()
+        # role -> module -> action -> bool, loaded on first permission check
+        self._permission_matrix: Optional[Dict[str, Dict[str, Dict[str, bool]]]] = None
+        self._permission_generation = 0
+        # username -> role (None for unknown users)
+        self._user_roles: Dict[str, Optional[str]] = {}
+        # session_token -> (user info, monotonic time of last validation)
+        self._session_cache: Dict[str, Tuple[Dict, float]] = {}
+        self._last_session_cleanup = 0.0
+        # Wall-clock time of the last statement or session check, used for idle detection
+        self.last_activity = 0.0
         self._init_auth_tables()
         self._create_default_admin()
+        self.activity_writer = get_activity_writer(db_name)
+    
+    def _connect(self) -> sqlite3.Connection:
+        """New connection to the database, noted as activity for idle detection"""
+        self.last_activity = time.time()
+        return sqlite3.connect(self.db_name)
     
     def _init_auth_tables(self):
         """Initialize authentication tables"""
-        with sqlite3.connect(self.db_name) as conn:
+        with self._connect() as conn:
             cursor = conn.cursor()
             
             # Users table
@@ -95,15 +136,73 @@ class AuthManager:
             """)
             
             # Create indexes
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_activity_user ON activity_log(username)")
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_activity_timestamp ON activity_log(timestamp)")
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_user ON user_sessions(username)")
             
+            self._migrate_sessions_table(cursor)
+            self._migrate_activity_tables(cursor)
+            
             conn.commit()
     
+    def _migrate_sessions_table(self, cursor):
+        """Add expiry tracking to user_sessions"""
+        for col_name in ("expires_at", "last_seen"):
+            try:
+                cursor.execute(f"ALTER TABLE user_sessions ADD COLUMN {col_name} TEXT")
+            except sqlite3.OperationalError:
+                pass
+        
+        # Sessions created before expiry tracking never expire otherwise
+        cursor.execute(f"""
+            UPDATE user_sessions
+            SET expires_at = datetime(login_time, '+{SESSION_TTL_HOURS} hours')
+            WHERE expires_at IS NULL
+        """)
+        
+        # session_token lookups use the UNIQUE constraint's index;
+        # this one serves the periodic cleanup
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_sessions_active_expiry 
+            ON user_sessions(is_active, expires_at)
+        """)
+    
+    def _migrate_activity_tables(self, cursor):
+        """Composite filter indexes and hourly/daily rollups for activity_log"""
+        # Every filter column leads one index, ordered like the keyset pagination
+        cursor.execute("DROP INDEX IF EXISTS idx_activity_user")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_activity_user_time ON activity_log(username, timestamp, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_activity_action_time ON activity_log(action_type, timestamp, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_activity_module_time ON activity_log(module, timestamp, id)")
+        
+        # Rollups are kept up to date by the activity writer on every batch
+        for table in ('activity_rollup_hourly', 'activity_rollup_daily'):
+            cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    bucket TEXT NOT NULL,
+                    username TEXT NOT NULL,
+                    module TEXT NOT NULL,
+                    action_type TEXT NOT NULL,
+                    event_count INTEGER DEFAULT 0,
+                    PRIMARY KEY (bucket, username, module, action_type)
+                )
+            """)
+        
+        # Backfill once from existing activity
+        for table, bucket_format in (('activity_rollup_hourly', '%Y-%m-%d %H:00:00'),
+                                     ('activity_rollup_daily', '%Y-%m-%d')):
+            cursor.execute(f"SELECT COUNT(*) FROM {table}")
+            if cursor.fetchone()[0] == 0:
+                cursor.execute(f"""
+                    INSERT INTO {table} (bucket, username, module, action_type, event_count)
+                    SELECT strftime('{bucket_format}', timestamp), username, module, action_type, COUNT(*)
+                    FROM activity_log
+                    WHERE timestamp IS NOT NULL
+                    GROUP BY 1, 2, 3, 4
+                """)
+    
     def _create_default_admin(self):
         """Create default admin user if not exists"""
-        with sqlite3.connect(self.db_name) as conn:
+        with self._connect() as conn:
             cursor = conn.cursor()
             
             # Check if admin exists
@@ -189,7 +288,10 @@ class AuthManager:
     
     def login(self, username: str, password: str) -> Tuple[bool, Optional[str]]:
         """Authenticate user and create session"""
-        with sqlite3.connect(self.db_name) as conn:
+        # Streamlit only where session state is touched: the CLI (a1lab) imports this module headless
+        import streamlit as st
+        
+        with self._connect() as conn:
             cursor = conn.cursor()
             
             password_hash = self._hash_password(password)
@@ -212,9 +314,9 @@ class AuthManager:
                 session_token = secrets.token_hex(32)
                 
                 # Save session
-                cursor.execute("""
-                    INSERT INTO user_sessions (username, session_token, is_active)
-                    VALUES (?, ?, 1)
+                cursor.execute(f"""
+                    INSERT INTO user_sessions (username, session_token, is_active, expires_at, last_seen)
+                    VALUES (?, ?, 1, datetime('now', '+{SESSION_TTL_HOURS} hours'), datetime('now'))
                 """, (username, session_token))
                 
                 # Update last login
@@ -225,11 +327,11 @@ class AuthManager:
                     WHERE username = ?
                 """, (username,))
                 
-                # Log activity
-                self.log_activity(username, 'login', 'system', 'تسجيل دخول ناجح')
-                
                 conn.commit()
                 
+                # Log activity (after commit: the writer must not wait on this transaction's lock)
+                self.log_activity(username, 'login', 'system', 'تسجيل دخول ناجح')
+                
                 # Store in session state
                 st.session_state.logged_in = True
                 st.session_state.username = username
@@ -237,122 +339,251 @@ class AuthManager:
                 st.session_state.role = role
                 st.session_state.session_token = session_token
                 
+                self.cleanup_sessions()
+                
                 return True, None
             else:
                 return False, "اسم المستخدم أو كلمة المرور غير صحيحة"
     
-    def logout(self, username: str):
-        """Logout user and end session"""
-        with sqlite3.connect(self.db_name) as conn:
+    def logout(self, username: str, session_token: str = None):
+        """Logout user and end the given session (all of the user's sessions without a token)"""
+        import streamlit as st
+        
+        with self._connect() as conn:
             cursor = conn.cursor()
             
             # End session
-            cursor.execute("""
-                UPDATE user_sessions 
-                SET logout_time = datetime('now'),
-                    is_active = 0
-                WHERE username = ? AND is_active = 1
-            """, (username,))
-            
-            # Log activity
-            self.log_activity(username, 'logout', 'system', 'تسجيل خروج')
+            if session_token:
+                cursor.execute("""
+                    UPDATE user_sessions 
+                    SET logout_time = datetime('now'),
+                        is_active = 0
+                    WHERE session_token = ? AND is_active = 1
+                """, (session_token,))
+                self._forget_sessions(token=session_token)
+            else:
+                cursor.execute("""
+                    UPDATE user_sessions 
+                    SET logout_time = datetime('now'),
+                        is_active = 0
+                    WHERE username = ? AND is_active = 1
+                """, (username,))
+                self._forget_sessions(username=username)
             
             conn.commit()
         
+        # Log activity
+        self.log_activity(username, 'logout', 'system', 'تسجيل خروج')
+        
         # Clear session state
         for key in list(st.session_state.keys()):
             del st.session_state[key]
     
-    def check_permission(self, username: str, module: str, action: str) -> bool:
-        """Check if user has permission for action on module"""
-        if not username:
-            return False
+    # =========================================================================
+    #                         SESSIONS
+    # =========================================================================
+    
+    def validate_session(self, session_token: str) -> Optional[Dict]:
+        """
+        Return the user of an active, unexpired session or None
         
-        with sqlite3.connect(self.db_name) as conn:
+        Valid tokens are cached for SESSION_CACHE_SECONDS; each database
+        validation slides the expiry forward by SESSION_TTL_HOURS.
+        """
+        if not session_token:
+            return None
+        
+        # A cached check still means a user is working
+        self.last_activity = time.time()
+        now = time.monotonic()
+        with self._cache_lock:
+            cached = self._session_cache.get(session_token)
+        if cached and now - cached[1] < SESSION_CACHE_SECONDS:
+            return cached[0]
+        
+        with self._connect() as conn:
             cursor = conn.cursor()
-            
-            # Get user role
-            cursor.execute("SELECT role FROM users WHERE username = ?", (username,))
+            cursor.execute("""
+                SELECT u.username, u.full_name, u.role
+                FROM user_sessions s
+                JOIN users u ON u.username = s.username
+                WHERE s.session_token = ? AND s.is_active = 1
+                  AND s.expires_at > datetime('now') AND u.is_active = 1
+            """, (session_token,))
             result = cursor.fetchone()
             
             if not result:
-                return False
-            
-            role = result[0]
-            
-            # Admin has all permissions
-            if role == 'admin':
-                return True
-            
-            # Check specific permission
-            action_map = {
-                'view': 'can_view',
-                'create': 'can_create',
-                'edit': 'can_edit',
-                'delete': 'can_delete',
-                'export': 'can_export'
-            }
-            
-            column = action_map.get(action, 'can_view')
+                self._forget_sessions(token=session_token)
+                return None
             
             cursor.execute(f"""
-                SELECT {column} 
-                FROM permissions 
-                WHERE role = ? AND module = ?
-            """, (role, module))
-            
-            result = cursor.fetchone()
-            return bool(result and result[0]) if result else False
+                UPDATE user_sessions
+                SET expires_at = datetime('now', '+{SESSION_TTL_HOURS} hours'),
+                    last_seen = datetime('now')
+                WHERE session_token = ?
+            """, (session_token,))
+            conn.commit()
+        
+        user = dict(zip(('username', 'full_name', 'role'), result))
+        with self._cache_lock:
+            self._session_cache[session_token] = (user, now)
+        return user
     
-    def get_user_permissions(self, username: str) -> Dict[str, Dict[str, bool]]:
-        """Get all permissions for user"""
-        with sqlite3.connect(self.db_name) as conn:
+    def resume_session(self, session_token: str) -> bool:
+        """Restore st.session_state from a valid session token (e.g. after a browser refresh)"""
+        import streamlit as st
+        
+        user = self.validate_session(session_token)
+        if not user:
+            return False
+        
+        st.session_state.logged_in = True
+        st.session_state.username = user['username']
+        st.session_state.full_name = user['full_name']
+        st.session_state.role = user['role']
+        st.session_state.session_token = session_token
+        return True
+    
+    def cleanup_sessions(self, force: bool = False) -> int:
+        """Deactivate expired sessions and delete old ended ones, at most once per interval"""
+        now = time.monotonic()
+        if not force and now - self._last_session_cleanup < SESSION_CLEANUP_INTERVAL_SECONDS:
+            return 0
+        self._last_session_cleanup = now
+        
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE user_sessions
+                SET is_active = 0, logout_time = COALESCE(logout_time, expires_at)
+                WHERE is_active = 1 AND expires_at <= datetime('now')
+            """)
+            expired = cursor.rowcount
+            cursor.execute(f"""
+                DELETE FROM user_sessions
+                WHERE is_active = 0 
+                  AND COALESCE(logout_time, expires_at, login_time) < datetime('now', '-{SESSION_RETENTION_DAYS} days')
+            """)
+            conn.commit()
+        return expired
+    
+    def _forget_sessions(self, token: str = None, username: str = None):
+        """Drop cached session validations by token or by user"""
+        with self._cache_lock:
+            if token:
+                self._session_cache.pop(token, None)
+            if username:
+                for key in [k for k, (user, _) in self._session_cache.items() if user['username'] == username]:
+                    del self._session_cache[key]
+    
+    # =========================================================================
+    #                         PERMISSION CACHE
+    # =========================================================================
+    
+    def _get_permission_matrix(self) -> Dict[str, Dict[str, Dict[str, bool]]]:
+        """Whole role × module × action matrix, loaded once and kept in memory"""
+        matrix = self._permission_matrix
+        if matrix is not None:
+            return matrix
+        
+        generation = self._permission_generation
+        with self._connect() as conn:
             cursor = conn.cursor()
-            
-            cursor.execute("SELECT role FROM users WHERE username = ?", (username,))
-            result = cursor.fetchone()
-            
-            if not result:
-                return {}
-            
-            role = result[0]
-            
-            if role == 'admin':
-                # Admin has all permissions
-                modules = ['cases', 'doctors', 'invoices', 'reports', 'settings', 'users']
-                return {
-                    module: {
-                        'view': True, 'create': True, 'edit': True, 
-                        'delete': True, 'export': True
-                    }
-                    for module in modules
-                }
-            
             cursor.execute("""
-                SELECT module, can_view, can_create, can_edit, can_delete, can_export
+                SELECT role, module, can_view, can_create, can_edit, can_delete, can_export
                 FROM permissions
-                WHERE role = ?
-            """, (role,))
-            
-            permissions = {}
-            for row in cursor.fetchall():
-                module, view, create, edit, delete, export = row
-                permissions[module] = {
+            """)
+            matrix = {}
+            for role, module, view, create, edit, delete, export in cursor.fetchall():
+                matrix.setdefault(role, {})[module] = {
                     'view': bool(view),
                     'create': bool(create),
                     'edit': bool(edit),
                     'delete': bool(delete),
                     'export': bool(export)
                 }
-            
-            return permissions
+        
+        with self._cache_lock:
+            # Don't keep a snapshot that raced with update_permissions
+            if generation == self._permission_generation:
+                self._permission_matrix = matrix
+        return matrix
+    
+    def _get_user_role(self, username: str) -> Optional[str]:
+        """Role of a user, cached per username"""
+        with self._cache_lock:
+            if username in self._user_roles:
+                return self._user_roles[username]
+        
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT role FROM users WHERE username = ?", (username,))
+            result = cursor.fetchone()
+        
+        role = result[0] if result else None
+        with self._cache_lock:
+            self._user_roles[username] = role
+        return role
+    
+    def invalidate_permissions(self):
+        """Drop the cached permission matrix"""
+        with self._cache_lock:
+            self._permission_generation += 1
+            self._permission_matrix = None
+    
+    def invalidate_user(self, username: str):
+        """Drop the cached role and session validations of a user"""
+        with self._cache_lock:
+            self._user_roles.pop(username, None)
+        self._forget_sessions(username=username)
+    
+    def check_permission(self, username: str, module: str, action: str) -> bool:
+        """Check if user has permission for action on module"""
+        if not username:
+            return False
+        
+        role = self._get_user_role(username)
+        
+        if not role:
+            return False
+        
+        # Admin has all permissions
+        if role == 'admin':
+            return True
+        
+        # Unknown actions fall back to view
+        if action not in self.ACTION_COLUMNS:
+            action = 'view'
+        
+        return self._get_permission_matrix().get(role, {}).get(module, {}).get(action, False)
+    
+    def get_user_permissions(self, username: str) -> Dict[str, Dict[str, bool]]:
+        """Get all permissions for user"""
+        role = self._get_user_role(username)
+        
+        if not role:
+            return {}
+        
+        if role == 'admin':
+            # Admin has all permissions
+            modules = ['cases', 'doctors', 'invoices', 'reports', 'settings', 'users']
+            return {
+                module: {
+                    'view': True, 'create': True, 'edit': True, 
+                    'delete': True, 'export': True
+                }
+                for module in modules
+            }
+        
+        role_permissions = self._get_permission_matrix().get(role, {})
+        return {module: dict(actions) for module, actions in role_permissions.items()}
     
     def create_user(self, username: str, password: str, full_name: str, 
                     role: str, email: str = None, phone: str = None,
                     created_by: str = None, notes: str = None) -> Tuple[bool, str]:
         """Create new user"""
         try:
-            with sqlite3.connect(self.db_name) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 
                 # Check if username exists
@@ -368,19 +599,20 @@ class AuthManager:
                     VALUES (?, ?, ?, ?, ?, ?, ?, ?)
                 """, (username, password_hash, full_name, email, phone, role, created_by, notes))
                 
-                # Log activity
-                self.log_activity(created_by or 'admin', 'create', 'users', 
-                                f'إضافة مستخدم جديد: {full_name} ({username})')
-                
                 conn.commit()
-                return True, "تم إضافة المستخدم بنجاح"
+            self.invalidate_user(username)
+            
+            # Log activity
+            self.log_activity(created_by or 'admin', 'create', 'users', 
+                            f'إضافة مستخدم جديد: {full_name} ({username})')
+            return True, "تم إضافة المستخدم بنجاح"
         except Exception as e:
             return False, f"خطأ في إضافة المستخدم: {str(e)}"
     
     def update_user(self, username: str, **kwargs) -> Tuple[bool, str]:
         """Update user information"""
         try:
-            with sqlite3.connect(self.db_name) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 
                 # Build update query
@@ -419,12 +651,13 @@ class AuthManager:
                 
                 cursor.execute(query, values)
                 
-                # Log activity
-                self.log_activity(kwargs.get('updated_by', 'admin'), 'update', 'users',
-                                f'تحديث بيانات المستخدم: {username}')
-                
                 conn.commit()
-                return True, "تم تحديث البيانات بنجاح"
+            self.invalidate_user(username)
+            
+            # Log activity
+            self.log_activity(kwargs.get('updated_by', 'admin'), 'update', 'users',
+                            f'تحديث بيانات المستخدم: {username}')
+            return True, "تم تحديث البيانات بنجاح"
         except Exception as e:
             return False, f"خطأ في التحديث: {str(e)}"
     
@@ -434,23 +667,24 @@ class AuthManager:
             return False, "لا يمكن حذف المدير الرئيسي"
         
         try:
-            with sqlite3.connect(self.db_name) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 
                 cursor.execute("UPDATE users SET is_active = 0 WHERE username = ?", (username,))
                 
-                # Log activity
-                self.log_activity(deleted_by, 'delete', 'users',
-                                f'تعطيل المستخدم: {username}')
-                
                 conn.commit()
-                return True, "تم تعطيل المستخدم"
+            self.invalidate_user(username)
+            
+            # Log activity
+            self.log_activity(deleted_by, 'delete', 'users',
+                            f'تعطيل المستخدم: {username}')
+            return True, "تم تعطيل المستخدم"
         except Exception as e:
             return False, f"خطأ: {str(e)}"
     
     def get_all_users(self) -> List[Dict]:
         """Get all users"""
-        with sqlite3.connect(self.db_name) as conn:
+        with self._connect() as conn:
             cursor = conn.cursor()
             
             cursor.execute("""
@@ -468,50 +702,77 @@ class AuthManager:
     def log_activity(self, username: str, action_type: str, module: str, 
                      description: str, record_id: int = None, 
                      old_data: str = None, new_data: str = None):
-        """Log user activity"""
+        """Log user activity (queued, written in batches by the activity writer)"""
         try:
-            with sqlite3.connect(self.db_name) as conn:
-                cursor = conn.cursor()
-                
-                cursor.execute("""
-                    INSERT INTO activity_log 
-                    (username, action_type, module, description, record_id, old_data, new_data)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                """, (username, action_type, module, description, record_id, old_data, new_data))
-                
-                conn.commit()
+            # Same placeholder as the rollups, so optional callers' events are kept, not rejected
+            self.activity_writer.submit('activity_log', {
+                'username': username or ROLLUP_UNKNOWN,
+                'action_type': action_type or ROLLUP_UNKNOWN,
+                'module': module or ROLLUP_UNKNOWN,
+                'description': description,
+                'record_id': record_id,
+                'old_data': old_data,
+                'new_data': new_data,
+                'timestamp': datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+            })
         except:
             pass  # Don't fail if logging fails
     
+    def _activity_filters(self, username: str = None, module: str = None, action_type: str = None,
+                          start_date: str = None, end_date: str = None,
+                          time_column: str = "timestamp") -> Tuple[str, List]:
+        """WHERE clause shared by the raw log and the rollups (dates are inclusive)"""
+        clauses = []
+        params = []
+        
+        if username:
+            clauses.append("username = ?")
+            params.append(username)
+        
+        if module:
+            clauses.append("module = ?")
+            params.append(module)
+        
+        if action_type:
+            clauses.append("action_type = ?")
+            params.append(action_type)
+        
+        # Plain range comparisons so the (column, timestamp) indexes are used
+        if start_date:
+            clauses.append(f"{time_column} >= date(?)")
+            params.append(start_date)
+        
+        if end_date:
+            clauses.append(f"{time_column} < date(?, '+1 day')")
+            params.append(end_date)
+        
+        return (" AND ".join(clauses) or "1=1"), params
+    
     def get_activity_log(self, username: str = None, module: str = None, 
                          start_date: str = None, end_date: str = None,
-                         limit: int = 100) -> List[Dict]:
-        """Get activity log with filters"""
-        with sqlite3.connect(self.db_name) as conn:
+                         limit: int = 100, action_type: str = None,
+                         before: Optional[Tuple[str, int]] = None) -> List[Dict]:
+        """
+        Get activity log with filters, newest first
+        
+        Every filter runs in SQL. Pagination is keyset based: pass the
+        (timestamp, id) of the last row of a page as before to get the next one.
+        """
+        # Include events still waiting in the writer queue
+        self.activity_writer.flush()
+        
+        where, params = self._activity_filters(username, module, action_type, start_date, end_date)
+        query = f"SELECT * FROM activity_log WHERE {where}"
+        
+        if before:
+            query += " AND (timestamp < ? OR (timestamp = ? AND id < ?))"
+            params.extend([before[0], before[0], before[1]])
+        
+        query += " ORDER BY timestamp DESC, id DESC LIMIT ?"
+        params.append(limit)
+        
+        with self._connect() as conn:
             cursor = conn.cursor()
-            
-            query = "SELECT * FROM activity_log WHERE 1=1"
-            params = []
-            
-            if username:
-                query += " AND username = ?"
-                params.append(username)
-            
-            if module:
-                query += " AND module = ?"
-                params.append(module)
-            
-            if start_date:
-                query += " AND date(timestamp) >= date(?)"
-                params.append(start_date)
-            
-            if end_date:
-                query += " AND date(timestamp) <= date(?)"
-                params.append(end_date)
-            
-            query += " ORDER BY timestamp DESC LIMIT ?"
-            params.append(limit)
-            
             cursor.execute(query, params)
             
             columns = ['id', 'username', 'action_type', 'module', 'description',
@@ -519,10 +780,32 @@ class AuthManager:
             
             return [dict(zip(columns, row)) for row in cursor.fetchall()]
     
+    def get_activity_rollup(self, granularity: str = 'daily', username: str = None,
+                            module: str = None, action_type: str = None,
+                            start_date: str = None, end_date: str = None) -> List[Dict]:
+        """Activity counts per bucket/user/module/action from the hourly or daily rollup"""
+        table = 'activity_rollup_hourly' if granularity == 'hourly' else 'activity_rollup_daily'
+        
+        self.activity_writer.flush()
+        
+        where, params = self._activity_filters(username, module, action_type, start_date, end_date,
+                                               time_column="bucket")
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT bucket, username, module, action_type, event_count
+                FROM {table}
+                WHERE {where}
+                ORDER BY bucket
+            """, params)
+            
+            columns = ['bucket', 'username', 'module', 'action_type', 'event_count']
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    
     def update_permissions(self, role: str, module: str, permissions: Dict[str, bool]) -> bool:
         """Update role permissions for a module"""
         try:
-            with sqlite3.connect(self.db_name) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 
                 cursor.execute("""
@@ -545,14 +828,32 @@ class AuthManager:
                 ))
                 
                 conn.commit()
-                return True
+            self.invalidate_permissions()
+            return True
         except:
             return False
 
 
+def get_auth_manager(db_name: str = "lab_database.db") -> AuthManager:
+    """
+    Return the process-wide AuthManager of a database file
+    
+    The auth schema and default admin are set up once, on first use,
+    instead of on every page render and permission check.
+    """
+    key = os.path.abspath(db_name)
+    with _AUTH_MANAGERS_LOCK:
+        auth = _AUTH_MANAGERS.get(key)
+        if auth is None:
+            auth = _AUTH_MANAGERS[key] = AuthManager(db_name)
+            get_maintenance_scheduler(db_name).watch(auth)
+        return auth
+
+
 def require_auth(func):
     """Decorator to require authentication"""
     def wrapper(*args, **kwargs):
+        import streamlit as st
         if not st.session_state.get('logged_in', False):
             st.warning("⚠️ يجب تسجيل الدخول أولاً")
             return None
@@ -564,11 +865,12 @@ def require_permission(module: str, action: str):
     """Decorator to check permission"""
     def decorator(func):
         def wrapper(*args, **kwargs):
+            import streamlit as st
             if not st.session_state.get('logged_in', False):
                 st.error("❌ يجب تسجيل الدخول")
                 return None
             
-            auth = AuthManager()
+            auth = get_auth_manager()
             username = st.session_state.get('username')
             
             if not auth.check_permission(username, module, action):
@@ -25,6 +25,20 @@ ALL_TEETH = ALL_UPPER_TEETH + ALL_LOWER_TEETH
 DEFAULT_PMMA_PRICE = 150  # ج.م
 DEFAULT_NIGHTGUARD_PRICE = 500  # ج.م
 
+# Mass price adjustment rules (settings page) -> label
+PRICE_RULE_PERCENT = "percent"
+PRICE_RULE_DELTA = "delta"
+PRICE_RULE_CATALOG = "catalog"
+PRICE_RULE_ENTITY = "entity"
+
+PRICE_ADJUSTMENT_RULES = {
+    PRICE_RULE_PERCENT: "📈 نسبة مئوية %",
+    PRICE_RULE_DELTA: "➕ زيادة/خصم مبلغ ثابت",
+    PRICE_RULE_CATALOG: "📋 نسخ من أسعار الخامات الافتراضية",
+    PRICE_RULE_ENTITY: "👥 نسخ من طبيب/مركز آخر",
+}
+PRICE_ROUNDING_STEPS = [0, 5, 10, 50, 100]  # 0 = no rounding
+
 # =============================================================================
 #                           FILE PATHS
 # =============================================================================
@@ -41,6 +55,27 @@ FONT_FOLDER_FALLBACK = "fonts"
 DATABASE_NAME = "lab_database.db"
 MAX_BACKUPS_TO_KEEP = 30  # Number of backup files to retain
 
+# Query instrumentation
+QUERY_LOG_FOLDER = "logs"
+QUERY_LOG_MAX_BYTES = 5 * 1024 * 1024  # Rotate the query log at 5 MB
+QUERY_LOG_BACKUPS = 5  # Number of rotated query logs to keep
+QUERY_BUFFER_SIZE = 5000  # Statements kept in memory for the stats page
+SLOW_QUERY_THRESHOLD_MS = 250  # Statements slower than this get EXPLAIN QUERY PLAN
+
+# Scheduled maintenance (ANALYZE, optimize, WAL checkpoint, incremental vacuum)
+MAINTENANCE_INTERVAL_SECONDS = 6 * 60 * 60  # Run at most every 6 hours
+MAINTENANCE_IDLE_SECONDS = 5 * 60  # Only after 5 minutes without any statement
+MAINTENANCE_CHECK_SECONDS = 60  # How often the scheduler wakes up
+ANALYZE_CHANGE_RATIO = 0.1  # Re-ANALYZE a table once its row count moved 10%
+
+# Background activity/audit log writer
+ACTIVITY_QUEUE_SIZE = 10000  # Events buffered in memory before producers wait
+ACTIVITY_BATCH_SIZE = 200  # Rows per executemany
+ACTIVITY_FLUSH_SECONDS = 2  # Flush a partial batch after this long
+ACTIVITY_PUT_TIMEOUT_SECONDS = 0.5  # Wait this long on a full queue, then write synchronously
+ACTIVITY_SPILL_SUFFIX = "-activity.jsonl"  # Next to the database: events a write failed on, replayed later
+ACTIVITY_QUARANTINE_SUFFIX = "-activity-rejected.jsonl"  # Next to the database: events the database rejected, never replayed
+
 # =============================================================================
 #                           CASE STATUS
 # =============================================================================
@@ -94,6 +129,10 @@ PAGE_TITLE = "A1 Dental Lab"
 PAGE_ICON = "🦷"
 LAYOUT = "wide"
 
+# Archive paging
+ARCHIVE_PAGE_SIZE = 25  # Cases (expanders) per archive page
+ARCHIVE_ATTACHMENT_BATCH = 200  # Attachment rows per query while loading a page
+
 # Date formats
 DATE_FORMAT_DISPLAY = "%Y-%m-%d"  # For display
 DATE_FORMAT_FILE = "%Y%m%d_%H%M%S"  # For filenames
@@ -110,6 +149,8 @@ MAX_TEETH_COUNT = 32
 
 # File upload limits
 MAX_FILE_SIZE_MB = 10
+MAX_3D_FILE_SIZE_MB = 100  # STL/OBJ scans are routinely tens of MB
+ATTACHMENT_CHUNK_BYTES = 1024 * 1024  # Uploads are streamed and hashed in 1 MB chunks
 ALLOWED_IMAGE_EXTENSIONS = ["jpg", "jpeg", "png", "gif"]
 ALLOWED_DOCUMENT_EXTENSIONS = ["pdf", "doc", "docx"]
 ALLOWED_3D_EXTENSIONS = ["stl", "obj"]
@@ -122,6 +163,36 @@ ALL_ALLOWED_EXTENSIONS = (
     ALLOWED_ARCHIVE_EXTENSIONS
 )
 
+# Attachment previews, rendered once per content hash by a background worker
+THUMBNAIL_SIZE = (320, 320)  # Archive gallery
+PDF_PREVIEW_SIZE = (800, 600)  # Embedded in PDF reports (80 x 60 mm at ~250 dpi)
+PREVIEW_JPEG_QUALITY = 80
+
+# 3D scan analysis
+MESH_PARSE_CHUNK_BYTES = 4 * 1024 * 1024  # ASCII STL / OBJ are parsed this much at a time
+MESH_PREVIEW_TRIANGLES = 20000  # Scans are decimated to about this many faces before rendering
+MESH_PREVIEW_SIZE = (400, 400)  # Pixels per rendered view
+MESH_PREVIEW_VIEWS = {  # name -> (elevation, azimuth) in degrees
+    "occlusal": (90, -90),
+    "front": (0, -90),
+    "side": (0, 0),
+}
+
+# Attachment garbage collection and cold storage (run with database maintenance)
+ATTACHMENT_GC_GRACE_DAYS = 7  # Unreferenced files are kept this long before deletion
+ATTACHMENT_COLD_AFTER_MONTHS = 6  # Delivered cases older than this move to compressed bundles
+ATTACHMENT_COLD_FOLDER = "cold"  # Bundle folder inside UPLOAD_FOLDER
+
+# =============================================================================
+#                           SESSIONS
+# =============================================================================
+
+SESSION_TTL_HOURS = 12  # Sliding expiry: extended on every validation
+SESSION_CACHE_SECONDS = 60  # Validated tokens are trusted this long without a query
+SESSION_CLEANUP_INTERVAL_SECONDS = 60 * 60  # Expire/purge old sessions at most hourly
+SESSION_RETENTION_DAYS = 30  # Ended sessions are deleted after this many days
+SESSION_COOKIE = "a1_session"  # Browser cookie used to resume a session after refresh (never the URL)
+
 # =============================================================================
 #                           NOTIFICATION SETTINGS
 # =============================================================================
@@ -213,20 +284,48 @@ def get_arch_from_tooth(tooth_num):
         return "unknown"
 
 
+def get_max_file_size_mb(filename):
+    """Upload limit for a file name: 3D scans get a larger limit"""
+    extension = str(filename).rsplit(".", 1)[-1].lower()
+    if extension in ALLOWED_3D_EXTENSIONS:
+        return MAX_3D_FILE_SIZE_MB
+    return MAX_FILE_SIZE_MB
+
+
+# Arch, position along the arch: neighbours in FDI notation (18…11, 21…28 / 48…41, 31…38)
+_FDI_POSITION = {tooth: (arch, position)
+                 for arch, teeth in enumerate((ALL_UPPER_TEETH, ALL_LOWER_TEETH))
+                 for position, tooth in enumerate(teeth)}
+
+
 def group_consecutive_teeth(teeth_list):
     """
-    Group consecutive tooth numbers together.
-    Example: [11, 12, 13, 21, 22] → [[11, 12, 13], [21, 22]]
+    Group adjacent teeth together, in the order they sit along the arch.
+    Adjacency follows FDI numbering, so groups cross the midline (11-21,
+    41-31) but never join the two arches; other numbers group numerically.
+    
+    >>> group_consecutive_teeth([11, 12, 13, 21, 22])
+    [[13, 12, 11, 21, 22]]
+    >>> group_consecutive_teeth([18, 21, 41, 31, 36])
+    [[18], [21], [41, 31], [36]]
+    >>> group_consecutive_teeth([28, 38])
+    [[28], [38]]
     """
     if not teeth_list:
         return []
     
-    sorted_teeth = sorted(teeth_list)
+    # Non-FDI numbers sort after both arches, on their own numeric line
+    def position(tooth):
+        return _FDI_POSITION.get(tooth, (2, tooth))
+    
+    sorted_teeth = sorted(set(teeth_list), key=position)
     groups = []
     current_group = [sorted_teeth[0]]
     
     for tooth in sorted_teeth[1:]:
-        if tooth == current_group[-1] + 1:
+        arch, index = position(tooth)
+        previous_arch, previous_index = position(current_group[-1])
+        if arch == previous_arch and index == previous_index + 1:
             current_group.append(tooth)
         else:
             groups.append(current_group)
@@ -239,8 +338,13 @@ def group_consecutive_teeth(teeth_list):
 def teeth_to_display_string(teeth_list):
     """
     Convert list of teeth to display string.
-    Example: [11, 12, 13] → "11-13"
-    Example: [11, 13] → "11, 13"
+    
+    >>> teeth_to_display_string([11, 12, 13])
+    '13-11'
+    >>> teeth_to_display_string([11, 21])
+    '11, 21'
+    >>> teeth_to_display_string([11, 13])
+    '13 | 11'
     """
     groups = group_consecutive_teeth(teeth_list)
     result = []
@@ -292,6 +396,7 @@ __all__ = [
     'is_valid_tooth_number',
     'format_price',
     'get_arch_from_tooth',
+    'get_max_file_size_mb',
     'group_consecutive_teeth',
     'teeth_to_display_string',
     
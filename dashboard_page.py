@@ -3,11 +3,100 @@ import streamlit as st
 import pandas as pd
 from datetime import datetime, timedelta
 
+# All dashboard queries, fetched together through db.run_queries so the page
+# waits for the slowest query instead of the sum of all of them
+DASHBOARD_QUERIES = {
+    # 1. Cases in lab
+    "in_lab": """
+        SELECT COUNT(*) as count 
+        FROM cases 
+        WHERE status IN ('في المعمل', 'في المعمل - بعد Try-in')
+    """,
+    # 2. Delivered this month
+    "delivered": """
+        SELECT COUNT(*) as count 
+        FROM cases 
+        WHERE status = 'تم التسليم' 
+        AND strftime('%Y-%m', delivery_date) = strftime('%Y-%m', 'now')
+    """,
+    # 3. Total revenue this month
+    "revenue": """
+        SELECT COALESCE(SUM(price), 0) as total 
+        FROM cases 
+        WHERE status = 'تم التسليم' 
+        AND strftime('%Y-%m', delivery_date) = strftime('%Y-%m', 'now')
+    """,
+    # 4. Unpaid cases
+    "unpaid": """
+        SELECT COUNT(*) as count 
+        FROM cases 
+        WHERE is_paid = 0 AND status = 'تم التسليم'
+    """,
+    # Cases due in next 7 days
+    "upcoming_cases": """
+        SELECT 
+            case_code, patient, doctor, expected_delivery,
+            is_try_in, try_in_date, status
+        FROM cases
+        WHERE status IN ('في المعمل', 'في المعمل - بعد Try-in')
+        AND date(expected_delivery) BETWEEN date('now') AND date('now', '+7 days')
+        ORDER BY expected_delivery ASC
+    """,
+    # New cases per day (last 30 days)
+    "daily_cases": """
+        SELECT 
+            entry_date,
+            COUNT(*) as count
+        FROM cases
+        WHERE date(entry_date) >= date('now', '-30 days')
+        GROUP BY entry_date
+        ORDER BY entry_date
+    """,
+    # Revenue per week (last 8 weeks)
+    "weekly_rev": """
+        SELECT 
+            strftime('%Y-W%W', delivery_date) as week,
+            SUM(price) as revenue
+        FROM cases
+        WHERE status = 'تم التسليم'
+        AND date(delivery_date) >= date('now', '-56 days')
+        GROUP BY week
+        ORDER BY week
+    """,
+    # Doctor statistics
+    "doc_stats": """
+        SELECT 
+            doctor,
+            COUNT(*) as total_cases,
+            SUM(CASE WHEN status = 'تم التسليم' THEN 1 ELSE 0 END) as delivered,
+            SUM(CASE WHEN status IN ('في المعمل', 'في المعمل - بعد Try-in') THEN 1 ELSE 0 END) as in_lab,
+            COALESCE(SUM(CASE WHEN status = 'تم التسليم' THEN price ELSE 0 END), 0) as total_revenue,
+            COALESCE(SUM(CASE WHEN is_paid = 0 AND status = 'تم التسليم' THEN price ELSE 0 END), 0) as unpaid
+        FROM cases
+        GROUP BY doctor
+        ORDER BY total_cases DESC
+    """,
+    # All in-lab cases with expected delivery
+    "calendar_data": """
+        SELECT 
+            expected_delivery,
+            COUNT(*) as count
+        FROM cases
+        WHERE status IN ('في المعمل', 'في المعمل - بعد Try-in')
+        AND expected_delivery IS NOT NULL
+        GROUP BY expected_delivery
+        ORDER BY expected_delivery
+    """,
+}
+
+
 def show_dashboard_page(db):
     """Display dashboard with key metrics and statistics"""
     
     st.header("📊 لوحة المعلومات - Dashboard")
     
+    data = db.run_queries(DASHBOARD_QUERIES)
+    
     # =============================================================================
     #                           KEY METRICS
     # =============================================================================
@@ -15,45 +104,19 @@ def show_dashboard_page(db):
     
     col1, col2, col3, col4 = st.columns(4)
     
-    # 1. Cases in lab
-    in_lab_query = """
-        SELECT COUNT(*) as count 
-        FROM cases 
-        WHERE status IN ('في المعمل', 'في المعمل - بعد Try-in')
-    """
-    in_lab = db.run_query(in_lab_query)
+    in_lab = data['in_lab']
     in_lab_count = in_lab['count'].values[0] if not in_lab.empty else 0
     col1.metric("🔵 الحالات في المعمل", in_lab_count)
     
-    # 2. Delivered this month
-    delivered_query = """
-        SELECT COUNT(*) as count 
-        FROM cases 
-        WHERE status = 'تم التسليم' 
-        AND strftime('%Y-%m', delivery_date) = strftime('%Y-%m', 'now')
-    """
-    delivered = db.run_query(delivered_query)
+    delivered = data['delivered']
     delivered_count = delivered['count'].values[0] if not delivered.empty else 0
     col2.metric("🟢 التسليمات هذا الشهر", delivered_count)
     
-    # 3. Total revenue this month
-    revenue_query = """
-        SELECT COALESCE(SUM(price), 0) as total 
-        FROM cases 
-        WHERE status = 'تم التسليم' 
-        AND strftime('%Y-%m', delivery_date) = strftime('%Y-%m', 'now')
-    """
-    revenue = db.run_query(revenue_query)
+    revenue = data['revenue']
     total_rev = revenue['total'].values[0] if not revenue.empty else 0
     col3.metric("💰 الإيرادات الشهرية", f"{total_rev:,.0f} ج.م")
     
-    # 4. Unpaid cases
-    unpaid_query = """
-        SELECT COUNT(*) as count 
-        FROM cases 
-        WHERE is_paid = 0 AND status = 'تم التسليم'
-    """
-    unpaid = db.run_query(unpaid_query)
+    unpaid = data['unpaid']
     unpaid_count = unpaid['count'].values[0] if not unpaid.empty else 0
     col4.metric("⚠️ حالات غير مدفوعة", unpaid_count)
     
@@ -64,17 +127,7 @@ def show_dashboard_page(db):
     # =============================================================================
     st.subheader("📅 الحالات المقرر تسليمها قريباً")
     
-    # Get cases due in next 7 days
-    upcoming_query = """
-        SELECT 
-            case_code, patient, doctor, expected_delivery,
-            is_try_in, try_in_date, status
-        FROM cases
-        WHERE status IN ('في المعمل', 'في المعمل - بعد Try-in')
-        AND date(expected_delivery) BETWEEN date('now') AND date('now', '+7 days')
-        ORDER BY expected_delivery ASC
-    """
-    upcoming_cases = db.run_query(upcoming_query)
+    upcoming_cases = data['upcoming_cases']
     
     if not upcoming_cases.empty:
         for _, row in upcoming_cases.iterrows():
@@ -115,16 +168,7 @@ def show_dashboard_page(db):
         with col_chart1:
             st.subheader("📈 الحالات الجديدة (آخر 30 يوم)")
             
-            daily_cases_query = """
-                SELECT 
-                    entry_date,
-                    COUNT(*) as count
-                FROM cases
-                WHERE date(entry_date) >= date('now', '-30 days')
-                GROUP BY entry_date
-                ORDER BY entry_date
-            """
-            daily_cases = db.run_query(daily_cases_query)
+            daily_cases = data['daily_cases']
             
             if not daily_cases.empty:
                 st.line_chart(daily_cases.set_index('entry_date')['count'])
@@ -134,17 +178,7 @@ def show_dashboard_page(db):
         with col_chart2:
             st.subheader("💵 الإيرادات (آخر 8 أسابيع)")
             
-            weekly_revenue_query = """
-                SELECT 
-                    strftime('%Y-W%W', delivery_date) as week,
-                    SUM(price) as revenue
-                FROM cases
-                WHERE status = 'تم التسليم'
-                AND date(delivery_date) >= date('now', '-56 days')
-                GROUP BY week
-                ORDER BY week
-            """
-            weekly_rev = db.run_query(weekly_revenue_query)
+            weekly_rev = data['weekly_rev']
             
             if not weekly_rev.empty:
                 st.bar_chart(weekly_rev.set_index('week')['revenue'])
@@ -154,20 +188,7 @@ def show_dashboard_page(db):
     with tab2:
         st.subheader("👨‍⚕️ إحصائيات الأطباء")
         
-        # Doctor statistics
-        doc_stats_query = """
-            SELECT 
-                doctor,
-                COUNT(*) as total_cases,
-                SUM(CASE WHEN status = 'تم التسليم' THEN 1 ELSE 0 END) as delivered,
-                SUM(CASE WHEN status IN ('في المعمل', 'في المعمل - بعد Try-in') THEN 1 ELSE 0 END) as in_lab,
-                COALESCE(SUM(CASE WHEN status = 'تم التسليم' THEN price ELSE 0 END), 0) as total_revenue,
-                COALESCE(SUM(CASE WHEN is_paid = 0 AND status = 'تم التسليم' THEN price ELSE 0 END), 0) as unpaid
-            FROM cases
-            GROUP BY doctor
-            ORDER BY total_cases DESC
-        """
-        doc_stats = db.run_query(doc_stats_query)
+        doc_stats = data['doc_stats']
         
         if not doc_stats.empty:
             # Format the data for display
@@ -191,18 +212,7 @@ def show_dashboard_page(db):
     with tab3:
         st.subheader("📅 التقويم - الحالات حسب الموعد")
         
-        # Get all in-lab cases with expected delivery
-        calendar_query = """
-            SELECT 
-                expected_delivery,
-                COUNT(*) as count
-            FROM cases
-            WHERE status IN ('في المعمل', 'في المعمل - بعد Try-in')
-            AND expected_delivery IS NOT NULL
-            GROUP BY expected_delivery
-            ORDER BY expected_delivery
-        """
-        calendar_data = db.run_query(calendar_query)
+        calendar_data = data['calendar_data']
         
         if not calendar_data.empty:
             # Show as a simple table
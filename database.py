@@ -5,12 +5,24 @@ Comprehensive database management with full CRUD operations and analytics
 """
 
 import sqlite3
+import json
 import pandas as pd
-from datetime import datetime, timedelta
-import shutil
+from datetime import datetime, timedelta, timezone
 import os
 import glob
-from typing import Optional, Dict, List, Tuple, Any
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import pathname2url
+from typing import Optional, Dict, List, Tuple, Any, Union
+
+from query_monitor import QueryMonitor, find_calling_page
+from price_matrix import get_price_matrix
+from entity_tree import get_entity_tree
+from maintenance import get_maintenance_scheduler
+from activity_writer import get_activity_writer
+from attachment_store import get_attachment_store
+from constants import PRICE_RULE_PERCENT, PRICE_RULE_DELTA, PRICE_RULE_CATALOG, PRICE_RULE_ENTITY
 
 
 class DatabaseManager:
@@ -23,12 +35,30 @@ class DatabaseManager:
     - Balance tracking
     - Analytics and reporting
     - Automatic backups
+    
+    One instance is shared by all sessions and threads (main.get_db): every
+    call opens its own connection (or uses the calling pool thread's
+    read-only one) and the caches it holds are thread-safe.
     """
     
+    # Maximum number of worker threads used by run_queries
+    READ_POOL_SIZE = 6
+    
     def __init__(self, db_name="lab_database.db"):
         self.db_name = db_name
         self.backup_folder = "backups"
+        self._read_local = threading.local()
+        self._read_pool = None
+        self._read_pool_lock = threading.Lock()
+        self.monitor = QueryMonitor(db_name)
         self.init_db()
+        self.price_matrix = get_price_matrix(db_name)
+        self.entity_tree = get_entity_tree(db_name)
+        self.maintenance = get_maintenance_scheduler(db_name)
+        self.maintenance.watch(self.monitor)
+        self.activity_writer = get_activity_writer(db_name)
+        self.maintenance.watch(self.activity_writer)
+        self.attachments = get_attachment_store(db_name)
         
     # =========================================================================
     #                         DATABASE INITIALIZATION
@@ -42,6 +72,13 @@ class DatabaseManager:
             # Enable foreign keys
             cursor.execute("PRAGMA foreign_keys = ON")
             
+            # Only takes effect on a new, empty file; existing files are
+            # switched by the one-off VACUUM of the idle maintenance run
+            cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            
+            # WAL lets the read-only pool run concurrently with writers
+            cursor.execute("PRAGMA journal_mode = WAL")
+            
             self._create_doctors_table(cursor)
             self._create_cases_table(cursor)
             self._create_prices_table(cursor)
@@ -54,6 +91,7 @@ class DatabaseManager:
             
             self._create_indexes(cursor)
             self._migrate_existing_columns(cursor)
+            self._migrate_entity_ids(cursor)
             
             conn.commit()
     
@@ -68,12 +106,13 @@ class DatabaseManager:
                 email TEXT,
                 address TEXT,
                 is_center INTEGER DEFAULT 0,
+                parent_id INTEGER,
                 center_parent TEXT,
                 is_active INTEGER DEFAULT 1,
                 notes TEXT,
                 created_at TEXT DEFAULT (datetime('now')),
                 updated_at TEXT DEFAULT (datetime('now')),
-                FOREIGN KEY (center_parent) REFERENCES doctors_list(name) ON DELETE CASCADE
+                FOREIGN KEY (parent_id) REFERENCES doctors_list(id) ON DELETE CASCADE
             )
         """)
     
@@ -84,6 +123,9 @@ class DatabaseManager:
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 case_code TEXT UNIQUE NOT NULL,
                 patient TEXT NOT NULL,
+                entity_id INTEGER,
+                branch_id INTEGER,
+                doctor_id INTEGER,
                 doctor TEXT NOT NULL,
                 dental_center TEXT,
                 branch_name TEXT,
@@ -106,7 +148,10 @@ class DatabaseManager:
                 tax REAL DEFAULT 0,
                 final_price REAL,
                 created_at TEXT DEFAULT (datetime('now')),
-                updated_at TEXT DEFAULT (datetime('now'))
+                updated_at TEXT DEFAULT (datetime('now')),
+                FOREIGN KEY (entity_id) REFERENCES doctors_list(id),
+                FOREIGN KEY (branch_id) REFERENCES doctors_list(id),
+                FOREIGN KEY (doctor_id) REFERENCES doctors_list(id)
             )
         """)
     
@@ -115,6 +160,7 @@ class DatabaseManager:
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS doctors_prices (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
+                entity_id INTEGER NOT NULL,
                 doc_name TEXT NOT NULL,
                 material TEXT NOT NULL,
                 price REAL NOT NULL,
@@ -123,7 +169,8 @@ class DatabaseManager:
                 is_active INTEGER DEFAULT 1,
                 created_at TEXT DEFAULT (datetime('now')),
                 updated_at TEXT DEFAULT (datetime('now')),
-                UNIQUE(doc_name, material)
+                UNIQUE(entity_id, material),
+                FOREIGN KEY (entity_id) REFERENCES doctors_list(id) ON DELETE CASCADE
             )
         """)
     
@@ -133,6 +180,8 @@ class DatabaseManager:
             CREATE TABLE IF NOT EXISTS invoices (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 invoice_number TEXT UNIQUE NOT NULL,
+                entity_id INTEGER,
+                branch_id INTEGER,
                 doctor_name TEXT NOT NULL,
                 dental_center TEXT,
                 branch_name TEXT,
@@ -148,7 +197,9 @@ class DatabaseManager:
                 cancelled_at TEXT,
                 cancelled_by TEXT,
                 cancellation_reason TEXT,
-                created_at TEXT DEFAULT (datetime('now'))
+                created_at TEXT DEFAULT (datetime('now')),
+                FOREIGN KEY (entity_id) REFERENCES doctors_list(id),
+                FOREIGN KEY (branch_id) REFERENCES doctors_list(id)
             )
         """)
     
@@ -169,6 +220,8 @@ class DatabaseManager:
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS balances (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
+                entity_id INTEGER,
+                branch_id INTEGER,
                 entity_name TEXT NOT NULL,
                 entity_type TEXT NOT NULL,
                 branch_name TEXT,
@@ -179,7 +232,8 @@ class DatabaseManager:
                 total_invoiced REAL DEFAULT 0,
                 notes TEXT,
                 last_updated TEXT DEFAULT (datetime('now')),
-                UNIQUE(entity_name, branch_name)
+                FOREIGN KEY (entity_id) REFERENCES doctors_list(id),
+                FOREIGN KEY (branch_id) REFERENCES doctors_list(id)
             )
         """)
     
@@ -188,6 +242,8 @@ class DatabaseManager:
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS payments (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
+                entity_id INTEGER,
+                branch_id INTEGER,
                 entity_name TEXT NOT NULL,
                 branch_name TEXT,
                 amount REAL NOT NULL,
@@ -196,7 +252,9 @@ class DatabaseManager:
                 payment_date TEXT NOT NULL,
                 notes TEXT,
                 created_by TEXT,
-                created_at TEXT DEFAULT (datetime('now'))
+                created_at TEXT DEFAULT (datetime('now')),
+                FOREIGN KEY (entity_id) REFERENCES doctors_list(id),
+                FOREIGN KEY (branch_id) REFERENCES doctors_list(id)
             )
         """)
     
@@ -253,7 +311,6 @@ class DatabaseManager:
         indexes = [
             # Cases table indexes
             "CREATE INDEX IF NOT EXISTS idx_cases_doctor ON cases(doctor)",
-            "CREATE INDEX IF NOT EXISTS idx_cases_dental_center ON cases(dental_center)",
             "CREATE INDEX IF NOT EXISTS idx_cases_status ON cases(status)",
             "CREATE INDEX IF NOT EXISTS idx_cases_entry_date ON cases(entry_date)",
             "CREATE INDEX IF NOT EXISTS idx_cases_expected_delivery ON cases(expected_delivery)",
@@ -261,13 +318,10 @@ class DatabaseManager:
             "CREATE INDEX IF NOT EXISTS idx_cases_patient ON cases(patient)",
             
             # Invoices table indexes
-            "CREATE INDEX IF NOT EXISTS idx_invoices_doctor ON invoices(doctor_name)",
             "CREATE INDEX IF NOT EXISTS idx_invoices_date ON invoices(issue_date)",
             "CREATE INDEX IF NOT EXISTS idx_invoices_cancelled ON invoices(is_cancelled)",
             
             # Composite indexes
-            "CREATE INDEX IF NOT EXISTS idx_cases_doctor_paid ON cases(doctor, is_paid)",
-            "CREATE INDEX IF NOT EXISTS idx_cases_center_branch ON cases(dental_center, branch_name)",
             "CREATE INDEX IF NOT EXISTS idx_cases_status_delivery ON cases(status, expected_delivery)",
         ]
         
@@ -316,8 +370,9 @@ class DatabaseManager:
             "address": "TEXT",
             "is_active": "INTEGER DEFAULT 1",
             "notes": "TEXT",
-            "created_at": "TEXT DEFAULT (datetime('now'))",
-            "updated_at": "TEXT DEFAULT (datetime('now'))"
+            # ALTER TABLE only accepts constant defaults
+            "created_at": "TEXT",
+            "updated_at": "TEXT"
         }
         
         for col_name, col_type in doctor_columns.items():
@@ -350,8 +405,8 @@ class DatabaseManager:
             "cost_price": "REAL DEFAULT 0",
             "notes": "TEXT",
             "is_active": "INTEGER DEFAULT 1",
-            "created_at": "TEXT DEFAULT (datetime('now'))",
-            "updated_at": "TEXT DEFAULT (datetime('now'))"
+            "created_at": "TEXT",
+            "updated_at": "TEXT"
         }
         
         for col_name, col_type in price_columns.items():
@@ -359,6 +414,179 @@ class DatabaseManager:
                 cursor.execute(f"ALTER TABLE doctors_prices ADD COLUMN {col_name} {col_type}")
             except sqlite3.OperationalError:
                 pass
+        
+        # Balances table columns (running totals, see reconcile_balances)
+        balance_columns = {
+            "total_paid": "REAL DEFAULT 0",
+            "total_invoiced": "REAL DEFAULT 0"
+        }
+        
+        for col_name, col_type in balance_columns.items():
+            try:
+                cursor.execute(f"ALTER TABLE balances ADD COLUMN {col_name} {col_type}")
+            except sqlite3.OperationalError:
+                pass
+    
+    def _migrate_entity_ids(self, cursor):
+        """
+        Move entity references from name strings to integer doctors_list ids
+        
+        Adds the id columns to existing tables, backfills them from the
+        denormalized names (which are kept for display only) and replaces
+        the name-based indexes with id-based ones.
+        """
+        id_columns = {
+            "doctors_list": ["parent_id"],
+            "cases": ["entity_id", "branch_id", "doctor_id"],
+            "doctors_prices": ["entity_id"],
+            "invoices": ["entity_id", "branch_id"],
+            "balances": ["entity_id", "branch_id"],
+            "payments": ["entity_id", "branch_id"],
+        }
+        
+        for table, columns in id_columns.items():
+            for col_name in columns:
+                try:
+                    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {col_name} INTEGER")
+                except sqlite3.OperationalError:
+                    pass
+        
+        backfill = [
+            # Branch → center
+            """
+            UPDATE doctors_list SET parent_id = (
+                SELECT p.id FROM doctors_list p WHERE p.name = doctors_list.center_parent
+            )
+            WHERE parent_id IS NULL AND center_parent IS NOT NULL
+            """,
+            # Cases bill the center when there is one, otherwise the doctor
+            """
+            UPDATE cases SET entity_id = (
+                SELECT d.id FROM doctors_list d
+                WHERE d.name = COALESCE(NULLIF(cases.dental_center, ''), cases.doctor)
+            )
+            WHERE entity_id IS NULL
+            """,
+            """
+            UPDATE cases SET branch_id = (
+                SELECT d.id FROM doctors_list d WHERE d.name = cases.branch_name
+            )
+            WHERE branch_id IS NULL AND COALESCE(branch_name, '') != ''
+            """,
+            # The treating doctor, also when the case is billed to a center
+            """
+            UPDATE cases SET doctor_id = (
+                SELECT d.id FROM doctors_list d WHERE d.name = cases.doctor
+            )
+            WHERE doctor_id IS NULL
+            """,
+            """
+            UPDATE doctors_prices SET entity_id = (
+                SELECT d.id FROM doctors_list d WHERE d.name = doctors_prices.doc_name
+            )
+            WHERE entity_id IS NULL
+            """,
+            """
+            UPDATE invoices SET entity_id = (
+                SELECT d.id FROM doctors_list d
+                WHERE d.name = COALESCE(NULLIF(invoices.dental_center, ''), invoices.doctor_name)
+            )
+            WHERE entity_id IS NULL
+            """,
+            """
+            UPDATE invoices SET branch_id = (
+                SELECT d.id FROM doctors_list d WHERE d.name = invoices.branch_name
+            )
+            WHERE branch_id IS NULL AND COALESCE(branch_name, '') != ''
+            """,
+        ]
+        for table in ("balances", "payments"):
+            backfill.append(f"""
+                UPDATE {table} SET entity_id = (
+                    SELECT d.id FROM doctors_list d WHERE d.name = {table}.entity_name
+                )
+                WHERE entity_id IS NULL
+            """)
+            backfill.append(f"""
+                UPDATE {table} SET branch_id = (
+                    SELECT d.id FROM doctors_list d WHERE d.name = {table}.branch_name
+                )
+                WHERE branch_id IS NULL AND COALESCE(branch_name, '') != ''
+            """)
+        
+        for sql in backfill:
+            cursor.execute(sql)
+        
+        # Rows whose names match no doctors_list entry cannot be keyed on ids:
+        # prices and balances are moved aside (see _set_aside_rows), the
+        # ledger tables keep them with a NULL id and are only reported
+        unresolved = "entity_id IS NULL OR (COALESCE(branch_name, '') != '' AND branch_id IS NULL)"
+        self._set_aside_rows(cursor, "doctors_prices", "entity_id IS NULL")
+        self._set_aside_rows(cursor, "balances", unresolved)
+        # One balance per account: older duplicates of the same ids go aside too
+        self._set_aside_rows(cursor, "balances", """
+            id NOT IN (SELECT MAX(id) FROM balances GROUP BY entity_id, COALESCE(branch_id, 0))
+        """)
+        for table, condition in (("cases", "entity_id IS NULL"), ("invoices", "entity_id IS NULL"),
+                                 ("payments", unresolved)):
+            count = cursor.execute(f"SELECT COUNT(*) FROM {table} WHERE {condition}").fetchone()[0]
+            if count:
+                print(f"Migration warning: {count} {table} row(s) reference an unknown doctor/center/branch")
+        
+        # Legacy tables are still unique on the names, which rename_entity rewrites
+        self._rebuild_name_keyed_table(cursor, "doctors_prices", "doc_name", self._create_prices_table)
+        self._rebuild_name_keyed_table(cursor, "balances", "entity_name", self._create_balances_table)
+        
+        # Name-based indexes superseded by the id-based ones below
+        for old_index in ("idx_cases_dental_center", "idx_cases_doctor_paid",
+                          "idx_cases_center_branch", "idx_invoices_doctor", "idx_balances_entity"):
+            cursor.execute(f"DROP INDEX IF EXISTS {old_index}")
+        
+        indexes = [
+            "CREATE INDEX IF NOT EXISTS idx_doctors_parent ON doctors_list(parent_id)",
+            "CREATE INDEX IF NOT EXISTS idx_cases_entity_paid ON cases(entity_id, is_paid)",
+            "CREATE INDEX IF NOT EXISTS idx_cases_entity_branch ON cases(entity_id, branch_id, is_paid)",
+            "CREATE INDEX IF NOT EXISTS idx_cases_doctor_id ON cases(doctor_id)",
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_prices_entity_material ON doctors_prices(entity_id, material)",
+            "CREATE INDEX IF NOT EXISTS idx_invoices_entity ON invoices(entity_id, branch_id)",
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_balances_entity_branch ON balances(entity_id, COALESCE(branch_id, 0))",
+            "CREATE INDEX IF NOT EXISTS idx_payments_entity ON payments(entity_id, branch_id)",
+        ]
+        for idx_sql in indexes:
+            cursor.execute(idx_sql)
+    
+    def _set_aside_rows(self, cursor, table: str, condition: str):
+        """
+        Move rows matching condition into {table}_unmatched and report them
+        
+        Nothing is deleted for good: the rows can be fixed (e.g. by adding
+        the missing doctor) and copied back by hand.
+        """
+        count = cursor.execute(f"SELECT COUNT(*) FROM {table} WHERE {condition}").fetchone()[0]
+        if not count:
+            return
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {table}_unmatched AS SELECT * FROM {table} WHERE 0")
+        columns = ", ".join(row[1] for row in cursor.execute(f"PRAGMA table_info({table}_unmatched)"))
+        cursor.execute(f"INSERT INTO {table}_unmatched ({columns}) SELECT {columns} FROM {table} WHERE {condition}")
+        cursor.execute(f"DELETE FROM {table} WHERE {condition}")
+        print(f"Migration warning: moved {count} {table} row(s) without a matching doctor/center "
+              f"to {table}_unmatched")
+    
+    def _rebuild_name_keyed_table(self, cursor, table: str, name_column: str, create_table):
+        """Recreate table from its current DDL when a UNIQUE constraint still includes name_column"""
+        name_keyed = any(
+            index[2] and any(col[2] == name_column for col in cursor.execute(f"PRAGMA index_info('{index[1]}')"))
+            for index in cursor.execute(f"PRAGMA index_list({table})").fetchall()
+        )
+        if not name_keyed:
+            return
+        cursor.execute(f"ALTER TABLE {table} RENAME TO {table}_legacy")
+        create_table(cursor)
+        new_columns = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+        columns = ", ".join(row[1] for row in cursor.execute(f"PRAGMA table_info({table}_legacy)")
+                            if row[1] in new_columns)
+        cursor.execute(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {table}_legacy")
+        cursor.execute(f"DROP TABLE {table}_legacy")
     
     # =========================================================================
     #                         BASIC DATABASE OPERATIONS
@@ -366,25 +594,99 @@ class DatabaseManager:
     
     def run_query(self, query: str, params: Tuple = ()) -> pd.DataFrame:
         """Execute SELECT query and return DataFrame"""
+        page = find_calling_page()
+        start = time.perf_counter()
         try:
             with sqlite3.connect(self.db_name) as conn:
-                return pd.read_sql_query(query, conn, params=params)
+                result = pd.read_sql_query(query, conn, params=params)
+            self.monitor.record(query, params, 'query', (time.perf_counter() - start) * 1000,
+                                len(result), page)
+            return result
         except Exception as e:
             print(f"Query error: {e}")
+            self.monitor.record(query, params, 'query', (time.perf_counter() - start) * 1000,
+                                0, page, error=str(e))
             return pd.DataFrame()
     
     def run_action(self, query: str, params: Tuple = ()) -> bool:
         """Execute INSERT/UPDATE/DELETE and return success status"""
+        page = find_calling_page()
+        start = time.perf_counter()
         try:
             with sqlite3.connect(self.db_name) as conn:
                 cursor = conn.cursor()
                 cursor.execute(query, params)
                 conn.commit()
-                return True
+            self.monitor.record(query, params, 'action', (time.perf_counter() - start) * 1000,
+                                cursor.rowcount, page)
+            return True
         except Exception as e:
             print(f"Action error: {e}")
+            self.monitor.record(query, params, 'action', (time.perf_counter() - start) * 1000,
+                                0, page, error=str(e))
             return False
     
+    def run_queries(self, queries: Dict[str, Union[str, Tuple[str, Tuple]]]) -> Dict[str, pd.DataFrame]:
+        """
+        Execute several named SELECT queries in parallel
+        
+        Each value is either a SQL string or a (query, params) tuple. The
+        queries run on a thread pool of read-only WAL connections, so the
+        total latency approaches the slowest query instead of the sum.
+        Returns a dict with the same keys mapped to DataFrames.
+        """
+        if not queries:
+            return {}
+        
+        normalized = {}
+        for name, spec in queries.items():
+            if isinstance(spec, str):
+                normalized[name] = (spec, ())
+            else:
+                normalized[name] = (spec[0], tuple(spec[1]) if len(spec) > 1 else ())
+        
+        page = find_calling_page()
+        pool = self._get_read_pool()
+        futures = {
+            name: pool.submit(self._run_read_query, query, params, page)
+            for name, (query, params) in normalized.items()
+        }
+        return {name: future.result() for name, future in futures.items()}
+    
+    def _get_read_pool(self) -> ThreadPoolExecutor:
+        """Lazily create the thread pool used for batch reads"""
+        if self._read_pool is None:
+            with self._read_pool_lock:
+                if self._read_pool is None:
+                    self._read_pool = ThreadPoolExecutor(
+                        max_workers=self.READ_POOL_SIZE,
+                        thread_name_prefix="a1-db-read"
+                    )
+        return self._read_pool
+    
+    def _get_read_connection(self) -> sqlite3.Connection:
+        """Return this thread's read-only connection, opening it on first use"""
+        conn = getattr(self._read_local, 'conn', None)
+        if conn is None:
+            uri = f"file:{pathname2url(os.path.abspath(self.db_name))}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            self._read_local.conn = conn
+        return conn
+    
+    def _run_read_query(self, query: str, params: Tuple = (), page: str = "-") -> pd.DataFrame:
+        """Execute a SELECT on the calling pool thread's read-only connection"""
+        start = time.perf_counter()
+        try:
+            result = pd.read_sql_query(query, self._get_read_connection(), params=params)
+            self.monitor.record(query, params, 'batch', (time.perf_counter() - start) * 1000,
+                                len(result), page)
+            return result
+        except Exception as e:
+            print(f"Query error: {e}")
+            self.monitor.record(query, params, 'batch', (time.perf_counter() - start) * 1000,
+                                0, page, error=str(e))
+            return pd.DataFrame()
+    
     # =========================================================================
     #                         BACKUP OPERATIONS
     # =========================================================================
@@ -399,13 +701,44 @@ class DatabaseManager:
         backup_path = os.path.join(self.backup_folder, backup_name)
         
         try:
-            shutil.copy2(self.db_name, backup_path)
+            # SQLite's online backup copies a consistent snapshot, including
+            # pages still in the -wal file that a plain file copy would miss
+            with sqlite3.connect(self.db_name) as src, sqlite3.connect(backup_path) as dst:
+                src.backup(dst)
             self._cleanup_old_backups()
             return backup_path
         except Exception as e:
             print(f"Backup error: {e}")
             return None
     
+    def restore_database(self, backup_path: str) -> Optional[str]:
+        """
+        Replace the database contents with a backup
+        
+        The backup must pass PRAGMA quick_check. The current database is
+        backed up first; returns that safety backup's path, None on error.
+        Other processes keep their caches (prices, entity tree, sessions)
+        and should be restarted.
+        """
+        try:
+            if not os.path.isfile(backup_path):
+                raise FileNotFoundError(backup_path)
+            with sqlite3.connect(backup_path) as src:
+                check = src.execute("PRAGMA quick_check").fetchone()[0]
+                if check != "ok":
+                    raise ValueError(f"{backup_path} failed quick_check: {check}")
+                safety_backup = self.backup_database()
+                if not safety_backup:
+                    raise OSError("could not back up the current database first")
+                with sqlite3.connect(self.db_name) as dst:
+                    src.backup(dst)
+            self.price_matrix.invalidate()
+            self.entity_tree.invalidate()
+            return safety_backup
+        except Exception as e:
+            print(f"Restore error: {e}")
+            return None
+    
     def _cleanup_old_backups(self, max_backups: int = 30):
         """Keep only the most recent backups"""
         backups = sorted(glob.glob(os.path.join(self.backup_folder, "*.db")))
@@ -427,21 +760,41 @@ class DatabaseManager:
         return f"A1-{timestamp}"
     
     def add_case(self, case_data: Dict[str, Any]) -> Optional[str]:
-        """Add new case to database"""
+        """
+        Add new case to database
+        
+        entity_id/branch_id are the billing keys and doctor_id the treating
+        doctor; when missing they are resolved from the display names.
+        """
         case_code = self.get_next_case_code()
         
+        entity_id = case_data.get('entity_id')
+        if entity_id is None:
+            entity_id = self.get_entity_id(case_data.get('dental_center') or case_data.get('doctor'))
+        
+        branch_id = case_data.get('branch_id')
+        if branch_id is None and case_data.get('branch_name'):
+            branch_id = self.get_entity_id(case_data.get('branch_name'))
+        
+        doctor_id = case_data.get('doctor_id')
+        if doctor_id is None:
+            doctor_id = self.get_entity_id(case_data.get('doctor'))
+        
         query = """
             INSERT INTO cases (
-                case_code, patient, doctor, dental_center, branch_name,
+                case_code, patient, entity_id, branch_id, doctor_id, doctor, dental_center, branch_name,
                 entry_date, expected_delivery, color, teeth_map, notes,
                 price, count, is_try_in, try_in_date, priority,
                 lab_technician, discount, tax, final_price, attachment, status
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """
         
         params = (
             case_code,
             case_data.get('patient'),
+            entity_id,
+            branch_id,
+            doctor_id,
             case_data.get('doctor'),
             case_data.get('dental_center'),
             case_data.get('branch_name'),
@@ -527,7 +880,9 @@ class DatabaseManager:
             INSERT OR IGNORE INTO doctors_list (name, doc_code, phone, email, is_center)
             VALUES (?, ?, ?, ?, 0)
         """
-        return self.run_action(query, (name, doc_code, phone, email))
+        added = self.run_action(query, (name, doc_code, phone, email))
+        self.entity_tree.invalidate()
+        return added
     
     def add_dental_center(self, name: str, phone: str = None, email: str = None) -> bool:
         """Add new dental center"""
@@ -536,22 +891,112 @@ class DatabaseManager:
             INSERT OR IGNORE INTO doctors_list (name, doc_code, phone, email, is_center)
             VALUES (?, ?, ?, ?, 1)
         """
-        return self.run_action(query, (name, center_code, phone, email))
+        added = self.run_action(query, (name, center_code, phone, email))
+        self.entity_tree.invalidate()
+        return added
     
-    def add_branch(self, branch_name: str, center_name: str) -> bool:
+    def add_branch(self, branch_name: str, center_id: int) -> bool:
         """Add branch to dental center"""
         branch_code = f"B-{branch_name[:3].upper()}"
         query = """
-            INSERT OR IGNORE INTO doctors_list (name, doc_code, is_center, center_parent)
-            VALUES (?, ?, 0, ?)
+            INSERT OR IGNORE INTO doctors_list (name, doc_code, is_center, parent_id, center_parent)
+            VALUES (?, ?, 0, ?, (SELECT name FROM doctors_list WHERE id = ?))
         """
-        return self.run_action(query, (branch_name, branch_code, center_name))
+        added = self.run_action(query, (branch_name, branch_code, center_id, center_id))
+        self.entity_tree.invalidate()
+        return added
+    
+    def delete_entity(self, entity_id: int) -> bool:
+        """Delete a doctor, center or branch together with its branches and prices"""
+        try:
+            with sqlite3.connect(self.db_name) as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    DELETE FROM doctors_prices
+                    WHERE entity_id IN (SELECT id FROM doctors_list WHERE id = ? OR parent_id = ?)
+                """, (entity_id, entity_id))
+                cursor.execute("DELETE FROM doctors_list WHERE id = ? OR parent_id = ?",
+                               (entity_id, entity_id))
+                conn.commit()
+            self.price_matrix.invalidate()
+            self.entity_tree.invalidate()
+            return True
+        except Exception as e:
+            print(f"Error deleting entity: {e}")
+            return False
+    
+    def rename_entity(self, entity_id: int, new_name: str) -> bool:
+        """
+        Rename a doctor, center or branch
+        
+        References are integer ids, so only the denormalized display names
+        are refreshed; every update is keyed on an indexed id column.
+        """
+        try:
+            with sqlite3.connect(self.db_name) as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT name, is_center FROM doctors_list WHERE id = ?", (entity_id,))
+                row = cursor.fetchone()
+                if not row:
+                    return False
+                old_name, is_center = row
+                
+                cursor.execute(
+                    "UPDATE doctors_list SET name = ?, updated_at = datetime('now') WHERE id = ?",
+                    (new_name, entity_id)
+                )
+                cursor.execute("UPDATE doctors_list SET center_parent = ? WHERE parent_id = ?",
+                               (new_name, entity_id))
+                
+                cursor.execute("UPDATE cases SET doctor = ? WHERE doctor_id = ?",
+                               (new_name, entity_id))
+                if is_center:
+                    cursor.execute("UPDATE cases SET dental_center = ? WHERE entity_id = ?",
+                                   (new_name, entity_id))
+                cursor.execute("UPDATE cases SET branch_name = ? WHERE branch_id = ?",
+                               (new_name, entity_id))
+                
+                cursor.execute("UPDATE doctors_prices SET doc_name = ? WHERE entity_id = ?",
+                               (new_name, entity_id))
+                
+                cursor.execute("UPDATE invoices SET doctor_name = ? WHERE entity_id = ? AND doctor_name = ?",
+                               (new_name, entity_id, old_name))
+                if is_center:
+                    cursor.execute("UPDATE invoices SET dental_center = ? WHERE entity_id = ?",
+                                   (new_name, entity_id))
+                cursor.execute("UPDATE invoices SET branch_name = ? WHERE branch_id = ?",
+                               (new_name, entity_id))
+                
+                for table in ("balances", "payments"):
+                    cursor.execute(f"UPDATE {table} SET entity_name = ? WHERE entity_id = ?",
+                                   (new_name, entity_id))
+                    cursor.execute(f"UPDATE {table} SET branch_name = ? WHERE branch_id = ?",
+                                   (new_name, entity_id))
+                
+                conn.commit()
+            self.entity_tree.invalidate()
+            return True
+        except Exception as e:
+            print(f"Error renaming entity: {e}")
+            return False
+    
+    def get_entity_id(self, name: Optional[str]) -> Optional[int]:
+        """Resolve a doctor/center/branch name to its doctors_list id"""
+        if not name:
+            return None
+        result = self.run_query("SELECT id FROM doctors_list WHERE name = ?", (name,))
+        return int(result['id'].values[0]) if not result.empty else None
+    
+    def get_entity(self, entity_id: int) -> Optional[Dict]:
+        """Get a single doctors_list row by id"""
+        result = self.run_query("SELECT * FROM doctors_list WHERE id = ?", (entity_id,))
+        return result.iloc[0].to_dict() if not result.empty else None
     
     def get_all_doctors(self) -> pd.DataFrame:
         """Get all active doctors"""
         query = """
             SELECT * FROM doctors_list 
-            WHERE is_center = 0 AND center_parent IS NULL AND is_active = 1
+            WHERE is_center = 0 AND parent_id IS NULL AND is_active = 1
             ORDER BY name
         """
         return self.run_query(query)
@@ -565,66 +1010,329 @@ class DatabaseManager:
         """
         return self.run_query(query)
     
-    def get_branches(self, center_name: str) -> pd.DataFrame:
+    def get_entity_hierarchy(self) -> List[Dict]:
+        """
+        Every doctor and center with its branches, from the cached entity tree
+        
+        One recursive query per change instead of one query per center.
+        """
+        return self.entity_tree.get_tree()
+    
+    def get_branches(self, center_id: int) -> pd.DataFrame:
         """Get all branches for a dental center"""
-        query = "SELECT * FROM doctors_list WHERE center_parent = ? ORDER BY name"
-        return self.run_query(query, (center_name,))
+        query = "SELECT * FROM doctors_list WHERE parent_id = ? ORDER BY name"
+        return self.run_query(query, (center_id,))
     
     # =========================================================================
     #                         PRICING OPERATIONS
     # =========================================================================
     
-    def add_material_price(self, doc_name: str, material: str, price: float, cost_price: float = 0) -> bool:
+    def add_material_price(self, entity_id: int, material: str, price: float, cost_price: float = 0) -> bool:
         """Add or update material price for doctor/center"""
         query = """
-            INSERT INTO doctors_prices (doc_name, material, price, cost_price)
-            VALUES (?, ?, ?, ?)
-            ON CONFLICT(doc_name, material) DO UPDATE SET 
+            INSERT INTO doctors_prices (entity_id, doc_name, material, price, cost_price)
+            VALUES (?, (SELECT name FROM doctors_list WHERE id = ?), ?, ?, ?)
+            ON CONFLICT(entity_id, material) DO UPDATE SET 
                 price = excluded.price,
                 cost_price = excluded.cost_price,
                 updated_at = datetime('now')
         """
-        return self.run_action(query, (doc_name, material, price, cost_price))
+        success = self.run_action(query, (entity_id, entity_id, material, price, cost_price))
+        self.price_matrix.invalidate()
+        return success
+    
+    def update_price(self, price_id: int, price: float) -> bool:
+        """Update the price of an existing doctors_prices row"""
+        success = self.run_action(
+            "UPDATE doctors_prices SET price = ?, updated_at = datetime('now') WHERE id = ?",
+            (price, price_id)
+        )
+        self.price_matrix.invalidate()
+        return success
     
-    def get_price(self, doctor_name: str, material_name: str) -> float:
-        """Get price for specific material and doctor"""
-        query = "SELECT price FROM doctors_prices WHERE doc_name = ? AND material = ? AND is_active = 1"
-        result = self.run_query(query, (doctor_name, material_name))
-        return result['price'].values[0] if not result.empty else 0
+    def delete_price(self, price_id: int) -> bool:
+        """Delete a doctors_prices row"""
+        success = self.run_action("DELETE FROM doctors_prices WHERE id = ?", (price_id,))
+        self.price_matrix.invalidate()
+        return success
     
-    def get_all_prices_for_entity(self, entity_name: str) -> pd.DataFrame:
+    def bulk_upsert_prices(self, entity_id: int, prices: List[Dict[str, Any]],
+                           user: str = None) -> Optional[Dict[str, int]]:
+        """
+        Replace the price list of a doctor/center/branch with an edited copy
+        
+        prices is the complete new list of {material, price, cost_price}
+        (cost_price optional, kept when missing). It is diffed against the
+        active rows: new materials are inserted (a deactivated row of the
+        material is switched back on instead), changed ones updated and
+        missing ones deleted, all in one transaction together with a single
+        audit_log entry. Deactivated rows not in the list are left alone.
+        Returns {inserted, updated, deleted}, None on error.
+        """
+        desired = {}
+        for row in prices:
+            material = str(row.get('material') or '').strip()
+            if material:
+                desired[material] = row
+        
+        try:
+            with sqlite3.connect(self.db_name) as conn:
+                cursor = conn.cursor()
+                current, inactive = {}, {}
+                for price_id, material, price, cost_price, is_active in cursor.execute(
+                    "SELECT id, material, price, cost_price, is_active FROM doctors_prices WHERE entity_id = ?",
+                    (entity_id,)
+                ).fetchall():
+                    (current if is_active else inactive)[material] = (price_id, price, cost_price)
+                
+                inserts, reactivations, updates, deletes = [], [], [], []
+                old_values, new_values = {}, {}
+                for material, row in desired.items():
+                    # Empty editor cells arrive as None or NaN
+                    price = 0.0 if pd.isna(row.get('price')) else float(row['price'])
+                    cost_price = None if pd.isna(row.get('cost_price')) else float(row['cost_price'])
+                    if material in inactive:
+                        price_id, _, old_cost = inactive[material]
+                        if cost_price is None:
+                            cost_price = float(old_cost or 0)
+                        reactivations.append((price, cost_price, price_id))
+                        new_values[material] = price
+                        continue
+                    if material not in current:
+                        inserts.append((entity_id, entity_id, material, price, cost_price or 0.0))
+                        new_values[material] = price
+                        continue
+                    price_id, old_price, old_cost = current[material]
+                    if cost_price is None:
+                        cost_price = float(old_cost or 0)
+                    if price != old_price or cost_price != (old_cost or 0):
+                        updates.append((price, cost_price, price_id))
+                        old_values[material] = old_price
+                        new_values[material] = price
+                for material, (price_id, old_price, _) in current.items():
+                    if material not in desired:
+                        deletes.append((price_id,))
+                        old_values[material] = old_price
+                
+                if not (inserts or reactivations or updates or deletes):
+                    return {"inserted": 0, "updated": 0, "deleted": 0}
+                
+                cursor.executemany("DELETE FROM doctors_prices WHERE id = ?", deletes)
+                cursor.executemany("""
+                    UPDATE doctors_prices SET price = ?, cost_price = ?, updated_at = datetime('now')
+                    WHERE id = ?
+                """, updates)
+                cursor.executemany("""
+                    UPDATE doctors_prices SET price = ?, cost_price = ?, is_active = 1, updated_at = datetime('now')
+                    WHERE id = ?
+                """, reactivations)
+                cursor.executemany("""
+                    INSERT INTO doctors_prices (entity_id, doc_name, material, price, cost_price)
+                    VALUES (?, (SELECT name FROM doctors_list WHERE id = ?), ?, ?, ?)
+                """, inserts)
+                # Written with the changes (not through the activity writer) so both commit together
+                cursor.execute("""
+                    INSERT INTO audit_log (table_name, record_id, action, old_values, new_values, user)
+                    VALUES ('doctors_prices', ?, 'BULK_UPDATE', ?, ?, ?)
+                """, (entity_id, json.dumps(old_values, ensure_ascii=False),
+                      json.dumps(new_values, ensure_ascii=False), user))
+                conn.commit()
+        except Exception as e:
+            print(f"Error saving price list: {e}")
+            return None
+        finally:
+            self.price_matrix.invalidate()
+        
+        return {"inserted": len(inserts) + len(reactivations), "updated": len(updates), "deleted": len(deletes)}
+    
+    def _price_adjustment_sql(self, rule: str, entity_ids: List[int], materials: Optional[List[str]],
+                              value: float = 0, round_to: float = 0,
+                              source_entity_id: Optional[int] = None) -> Tuple[str, Dict[str, Any]]:
+        """
+        SELECT of the (entity_id, material, old_price, new_price, new_cost) rows
+        a mass adjustment changes, with its named parameters
+        
+        Percentage and fixed-delta rules change existing active prices only; the copy
+        rules also produce rows (old_price NULL) for materials the entity has
+        no active price for yet, carrying over the source cost price.
+        materials None means every material.
+        """
+        params = {
+            "entities": json.dumps([int(e) for e in entity_ids]),
+            "materials": json.dumps(list(materials)) if materials else None,
+            "value": float(value or 0),
+            "round_to": float(round_to or 0),
+            "source": source_entity_id,
+        }
+        if rule in (PRICE_RULE_PERCENT, PRICE_RULE_DELTA):
+            new_price = "p.price * (1 + :value / 100.0)" if rule == PRICE_RULE_PERCENT else "p.price + :value"
+            base = f"""
+                SELECT p.entity_id, p.material, p.price AS old_price, {new_price} AS raw_price,
+                       p.cost_price AS new_cost
+                FROM doctors_prices p
+                WHERE p.entity_id IN (SELECT value FROM json_each(:entities))
+                  AND p.is_active = 1
+                  AND (:materials IS NULL OR p.material IN (SELECT value FROM json_each(:materials)))
+            """
+        elif rule == PRICE_RULE_CATALOG:
+            base = """
+                SELECT e.value AS entity_id, c.material_name AS material,
+                       p.price AS old_price, c.default_price AS raw_price, c.default_cost AS new_cost
+                FROM json_each(:entities) e
+                JOIN material_catalog c ON c.is_active = 1
+                LEFT JOIN doctors_prices p
+                       ON p.entity_id = e.value AND p.material = c.material_name AND p.is_active = 1
+                WHERE :materials IS NULL OR c.material_name IN (SELECT value FROM json_each(:materials))
+            """
+        elif rule == PRICE_RULE_ENTITY:
+            base = """
+                SELECT e.value AS entity_id, s.material, p.price AS old_price, s.price AS raw_price,
+                       s.cost_price AS new_cost
+                FROM json_each(:entities) e
+                JOIN doctors_prices s ON s.entity_id = :source AND s.is_active = 1
+                LEFT JOIN doctors_prices p
+                       ON p.entity_id = e.value AND p.material = s.material AND p.is_active = 1
+                WHERE e.value != :source
+                  AND (:materials IS NULL OR s.material IN (SELECT value FROM json_each(:materials)))
+            """
+        else:
+            raise ValueError(f"Unknown price rule: {rule}")
+        
+        query = f"""
+            SELECT entity_id, material, old_price, new_price, new_cost
+            FROM (
+                SELECT entity_id, material, old_price, new_cost,
+                       MAX(0, CASE WHEN :round_to > 0
+                                   THEN ROUND(raw_price / :round_to) * :round_to
+                                   ELSE ROUND(raw_price, 2) END) AS new_price
+                FROM ({base})
+            )
+            WHERE old_price IS NULL OR new_price != old_price
+        """
+        return query, params
+    
+    def preview_price_adjustment(self, rule: str, entity_ids: List[int], materials: Optional[List[str]] = None,
+                                 value: float = 0, round_to: float = 0,
+                                 source_entity_id: Optional[int] = None) -> pd.DataFrame:
+        """Price rows a mass adjustment would change, old and new price side by side"""
+        targets, params = self._price_adjustment_sql(
+            rule, entity_ids, materials, value, round_to, source_entity_id
+        )
+        query = f"""
+            SELECT t.entity_id,
+                   COALESCE(parent.name || ' / ', '') || d.name AS entity_name,
+                   t.material, t.old_price, t.new_price,
+                   t.new_price - COALESCE(t.old_price, 0) AS change
+            FROM ({targets}) t
+            JOIN doctors_list d ON d.id = t.entity_id
+            LEFT JOIN doctors_list parent ON parent.id = d.parent_id
+            ORDER BY entity_name, t.material
+        """
+        with sqlite3.connect(self.db_name) as conn:
+            return pd.read_sql_query(query, conn, params=params)
+    
+    def apply_price_adjustment(self, rule: str, entity_ids: List[int], materials: Optional[List[str]] = None,
+                               value: float = 0, round_to: float = 0,
+                               source_entity_id: Optional[int] = None, user: str = None) -> Optional[int]:
+        """
+        Apply a mass adjustment as one INSERT ... SELECT upsert
+        
+        The changed rows are computed by the same query as the preview, so
+        the result matches it. Deactivated rows a copy rule targets are
+        switched back on with the copied cost price, like new rows.
+        One transaction with one audit_log entry;
+        returns the number of price rows written, None on error.
+        """
+        targets, params = self._price_adjustment_sql(
+            rule, entity_ids, materials, value, round_to, source_entity_id
+        )
+        try:
+            with sqlite3.connect(self.db_name) as conn:
+                cursor = conn.cursor()
+                # WHERE true: lets SQLite parse ON CONFLICT after a SELECT with a join
+                cursor.execute(f"""
+                    INSERT INTO doctors_prices (entity_id, doc_name, material, price, cost_price)
+                    SELECT t.entity_id, d.name, t.material, t.new_price, COALESCE(t.new_cost, 0)
+                    FROM ({targets}) t
+                    JOIN doctors_list d ON d.id = t.entity_id
+                    WHERE true
+                    ON CONFLICT(entity_id, material) DO UPDATE SET
+                        price = excluded.price,
+                        cost_price = CASE WHEN is_active = 1 THEN cost_price ELSE excluded.cost_price END,
+                        is_active = 1,
+                        updated_at = datetime('now')
+                """, params)
+                changed = cursor.rowcount
+                cursor.execute("""
+                    INSERT INTO audit_log (table_name, record_id, action, new_values, user)
+                    VALUES ('doctors_prices', NULL, 'MASS_REPRICE', ?, ?)
+                """, (json.dumps({
+                    "rule": rule, "value": params['value'], "round_to": params['round_to'],
+                    "source_entity_id": source_entity_id, "entity_ids": json.loads(params['entities']),
+                    "materials": materials or None, "rows": changed,
+                }, ensure_ascii=False), user))
+                conn.commit()
+        except Exception as e:
+            print(f"Error applying price adjustment: {e}")
+            return None
+        finally:
+            self.price_matrix.invalidate()
+        return changed
+    
+    def get_price(self, entity_id: int, material_name: str, branch_id: Optional[int] = None) -> float:
+        """Get effective price for specific material: branch, then doctor/center, then catalog default"""
+        return self.price_matrix.get_price(entity_id, material_name, branch_id)
+    
+    def get_effective_prices(self, entity_id: int, branch_id: Optional[int] = None) -> pd.DataFrame:
+        """Effective price list of a doctor/center/branch with the source of every price"""
+        resolved = self.price_matrix.resolve_prices(entity_id, branch_id)
+        rows = [
+            {'material': material, 'price': price, 'cost_price': cost_price, 'source': source}
+            for material, (price, cost_price, source) in sorted(resolved.items())
+        ]
+        return pd.DataFrame(rows, columns=['material', 'price', 'cost_price', 'source'])
+    
+    def get_all_prices_for_entity(self, entity_id: int) -> pd.DataFrame:
         """Get all material prices for a doctor or center"""
         query = """
             SELECT material, price, cost_price, notes 
             FROM doctors_prices 
-            WHERE doc_name = ? AND is_active = 1
+            WHERE entity_id = ? AND is_active = 1
             ORDER BY material
         """
-        return self.run_query(query, (entity_name,))
+        return self.run_query(query, (entity_id,))
     
     # =========================================================================
     #                         BALANCE OPERATIONS
     # =========================================================================
     
-    def get_or_create_balance(self, entity_name: str, entity_type: str = 'doctor', branch_name: str = None) -> Optional[Dict]:
+    def get_or_create_balance(self, entity_id: int, branch_id: Optional[int] = None) -> Optional[Dict]:
         """Get balance record for entity, create if doesn't exist"""
         query = """
             SELECT * FROM balances 
-            WHERE entity_name = ? AND COALESCE(branch_name, '') = COALESCE(?, '')
+            WHERE entity_id = ? AND COALESCE(branch_id, 0) = ?
         """
-        result = self.run_query(query, (entity_name, branch_name or ''))
+        result = self.run_query(query, (entity_id, branch_id or 0))
         
         if result.empty:
             insert_query = """
-                INSERT INTO balances (entity_name, entity_type, branch_name, previous_balance, outstanding_balance)
-                VALUES (?, ?, ?, 0, 0)
+                INSERT OR IGNORE INTO balances (
+                    entity_id, branch_id, entity_name, entity_type, branch_name,
+                    previous_balance, outstanding_balance
+                )
+                SELECT e.id, b.id, e.name,
+                       CASE WHEN e.is_center = 1 THEN 'center' ELSE 'doctor' END,
+                       b.name, 0, 0
+                FROM doctors_list e
+                LEFT JOIN doctors_list b ON b.id = ?
+                WHERE e.id = ?
             """
-            self.run_action(insert_query, (entity_name, entity_type, branch_name))
-            result = self.run_query(query, (entity_name, branch_name or ''))
+            self.run_action(insert_query, (branch_id, entity_id))
+            result = self.run_query(query, (entity_id, branch_id or 0))
         
         return result.iloc[0].to_dict() if not result.empty else None
     
-    def update_balance(self, entity_name: str, branch_name: Optional[str], 
+    def update_balance(self, entity_id: int, branch_id: Optional[int], 
                       previous_balance: float, previous_balance_date: str,
                       outstanding_balance: float, notes: str = '') -> bool:
         """Update balance information"""
@@ -635,27 +1343,28 @@ class DatabaseManager:
                 outstanding_balance = ?,
                 notes = ?,
                 last_updated = datetime('now')
-            WHERE entity_name = ? AND COALESCE(branch_name, '') = COALESCE(?, '')
+            WHERE entity_id = ? AND COALESCE(branch_id, 0) = ?
         """
         return self.run_action(query, (
             previous_balance, previous_balance_date, outstanding_balance, notes,
-            entity_name, branch_name or ''
+            entity_id, branch_id or 0
         ))
     
-    def record_payment(self, entity_name: str, amount: float, payment_method: str,
-                      branch_name: str = None, reference_number: str = None,
+    def record_payment(self, entity_id: int, amount: float, payment_method: str,
+                      branch_id: int = None, reference_number: str = None,
                       notes: str = None, created_by: str = None) -> bool:
         """Record a payment"""
         payment_date = datetime.now().strftime('%Y-%m-%d')
         
         # Insert payment record
         query = """
-            INSERT INTO payments (entity_name, branch_name, amount, payment_method, 
-                                reference_number, payment_date, notes, created_by)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            INSERT INTO payments (entity_id, branch_id, entity_name, branch_name, amount,
+                                payment_method, reference_number, payment_date, notes, created_by)
+            VALUES (?, ?, (SELECT name FROM doctors_list WHERE id = ?),
+                    (SELECT name FROM doctors_list WHERE id = ?), ?, ?, ?, ?, ?, ?)
         """
         success = self.run_action(query, (
-            entity_name, branch_name, amount, payment_method,
+            entity_id, branch_id, entity_id, branch_id, amount, payment_method,
             reference_number, payment_date, notes, created_by
         ))
         
@@ -666,18 +1375,133 @@ class DatabaseManager:
                 SET total_paid = total_paid + ?,
                     outstanding_balance = outstanding_balance - ?,
                     last_updated = datetime('now')
-                WHERE entity_name = ? AND COALESCE(branch_name, '') = COALESCE(?, '')
+                WHERE entity_id = ? AND COALESCE(branch_id, 0) = ?
             """
-            self.run_action(balance_query, (amount, amount, entity_name, branch_name or ''))
+            self.run_action(balance_query, (amount, amount, entity_id, branch_id or 0))
         
         return success
     
+    def reconcile_balances(self, fix: bool = False) -> pd.DataFrame:
+        """
+        Compare the running totals in balances with the invoice/payment ledger
+        
+        Returns one row per account whose total_invoiced (non-cancelled
+        invoices) or total_paid (payments) differs from the ledger, including
+        accounts with ledger entries but no balance row. With fix, the totals
+        are rewritten from the ledger and missing rows are created with
+        outstanding = invoiced - paid; existing outstanding balances are left
+        alone since they include manual adjustments.
+        """
+        ledger = """
+            WITH ledger AS (
+                SELECT entity_id, COALESCE(branch_id, 0) AS branch_key,
+                       SUM(invoiced) AS invoiced, SUM(paid) AS paid
+                FROM (
+                    SELECT entity_id, branch_id, COALESCE(final_amount, total_amount) AS invoiced, 0 AS paid
+                    FROM invoices WHERE COALESCE(is_cancelled, 0) = 0 AND entity_id IS NOT NULL
+                    UNION ALL
+                    SELECT entity_id, branch_id, 0, amount
+                    FROM payments WHERE entity_id IS NOT NULL
+                )
+                GROUP BY entity_id, branch_key
+            ),
+            accounts AS (
+                SELECT entity_id, COALESCE(branch_id, 0) AS branch_key FROM balances WHERE entity_id IS NOT NULL
+                UNION
+                SELECT entity_id, branch_key FROM ledger
+            )
+            SELECT a.entity_id, NULLIF(a.branch_key, 0) AS branch_id,
+                   COALESCE(e.name, b.entity_name) AS entity_name, COALESCE(br.name, b.branch_name) AS branch_name,
+                   b.id AS balance_id,
+                   COALESCE(b.total_invoiced, 0) AS stored_invoiced, COALESCE(l.invoiced, 0) AS ledger_invoiced,
+                   COALESCE(b.total_paid, 0) AS stored_paid, COALESCE(l.paid, 0) AS ledger_paid,
+                   b.outstanding_balance
+            FROM accounts a
+            LEFT JOIN balances b ON b.entity_id = a.entity_id AND COALESCE(b.branch_id, 0) = a.branch_key
+            LEFT JOIN ledger l ON l.entity_id = a.entity_id AND l.branch_key = a.branch_key
+            LEFT JOIN doctors_list e ON e.id = a.entity_id
+            LEFT JOIN doctors_list br ON br.id = NULLIF(a.branch_key, 0)
+            WHERE b.id IS NULL
+               OR ABS(COALESCE(b.total_invoiced, 0) - COALESCE(l.invoiced, 0)) > 0.005
+               OR ABS(COALESCE(b.total_paid, 0) - COALESCE(l.paid, 0)) > 0.005
+            ORDER BY entity_name, branch_name
+        """
+        mismatches = self.run_query(ledger)
+        if not fix or mismatches.empty:
+            return mismatches
+        
+        with sqlite3.connect(self.db_name) as conn:
+            cursor = conn.cursor()
+            for row in mismatches.itertuples(index=False):
+                branch_id = None if pd.isna(row.branch_id) else int(row.branch_id)
+                if pd.isna(row.balance_id):
+                    cursor.execute("""
+                        INSERT INTO balances (
+                            entity_id, branch_id, entity_name, entity_type, branch_name,
+                            outstanding_balance, total_invoiced, total_paid
+                        )
+                        SELECT e.id, b.id, e.name,
+                               CASE WHEN e.is_center = 1 THEN 'center' ELSE 'doctor' END,
+                               b.name, ?, ?, ?
+                        FROM doctors_list e
+                        LEFT JOIN doctors_list b ON b.id = ?
+                        WHERE e.id = ?
+                    """, (row.ledger_invoiced - row.ledger_paid, row.ledger_invoiced, row.ledger_paid,
+                          branch_id, int(row.entity_id)))
+                else:
+                    cursor.execute("""
+                        UPDATE balances
+                        SET total_invoiced = ?, total_paid = ?, last_updated = datetime('now')
+                        WHERE id = ?
+                    """, (row.ledger_invoiced, row.ledger_paid, int(row.balance_id)))
+            conn.commit()
+        return mismatches
+    
+    def get_account_statement(self, entity_id: int, branch_id: Optional[int] = None,
+                              start_date: str = None, end_date: str = None) -> pd.DataFrame:
+        """
+        Invoices and payments of one account in date order with a running balance
+        
+        The first row carries the opening balance (everything before
+        start_date); amounts owed are debit, payments credit.
+        """
+        opening_date = start_date
+        start_date = start_date or '0000-01-01'
+        end_date = end_date or '9999-12-31'
+        query = """
+            WITH entries AS (
+                SELECT issue_date AS date, 'invoice' AS type, invoice_number AS reference,
+                       COALESCE(final_amount, total_amount) AS debit, 0 AS credit
+                FROM invoices
+                WHERE entity_id = ? AND COALESCE(branch_id, 0) = ? AND COALESCE(is_cancelled, 0) = 0
+                UNION ALL
+                SELECT payment_date, 'payment', COALESCE(reference_number, payment_method), 0, amount
+                FROM payments
+                WHERE entity_id = ? AND COALESCE(branch_id, 0) = ?
+            )
+            SELECT ? AS date, 'opening' AS type, NULL AS reference,
+                   COALESCE(SUM(debit - credit), 0) AS debit, 0 AS credit
+            FROM entries WHERE date < ?
+            UNION ALL
+            SELECT * FROM (
+                SELECT * FROM entries WHERE date BETWEEN ? AND ? ORDER BY date, type
+            )
+        """
+        branch_key = branch_id or 0
+        statement = self.run_query(query, (
+            entity_id, branch_key, entity_id, branch_key,
+            opening_date, start_date, start_date, end_date
+        ))
+        if not statement.empty:
+            statement['balance'] = (statement['debit'] - statement['credit']).cumsum()
+        return statement
+    
     # =========================================================================
     #                         INVOICE OPERATIONS
     # =========================================================================
     
-    def create_invoice(self, doctor_name: str, case_ids: List[int], total_amount: float,
-                      dental_center: str = None, branch_name: str = None,
+    def create_invoice(self, entity_id: int, case_ids: List[int], total_amount: float,
+                      branch_id: int = None,
                       discount: float = 0, tax: float = 0,
                       created_by: str = None, notes: str = None) -> Optional[str]:
         """Create new invoice and link cases"""
@@ -699,20 +1523,30 @@ class DatabaseManager:
             # Calculate final amount
             final_amount = total_amount - discount + tax
             
+            page = find_calling_page()
+            start = time.perf_counter()
             with sqlite3.connect(self.db_name) as conn:
                 cursor = conn.cursor()
                 
-                # Insert invoice
+                # Insert invoice, display names come from the entity rows
                 cursor.execute("""
                     INSERT INTO invoices (
-                        invoice_number, doctor_name, dental_center, branch_name,
+                        invoice_number, entity_id, branch_id,
+                        doctor_name, dental_center, branch_name,
                         total_amount, discount, tax, final_amount,
                         issue_date, issue_time, created_by, notes
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (invoice_number, doctor_name, dental_center, branch_name,
-                     total_amount, discount, tax, final_amount,
-                     issue_date, issue_time, created_by, notes))
+                    )
+                    SELECT ?, e.id, b.id,
+                           e.name, CASE WHEN e.is_center = 1 THEN e.name END, b.name,
+                           ?, ?, ?, ?, ?, ?, ?, ?
+                    FROM doctors_list e
+                    LEFT JOIN doctors_list b ON b.id = ?
+                    WHERE e.id = ?
+                """, (invoice_number, total_amount, discount, tax, final_amount,
+                     issue_date, issue_time, created_by, notes, branch_id, entity_id))
                 
+                if cursor.rowcount != 1:
+                    raise ValueError(f"Unknown entity id: {entity_id}")
                 invoice_id = cursor.lastrowid
                 
                 # Link cases and mark as paid
@@ -727,17 +1561,18 @@ class DatabaseManager:
                     )
                 
                 conn.commit()
+            self.monitor.record("create_invoice", (), 'transaction',
+                                (time.perf_counter() - start) * 1000, len(case_ids) + 1, page)
             
             # Update outstanding balance
-            entity_name = dental_center if dental_center else doctor_name
             balance_query = """
                 UPDATE balances 
                 SET outstanding_balance = outstanding_balance + ?,
                     total_invoiced = total_invoiced + ?,
                     last_updated = datetime('now')
-                WHERE entity_name = ? AND COALESCE(branch_name, '') = COALESCE(?, '')
+                WHERE entity_id = ? AND COALESCE(branch_id, 0) = ?
             """
-            self.run_action(balance_query, (final_amount, final_amount, entity_name, branch_name or ''))
+            self.run_action(balance_query, (final_amount, final_amount, entity_id, branch_id or 0))
             
             return invoice_number
         except Exception as e:
@@ -748,7 +1583,8 @@ class DatabaseManager:
         """Get full invoice information with linked cases"""
         query = """
             SELECT
-                i.invoice_number, i.doctor_name, i.dental_center, i.branch_name,
+                i.invoice_number, i.entity_id, i.branch_id,
+                i.doctor_name, i.dental_center, i.branch_name,
                 i.total_amount, i.discount, i.tax, i.final_amount,
                 i.issue_date, i.issue_time, i.created_by, i.notes,
                 c.id AS case_id, c.case_code, c.patient, c.price,
@@ -764,15 +1600,21 @@ class DatabaseManager:
     def cancel_invoice(self, invoice_number: str, cancelled_by: str, reason: str) -> bool:
         """Cancel an invoice and update related records"""
         try:
+            page = find_calling_page()
+            start = time.perf_counter()
             with sqlite3.connect(self.db_name) as conn:
                 cursor = conn.cursor()
                 
                 # Get invoice details
-                cursor.execute("SELECT * FROM invoices WHERE invoice_number = ?", (invoice_number,))
+                cursor.execute("""
+                    SELECT entity_id, branch_id, final_amount
+                    FROM invoices WHERE invoice_number = ?
+                """, (invoice_number,))
                 invoice = cursor.fetchone()
                 
                 if not invoice:
                     return False
+                entity_id, branch_id, final_amount = invoice
                 
                 # Mark invoice as cancelled
                 cursor.execute("""
@@ -795,18 +1637,17 @@ class DatabaseManager:
                 """, (invoice_number,))
                 
                 # Update balance (subtract the invoice amount)
-                entity_name = invoice[3] if invoice[3] else invoice[2]  # dental_center or doctor_name
-                branch_name = invoice[4] if invoice[4] else None
-                final_amount = invoice[8]  # final_amount
-                
                 cursor.execute("""
                     UPDATE balances 
                     SET outstanding_balance = outstanding_balance - ?,
+                        total_invoiced = total_invoiced - ?,
                         last_updated = datetime('now')
-                    WHERE entity_name = ? AND COALESCE(branch_name, '') = COALESCE(?, '')
-                """, (final_amount, entity_name, branch_name or ''))
+                    WHERE entity_id = ? AND COALESCE(branch_id, 0) = ?
+                """, (final_amount, final_amount, entity_id, branch_id or 0))
                 
                 conn.commit()
+            self.monitor.record("cancel_invoice", (), 'transaction',
+                                (time.perf_counter() - start) * 1000, cursor.rowcount, page)
             
             return True
         except Exception as e:
@@ -834,7 +1675,7 @@ class DatabaseManager:
         stats['delivered'] = delivered['count'].values[0] if not delivered.empty else 0
         
         # Total entities (doctors + centers)
-        total_entities = self.run_query("SELECT COUNT(*) as count FROM doctors_list WHERE center_parent IS NULL AND is_active = 1")
+        total_entities = self.run_query("SELECT COUNT(*) as count FROM doctors_list WHERE parent_id IS NULL AND is_active = 1")
         stats['total_entities'] = total_entities['count'].values[0] if not total_entities.empty else 0
         
         # Unpaid cases
@@ -866,8 +1707,13 @@ class DatabaseManager:
         
         return stats
     
-    def get_doctor_statistics(self, doctor_name: str) -> Dict[str, Any]:
-        """Get statistics for specific doctor/center"""
+    def get_doctor_statistics(self, entity_id: int) -> Dict[str, Any]:
+        """
+        Get statistics for specific doctor/center
+        
+        Counts the cases billed to the entity and, for a doctor, the cases
+        they treated that were billed through a center.
+        """
         stats = {}
         
         query = """
@@ -879,9 +1725,9 @@ class DatabaseManager:
                 COALESCE(SUM(CASE WHEN is_paid = 0 AND status = 'تم التسليم' THEN price ELSE 0 END), 0) as unpaid_amount,
                 COALESCE(SUM(CASE WHEN is_paid = 1 THEN price ELSE 0 END), 0) as paid_amount
             FROM cases
-            WHERE doctor = ? OR dental_center = ?
+            WHERE entity_id = ? OR doctor_id = ?
         """
-        result = self.run_query(query, (doctor_name, doctor_name))
+        result = self.run_query(query, (entity_id, entity_id))
         
         if not result.empty:
             stats.update(result.iloc[0].to_dict())
@@ -929,15 +1775,23 @@ class DatabaseManager:
     
     def log_action(self, table_name: str, record_id: int, action: str,
                    old_values: str = None, new_values: str = None, user: str = None) -> bool:
-        """Log database action for audit trail"""
-        query = """
-            INSERT INTO audit_log (table_name, record_id, action, old_values, new_values, user)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """
-        return self.run_action(query, (table_name, record_id, action, old_values, new_values, user))
+        """Log database action for audit trail (queued, written in batches by the activity writer)"""
+        self.activity_writer.submit('audit_log', {
+            'table_name': table_name,
+            'record_id': record_id,
+            'action': action,
+            'old_values': old_values,
+            'new_values': new_values,
+            'user': user,
+            'timestamp': datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+        })
+        return True
     
     def get_audit_log(self, limit: int = 100, table_name: str = None) -> pd.DataFrame:
         """Get recent audit log entries"""
+        # Include events still waiting in the writer queue
+        self.activity_writer.flush()
+        
         if table_name:
             query = "SELECT * FROM audit_log WHERE table_name = ? ORDER BY timestamp DESC LIMIT ?"
             return self.run_query(query, (table_name, limit))
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Dental Chart - Client-side SVG tooth chart component
+Features:
+- FDI layout built from constants.ALL_UPPER_TEETH / ALL_LOWER_TEETH
+- Click, drag and whole-arch selection handled in the browser
+- Per-tooth material assignment, arch materials (nightguard) cover the whole arch
+- One value sent to the server per confirmation instead of a rerun per click
+"""
+
+import os
+from typing import Dict, List, Optional, Sequence
+
+import streamlit as st
+import streamlit.components.v1 as components
+
+from constants import ALL_UPPER_TEETH, ALL_LOWER_TEETH
+
+_FRONTEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "components", "dental_chart")
+_component = components.declare_component("dental_chart", path=_FRONTEND_DIR)
+
+
+def dental_chart(materials: List[str], prices: Dict[str, float], used_teeth: Dict[str, int],
+                 arch_materials: Sequence[str] = (), key: str = "dental_chart"):
+    """
+    Render the chart
+
+    materials: selectable materials, prices: material -> unit price,
+    used_teeth: tooth -> confirmed works already using it,
+    arch_materials: materials priced and assigned per whole arch.
+    Read confirmed selections with take_chart_submission(key).
+    """
+    _component(
+        upper=ALL_UPPER_TEETH,
+        lower=ALL_LOWER_TEETH,
+        materials=list(materials),
+        prices=prices,
+        used={str(tooth): count for tooth, count in used_teeth.items()},
+        arch_materials=list(arch_materials),
+        key=key,
+        default=None,
+    )
+
+
+def take_chart_submission(key: str = "dental_chart") -> Optional[Dict[str, str]]:
+    """
+    {tooth: material} confirmed in the chart since the last call, else None
+
+    The component keeps returning its last value on every rerun; the nonce
+    makes each confirmation count once. Call it before dental_chart() so the
+    chart is drawn with the new works already counted.
+    """
+    value = st.session_state.get(key)
+    if not value or not value.get("teeth"):
+        return None
+
+    nonce_key = f"{key}_nonce"
+    if st.session_state.get(nonce_key) == value.get("nonce"):
+        return None
+    st.session_state[nonce_key] = value.get("nonce")
+    return {str(tooth): material for tooth, material in value["teeth"].items()}
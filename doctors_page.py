@@ -1,10 +1,20 @@
 import streamlit as st
 import pandas as pd
 
+from constants import (
+    PRICE_RULE_PERCENT,
+    PRICE_RULE_DELTA,
+    PRICE_RULE_ENTITY,
+    PRICE_ADJUSTMENT_RULES,
+    PRICE_ROUNDING_STEPS,
+)
+
 def show_doctors_page(db):
     st.header("⚙️ إعدادات المعمل والأسعار")
 
-    tab1, tab2, tab3 = st.tabs(["👨‍⚕️ إدارة الأطباء", "🏥 إدارة مراكز الأسنان", "💰 قائمة الأسعار"])
+    tab1, tab2, tab3, tab4 = st.tabs([
+        "👨‍⚕️ إدارة الأطباء", "🏥 إدارة مراكز الأسنان", "💰 قائمة الأسعار", "📈 تعديل جماعي للأسعار"
+    ])
 
     # ============================================================================
     # TAB 1: Doctors Management
@@ -15,22 +25,19 @@ def show_doctors_page(db):
             name = st.text_input("اسم الدكتور:")
             if st.form_submit_button("إضافة"):
                 if name:
-                    db.run_action(
-                        "INSERT OR IGNORE INTO doctors_list (name, doc_code, is_center) VALUES (?,?,?)", 
-                        (name, f"D-{name[:3].upper()}", 0)
-                    )
+                    db.add_doctor(name)
                     st.success(f"تمت إضافة د/ {name}")
                     st.rerun()
 
         st.divider()
         st.subheader("قائمة الأطباء")
-        docs = db.run_query("SELECT name, doc_code FROM doctors_list WHERE is_center = 0 AND center_parent IS NULL")
-        if not docs.empty:
-            for idx, row in docs.iterrows():
+        docs = db.entity_tree.get_doctors()
+        if docs:
+            for doc in docs:
                 c1, c2 = st.columns([4, 1])
-                c1.write(f"**{row['name']}** ({row['doc_code']})")
-                if c2.button("🗑️", key=f"del_doc_{idx}"):
-                    db.run_action("DELETE FROM doctors_list WHERE name=? AND is_center=0", (row['name'],))
+                c1.write(f"**{doc['name']}** ({doc['doc_code']})")
+                if c2.button("🗑️", key=f"del_doc_{doc['id']}"):
+                    db.delete_entity(doc['id'])
                     st.rerun()
         else:
             st.info("لا يوجد أطباء مسجلين")
@@ -44,127 +51,295 @@ def show_doctors_page(db):
             center_name = st.text_input("اسم المركز:")
             if st.form_submit_button("إضافة المركز"):
                 if center_name:
-                    db.run_action(
-                        "INSERT OR IGNORE INTO doctors_list (name, doc_code, is_center) VALUES (?,?,?)", 
-                        (center_name, f"C-{center_name[:3].upper()}", 1)
-                    )
+                    db.add_dental_center(center_name)
                     st.success(f"تمت إضافة مركز {center_name}")
                     st.rerun()
 
         st.divider()
         st.subheader("قائمة المراكز والفروع")
         
-        centers = db.run_query("SELECT name, doc_code FROM doctors_list WHERE is_center = 1")
-        if not centers.empty:
-            for idx, center_row in centers.iterrows():
-                with st.expander(f"🏥 {center_row['name']}", expanded=False):
-                    # Center info
-                    col_info, col_del = st.columns([4, 1])
-                    col_info.write(f"**كود المركز:** {center_row['doc_code']}")
-                    if col_del.button("🗑️ حذف المركز", key=f"del_center_{idx}"):
-                        # Delete center and all branches
-                        db.run_action("DELETE FROM doctors_list WHERE name=? OR center_parent=?", 
-                                     (center_row['name'], center_row['name']))
-                        st.rerun()
-                    
-                    st.divider()
-                    
-                    # Add branch
-                    st.write("**إضافة فرع جديد:**")
-                    with st.form(f"add_branch_{idx}", clear_on_submit=True):
-                        branch_name = st.text_input("اسم الفرع:", key=f"branch_input_{idx}")
-                        if st.form_submit_button("إضافة الفرع"):
-                            if branch_name:
-                                db.run_action(
-                                    "INSERT OR IGNORE INTO doctors_list (name, doc_code, is_center, center_parent) VALUES (?,?,?,?)", 
-                                    (branch_name, f"B-{branch_name[:3].upper()}", 0, center_row['name'])
-                                )
-                                st.success(f"تمت إضافة فرع {branch_name}")
-                                st.rerun()
-                    
-                    # List branches
-                    branches = db.run_query(
-                        "SELECT name FROM doctors_list WHERE center_parent = ?", 
-                        (center_row['name'],)
-                    )
-                    
-                    if not branches.empty:
-                        st.write("**الفروع:**")
-                        for bidx, branch_row in branches.iterrows():
-                            bcol1, bcol2 = st.columns([4, 1])
-                            bcol1.write(f"📍 {branch_row['name']}")
-                            if bcol2.button("🗑️", key=f"del_branch_{idx}_{bidx}"):
-                                db.run_action("DELETE FROM doctors_list WHERE name=? AND center_parent=?", 
-                                            (branch_row['name'], center_row['name']))
-                                st.rerun()
-                    else:
-                        st.info("لا توجد فروع لهذا المركز")
-        else:
-            st.info("لا توجد مراكز مسجلة")
+        show_centers_tree(db)
 
     # ============================================================================
     # TAB 3: Price Lists
     # ============================================================================
     with tab3:
-        # Get all entities (doctors and centers)
-        all_entities = db.run_query("""
-            SELECT name, is_center 
-            FROM doctors_list 
-            WHERE center_parent IS NULL
-            ORDER BY is_center DESC, name
-        """)
-        
-        if all_entities.empty:
+        entity_names = build_entity_names(db.get_entity_hierarchy())
+        if entity_names:
+            show_price_lists(db, entity_names)
+        else:
             st.warning("يرجى إضافة أطباء أو مراكز أولاً")
-            return
-        
-        # Create display names
-        entity_names = []
-        for _, row in all_entities.iterrows():
-            prefix = "🏥 " if row['is_center'] == 1 else "👨‍⚕️ "
-            entity_names.append(prefix + row['name'])
-        
-        selected_display = st.selectbox("اختر الطبيب أو المركز لتعديل أسعاره:", entity_names)
-        selected_entity = selected_display.split(" ", 1)[1]  # Remove emoji prefix
-        
+
+    # ============================================================================
+    # TAB 4: Mass Price Adjustment
+    # ============================================================================
+    with tab4:
+        show_mass_repricing(db)
+
+
+def build_entity_names(entity_tree):
+    """entity id -> display name, centers first, each followed by its branches"""
+    entity_names = {}
+    for node in sorted(entity_tree, key=lambda n: not n['is_center']):
+        prefix = "🏥 " if node['is_center'] == 1 else "👨‍⚕️ "
+        entity_names[node['id']] = prefix + node['name']
+        for branch in node['branches']:
+            # Branch prices override the center prices for that branch only
+            entity_names[branch['id']] = f"📍 {node['name']} / {branch['name']}"
+    return entity_names
+
+
+def show_price_lists(db, entity_names):
+    """Price list editor of one selected doctor/center/branch"""
+    selected_entity_id = st.selectbox(
+        "اختر الطبيب أو المركز لتعديل أسعاره:",
+        list(entity_names.keys()),
+        format_func=entity_names.get
+    )
+    selected_entity = entity_names[selected_entity_id].split(" ", 1)[1]  # Remove emoji prefix
+    
+    st.divider()
+    st.write(f"📊 قائمة أسعار {selected_entity}")
+    show_price_editor(db, selected_entity_id)
+
+
+@st.fragment
+def show_centers_tree(db):
+    """
+    Centers list from the cached entity tree
+
+    Each center opens with a toggle kept in session state, so its branches
+    and forms are only rendered while it is open and opening one reruns
+    just this fragment.
+    """
+    centers = db.entity_tree.get_centers()
+    if not centers:
+        st.info("لا توجد مراكز مسجلة")
+        return
+
+    for center in centers:
         with st.container(border=True):
-            st.write(f"إضافة خامة جديدة لـ {selected_entity}")
-            c1, c2, c3 = st.columns([2,1,1])
-            m_name = c1.text_input("اسم الخامة (Material):", placeholder="Zircon...")
-            m_price = c2.number_input("السعر:", min_value=0, step=50)
-            if c3.button("➕ حفظ السعر"):
-                if m_name:
-                    db.run_action("""
-                        INSERT INTO doctors_prices (doc_name, material, price) VALUES (?,?,?)
-                        ON CONFLICT(doc_name, material) DO UPDATE SET price=excluded.price
-                    """, (selected_entity, m_name, m_price))
-                    st.success("تم الحفظ")
-                    st.rerun()
+            is_open = st.toggle(
+                f"🏥 {center['name']} ({len(center['branches'])} فرع)",
+                key=f"center_{center['id']}"
+            )
+            if is_open:
+                show_center_details(db, center)
 
-        st.divider()
-        st.write(f"📊 قائمة أسعار {selected_entity}")
-        prices = db.run_query("SELECT id, material, price FROM doctors_prices WHERE doc_name=?", (selected_entity,))
-        if not prices.empty:
-            # Display as editable table
-            for idx, row in prices.iterrows():
-                col1, col2, col3 = st.columns([2, 1, 1])
-                col1.write(f"**{row['material']}**")
-                
-                new_price = col2.number_input(
-                    "السعر", 
-                    value=float(row['price']), 
-                    min_value=0.0, 
-                    step=50.0,
-                    key=f"price_{row['id']}"
-                )
-                
-                if col3.button("💾 تحديث", key=f"update_{row['id']}"):
-                    db.run_action("UPDATE doctors_prices SET price=? WHERE id=?", (new_price, row['id']))
-                    st.success("تم التحديث")
-                    st.rerun()
-                
-                if col3.button("🗑️ حذف", key=f"del_price_{row['id']}"):
-                    db.run_action("DELETE FROM doctors_prices WHERE id=?", (row['id'],))
-                    st.rerun()
-        else:
-            st.info("لا توجد خامات مضافة.")
+
+def show_center_details(db, center):
+    """Center info, add-branch form and branch list of one open center"""
+    # Center info
+    col_info, col_del = st.columns([4, 1])
+    col_info.write(f"**كود المركز:** {center['doc_code']}")
+    if col_del.button("🗑️ حذف المركز", key=f"del_center_{center['id']}"):
+        # Delete center and all branches
+        db.delete_entity(center['id'])
+        st.rerun()
+    
+    st.divider()
+    
+    # Add branch
+    st.write("**إضافة فرع جديد:**")
+    with st.form(f"add_branch_{center['id']}", clear_on_submit=True):
+        branch_name = st.text_input("اسم الفرع:", key=f"branch_input_{center['id']}")
+        if st.form_submit_button("إضافة الفرع"):
+            if branch_name:
+                db.add_branch(branch_name, center['id'])
+                st.success(f"تمت إضافة فرع {branch_name}")
+                st.rerun()
+    
+    # List branches
+    if center['branches']:
+        st.write("**الفروع:**")
+        for branch in center['branches']:
+            bcol1, bcol2 = st.columns([4, 1])
+            bcol1.write(f"📍 {branch['name']}")
+            if bcol2.button("🗑️", key=f"del_branch_{branch['id']}"):
+                db.delete_entity(branch['id'])
+                st.rerun()
+    else:
+        st.info("لا توجد فروع لهذا المركز")
+
+
+def show_price_editor(db, entity_id):
+    """
+    Whole price list of one entity as an editable table
+
+    Rows can be edited, added and deleted freely; nothing is written until
+    the save button, which stores every change in one transaction.
+    """
+    # Active prices only, like get_all_prices_for_entity: deactivated rows are not in effect
+    prices = db.run_query("""
+        SELECT material, price, cost_price FROM doctors_prices
+        WHERE entity_id = ? AND is_active = 1 ORDER BY material
+    """, (entity_id,))
+    # A new editor key after each save drops the edits that were just stored
+    version = st.session_state.get(f"price_editor_version_{entity_id}", 0)
+
+    with st.form(f"price_editor_{entity_id}"):
+        edited = st.data_editor(
+            prices,
+            num_rows="dynamic",
+            hide_index=True,
+            use_container_width=True,
+            column_config={
+                "material": st.column_config.TextColumn("الخامة (Material)", required=True),
+                "price": st.column_config.NumberColumn("السعر", min_value=0, step=50, required=True),
+                "cost_price": st.column_config.NumberColumn("التكلفة", min_value=0, step=10, default=0),
+            },
+            key=f"price_table_{entity_id}_{version}"
+        )
+        st.caption("أضف صفاً لخامة جديدة أو احذف الصفوف المحددة، ثم احفظ كل التعديلات مرة واحدة")
+        submitted = st.form_submit_button("💾 حفظ التعديلات", type="primary")
+
+    if not submitted:
+        return
+
+    materials = edited['material'].dropna().astype(str).str.strip()
+    duplicates = materials[materials.duplicated()].unique()
+    if len(duplicates):
+        st.error(f"❌ خامات مكررة: {', '.join(duplicates)}")
+        return
+
+    result = db.bulk_upsert_prices(
+        entity_id, edited.to_dict('records'), st.session_state.get('username')
+    )
+    if result is None:
+        st.error("❌ حدث خطأ أثناء حفظ الأسعار")
+        return
+    if not any(result.values()):
+        st.info("لا توجد تعديلات للحفظ")
+        return
+
+    st.session_state[f"price_editor_version_{entity_id}"] = version + 1
+    st.toast(
+        f"✅ تم الحفظ: {result['inserted']} جديد، {result['updated']} معدل، {result['deleted']} محذوف"
+    )
+    st.rerun()
+
+
+# Entity scopes of the mass adjustment -> label
+REPRICE_SCOPES = {
+    "all": "كل الأطباء والمراكز",
+    "centers": "كل المراكز",
+    "doctors": "كل الأطباء",
+    "selected": "اختيار محدد",
+}
+
+
+@st.fragment
+def show_mass_repricing(db):
+    """
+    Yearly price increases and price copies across many entities at once
+
+    The preview shows every price row the rule changes; applying runs the
+    same rule as one set-based statement.
+    """
+    entity_tree = db.get_entity_hierarchy()
+    if not entity_tree:
+        st.warning("يرجى إضافة أطباء أو مراكز أولاً")
+        return
+    entity_names = build_entity_names(entity_tree)
+
+    rule = st.radio(
+        "طريقة التعديل:",
+        list(PRICE_ADJUSTMENT_RULES.keys()),
+        format_func=PRICE_ADJUSTMENT_RULES.get,
+        horizontal=True,
+        key="reprice_rule"
+    )
+    copies = rule not in (PRICE_RULE_PERCENT, PRICE_RULE_DELTA)
+
+    c1, c2, c3 = st.columns(3)
+    value, source_entity_id = 0, None
+    if rule == PRICE_RULE_PERCENT:
+        value = c1.number_input("النسبة %:", value=10.0, step=5.0, key="reprice_percent")
+    elif rule == PRICE_RULE_DELTA:
+        value = c1.number_input("المبلغ (بالسالب للخصم):", value=50.0, step=50.0, key="reprice_delta")
+    elif rule == PRICE_RULE_ENTITY:
+        source_entity_id = c1.selectbox(
+            "نسخ الأسعار من:", list(entity_names.keys()), format_func=entity_names.get,
+            key="reprice_source"
+        )
+    round_to = c2.selectbox(
+        "التقريب لأقرب:", PRICE_ROUNDING_STEPS, index=PRICE_ROUNDING_STEPS.index(50),
+        format_func=lambda step: f"{step} ج.م" if step else "بدون تقريب",
+        key="reprice_round"
+    )
+    # Copied prices on a branch become overrides of its center, so branches are opt-in there
+    include_branches = c3.checkbox(
+        "تشمل الفروع", value=not copies, key=f"reprice_branches_{copies}",
+        help="أسعار الفروع تلغي أسعار المركز لهذا الفرع فقط"
+    )
+
+    scope = st.radio(
+        "تطبيق على:", list(REPRICE_SCOPES.keys()), format_func=REPRICE_SCOPES.get,
+        horizontal=True, key="reprice_scope"
+    )
+    if scope == "selected":
+        entity_ids = st.multiselect(
+            "الأطباء / المراكز / الفروع:", list(entity_names.keys()), format_func=entity_names.get,
+            key="reprice_entities"
+        )
+    else:
+        entity_ids = []
+        for node in entity_tree:
+            if scope == "all" or (scope == "centers") == bool(node['is_center']):
+                entity_ids.append(node['id'])
+                if include_branches:
+                    entity_ids.extend(branch['id'] for branch in node['branches'])
+
+    all_materials = db.run_query("""
+        SELECT material FROM doctors_prices
+        UNION SELECT material_name FROM material_catalog WHERE is_active = 1
+        ORDER BY 1
+    """)['material'].tolist()
+    materials = st.multiselect(
+        "الخامات (اتركها فارغة لكل الخامات):", all_materials, key="reprice_materials"
+    )
+
+    if not entity_ids:
+        st.info("اختر طبيباً أو مركزاً واحداً على الأقل")
+        return
+
+    adjustment = dict(
+        rule=rule, entity_ids=entity_ids, materials=materials or None,
+        value=value, round_to=round_to, source_entity_id=source_entity_id
+    )
+    if st.button("👁️ معاينة التغييرات", key="reprice_preview"):
+        st.session_state['reprice_previewed'] = adjustment
+    # The preview stays valid only while the inputs are unchanged
+    if st.session_state.get('reprice_previewed') != adjustment:
+        return
+
+    preview = db.preview_price_adjustment(**adjustment)
+    if preview.empty:
+        st.info("لا توجد أسعار ستتغير بهذه الإعدادات")
+        return
+
+    m1, m2, m3 = st.columns(3)
+    m1.metric("أسعار ستتغير", f"{len(preview):,}")
+    m2.metric("أسعار جديدة", f"{preview['old_price'].isna().sum():,}")
+    m3.metric("عدد الأطباء/المراكز", f"{preview['entity_id'].nunique():,}")
+    st.dataframe(
+        preview.drop(columns=['entity_id']),
+        hide_index=True,
+        use_container_width=True,
+        column_config={
+            "entity_name": "الطبيب / المركز",
+            "material": "الخامة",
+            "old_price": st.column_config.NumberColumn("السعر الحالي", format="%.0f"),
+            "new_price": st.column_config.NumberColumn("السعر الجديد", format="%.0f"),
+            "change": st.column_config.NumberColumn("الفرق", format="%+.0f"),
+        }
+    )
+
+    if st.button("✅ تطبيق التعديل", type="primary", key="reprice_apply"):
+        changed = db.apply_price_adjustment(**adjustment, user=st.session_state.get('username'))
+        if changed is None:
+            st.error("❌ حدث خطأ أثناء تطبيق التعديل")
+            return
+        del st.session_state['reprice_previewed']
+        st.toast(f"✅ تم تعديل {changed:,} سعر")
+        st.rerun()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Entity Tree - Process-wide cache of the doctor/center → branch hierarchy
+Features:
+- Whole doctors_list hierarchy loaded with one recursive CTE
+- Shared by every DatabaseManager (and session) using the same database file
+- Write-through invalidation from the entity write paths
+- Nested dicts: each root doctor/center carries its 'branches'
+"""
+
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+
+_REGISTRY: Dict[str, "EntityTree"] = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+class EntityTree:
+    """Read-mostly doctors/centers tree"""
+
+    def __init__(self, db_name: str):
+        self.db_name = db_name
+        # (roots, id -> node) of one load, replaced as a whole
+        self._snapshot: Optional[Tuple[List[Dict], Dict[int, Dict]]] = None
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _load(self) -> Tuple[List[Dict], Dict[int, Dict]]:
+        """(roots, nodes by id) from doctors_list, reloading once after invalidation"""
+        snapshot = self._snapshot
+        if snapshot is not None:
+            return snapshot
+
+        with self._lock:
+            if self._snapshot is not None:
+                return self._snapshot
+            generation = self._generation
+
+        # Ordered by depth so every parent is built before its branches
+        with sqlite3.connect(self.db_name) as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute("""
+                WITH RECURSIVE tree (id, name, doc_code, is_center, is_active, parent_id, depth) AS (
+                    SELECT id, name, doc_code, is_center, is_active, parent_id, 0
+                    FROM doctors_list
+                    WHERE parent_id IS NULL
+                    UNION ALL
+                    SELECT d.id, d.name, d.doc_code, d.is_center, d.is_active, d.parent_id, t.depth + 1
+                    FROM doctors_list d
+                    JOIN tree t ON d.parent_id = t.id
+                )
+                SELECT * FROM tree ORDER BY depth, name
+            """).fetchall()
+
+        roots, nodes = [], {}
+        for row in rows:
+            node = dict(row)
+            node['branches'] = []
+            nodes[node['id']] = node
+            if node['parent_id'] is None:
+                roots.append(node)
+            else:
+                nodes[node['parent_id']]['branches'].append(node)
+
+        with self._lock:
+            # A write during the load makes this snapshot stale, don't keep it
+            if generation == self._generation:
+                self._snapshot = (roots, nodes)
+        return roots, nodes
+
+    def get_tree(self) -> List[Dict]:
+        """
+        Root doctors and centers (by name), each with its 'branches' list
+
+        The nodes are shared by every caller and must not be modified.
+        """
+        return self._load()[0]
+
+    def get_doctors(self) -> List[Dict]:
+        """Independent doctors (no parent, not a center)"""
+        return [node for node in self._load()[0] if not node['is_center']]
+
+    def get_centers(self) -> List[Dict]:
+        """Dental centers with their branches"""
+        return [node for node in self._load()[0] if node['is_center']]
+
+    def get_branches(self, center_id: int) -> List[Dict]:
+        """Branches of one center, empty for unknown ids"""
+        # Same snapshot as the roots: never a half-replaced tree after invalidate()
+        node = self._load()[1].get(center_id)
+        return list(node['branches']) if node else []
+
+    def invalidate(self):
+        """Drop the cached tree, the next read reloads it"""
+        with self._lock:
+            self._generation += 1
+            self._snapshot = None
+
+
+def get_entity_tree(db_name: str) -> EntityTree:
+    """Return the process-wide entity tree of a database file"""
+    key = os.path.abspath(db_name)
+    with _REGISTRY_LOCK:
+        tree = _REGISTRY.get(key)
+        if tree is None:
+            tree = _REGISTRY[key] = EntityTree(db_name)
+        return tree
@@ -2,8 +2,8 @@
 """
 Entry Page - New Case Registration
 Features:
-- Interactive tooth selection
-- Nightguard mode
+- Interactive tooth chart (click, drag and arch selection)
+- Nightguard per arch
 - Material pricing
 - Try-in scheduling
 - File attachments
@@ -13,12 +13,17 @@ Features:
 import streamlit as st
 import json
 from datetime import datetime, timedelta
-import os
-from collections import defaultdict
+from collections import defaultdict, Counter
 
-UPLOAD_FOLDER = "uploads"
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
+from constants import ALL_UPPER_TEETH, ALL_LOWER_TEETH, get_max_file_size_mb, group_consecutive_teeth
+from dental_chart import dental_chart, take_chart_submission
+
+# Where the effective price of a material came from
+PRICE_SOURCE_LABELS = {
+    'branch': "سعر الفرع",
+    'entity': "سعر الجهة",
+    'catalog': "السعر الافتراضي (الكتالوج)",
+}
 
 
 def show_entry_page(db):
@@ -28,25 +33,21 @@ def show_entry_page(db):
     # Initialize session state
     if 'confirmed_items' not in st.session_state:
         st.session_state.confirmed_items = []
-    if 'pending_teeth' not in st.session_state:
-        st.session_state.pending_teeth = {}
-    if 'nightguard_mode' not in st.session_state:
-        st.session_state.nightguard_mode = False
-    if 'show_tooth_numbers' not in st.session_state:
-        st.session_state.show_tooth_numbers = True
     
     # Get doctors and centers
     docs_df = db.run_query("""
-        SELECT name, is_center, center_parent, phone, email
+        SELECT id, name, is_center, phone, email
         FROM doctors_list 
-        WHERE center_parent IS NULL AND is_active = 1
+        WHERE parent_id IS NULL AND is_active = 1
         ORDER BY is_center DESC, name
     """)
     
     if docs_df.empty:
         st.warning("⚠️ يرجى إضافة دكاترة أو مراكز أولاً من صفحة الإعدادات.")
-        if st.button("➡️ الذهاب إلى الإعدادات"):
-            st.switch_page("pages/settings.py")
+        # Registered by main.py only for roles that may open the settings page
+        settings_page = st.session_state.get('pages', {}).get("doctors")
+        if settings_page:
+            st.page_link(settings_page, label="➡️ الذهاب إلى الإعدادات")
         return
     
     # =========================================================================
@@ -71,58 +72,62 @@ def show_entry_page(db):
         selected_doctor = None
         selected_center = None
         selected_branch = None
+        selected_entity_id = None
+        selected_branch_id = None
+        
+        def entity_label(row):
+            """Display name with contact info"""
+            display = row['name']
+            if row.get('phone'):
+                display += f" ({row['phone']})"
+            return display
         
         if entity_type == "دكتور":
             if not doctors_df.empty:
-                # Create display list with contact info
-                doctor_options = []
-                for _, doc in doctors_df.iterrows():
-                    display = doc['name']
-                    if doc.get('phone'):
-                        display += f" ({doc['phone']})"
-                    doctor_options.append(display)
+                doctor_labels = {int(doc['id']): entity_label(doc) for _, doc in doctors_df.iterrows()}
+                doctor_names = dict(zip(doctors_df['id'].astype(int), doctors_df['name']))
                 
-                selected_display = col_entity.selectbox(
+                selected_entity_id = col_entity.selectbox(
                     "👨‍⚕️ اسم الدكتور", 
-                    doctor_options,
+                    list(doctor_labels.keys()),
+                    format_func=doctor_labels.get,
                     help="اختر الدكتور من القائمة"
                 )
-                selected_doctor = selected_display.split(" (")[0]  # Extract name only
+                selected_doctor = doctor_names[selected_entity_id]
             else:
                 col_entity.warning("⚠️ لا يوجد أطباء مسجلين")
                 return
         else:  # Dental Center
             if not centers_df.empty:
-                # Create display list with contact info
-                center_options = []
-                for _, center in centers_df.iterrows():
-                    display = center['name']
-                    if center.get('phone'):
-                        display += f" ({center['phone']})"
-                    center_options.append(display)
+                center_labels = {int(c['id']): entity_label(c) for _, c in centers_df.iterrows()}
+                center_names = dict(zip(centers_df['id'].astype(int), centers_df['name']))
                 
-                selected_display = col_entity.selectbox(
+                selected_entity_id = col_entity.selectbox(
                     "🏥 اسم المركز", 
-                    center_options,
+                    list(center_labels.keys()),
+                    format_func=center_labels.get,
                     help="اختر المركز من القائمة"
                 )
-                selected_center = selected_display.split(" (")[0]  # Extract name only
+                selected_center = center_names[selected_entity_id]
                 
                 # Get branches
                 branches_df = db.run_query(
-                    "SELECT name FROM doctors_list WHERE center_parent = ? AND is_active = 1",
-                    (selected_center,)
+                    "SELECT id, name FROM doctors_list WHERE parent_id = ? AND is_active = 1",
+                    (selected_entity_id,)
                 )
                 
                 if not branches_df.empty:
-                    branch_options = ["-- المركز الرئيسي --"] + branches_df['name'].tolist()
-                    selected_branch = col_entity.selectbox(
+                    branch_names = {0: "-- المركز الرئيسي --"}
+                    branch_names.update(zip(branches_df['id'].astype(int), branches_df['name']))
+                    branch_choice = col_entity.selectbox(
                         "📍 الفرع", 
-                        branch_options,
+                        list(branch_names.keys()),
+                        format_func=branch_names.get,
                         help="اختر الفرع أو اترك المركز الرئيسي"
                     )
-                    if selected_branch == "-- المركز الرئيسي --":
-                        selected_branch = None
+                    if branch_choice:
+                        selected_branch_id = branch_choice
+                        selected_branch = branch_names[branch_choice]
             else:
                 col_entity.warning("⚠️ لا يوجد مراكز مسجلة")
                 return
@@ -138,355 +143,25 @@ def show_entry_page(db):
     #                    LOAD PRICES FOR SELECTED ENTITY
     # =========================================================================
     
+    # Served from the process-wide price matrix, no database round trip on reruns.
+    # Branch prices override the center/doctor prices, which override catalog defaults.
     price_entity = selected_center if selected_center else selected_doctor
-    prices_df = db.run_query(
-        "SELECT material, price, cost_price FROM doctors_prices WHERE doc_name = ? AND is_active = 1",
-        (price_entity,)
-    )
+    prices = db.price_matrix.resolve_prices(selected_entity_id, selected_branch_id)
     
-    materials_list = prices_df['material'].tolist() if not prices_df.empty else []
+    materials_list = sorted(prices)
     
     if not materials_list:
         st.warning(f"⚠️ لا توجد أسعار مسجلة لـ {price_entity}. يرجى إضافة الأسعار من صفحة الإعدادات.")
         return
     
-    # Check for nightguard availability
-    has_nightguard = any("nightguard" in mat.lower() for mat in materials_list)
+    if all(source == 'catalog' for _, _, source in prices.values()):
+        st.info(f"ℹ️ لا توجد أسعار خاصة بـ {price_entity}، يتم استخدام الأسعار الافتراضية من الكتالوج.")
     
     # =========================================================================
-    #                    NIGHTGUARD MODE TOGGLE
+    #                    TOOTH MAP AND CASE SUMMARY
     # =========================================================================
     
-    if has_nightguard:
-        st.divider()
-        with st.container(border=True):
-            nightguard_checkbox = st.checkbox(
-                "🌙 **تسجيل Nightguard** (سيتم اختيار الفك كامل)",
-                value=st.session_state.nightguard_mode,
-                key="ng_toggle",
-                help="تفعيل هذا الخيار لإضافة واقي ليلي (Nightguard) كامل"
-            )
-            
-            if nightguard_checkbox != st.session_state.nightguard_mode:
-                st.session_state.nightguard_mode = nightguard_checkbox
-                st.session_state.pending_teeth = {}
-                st.rerun()
-    
-    # =========================================================================
-    #                    NIGHTGUARD MODE - ARCH SELECTION
-    # =========================================================================
-    
-    if st.session_state.nightguard_mode:
-        st.divider()
-        with st.container(border=True):
-            st.subheader("🦷 اختيار الفك للـ Nightguard")
-            
-            nightguard_material = next((mat for mat in materials_list if "nightguard" in mat.lower()), None)
-            
-            if nightguard_material:
-                nightguard_price = prices_df[prices_df['material'] == nightguard_material]['price'].values[0]
-                
-                st.info(f"💰 **سعر الـ Nightguard:** {nightguard_price:,.0f} ج.م للفك الواحد")
-                
-                col_upper, col_lower = st.columns(2)
-                
-                # Upper arch button
-                if col_upper.button(
-                    "🦷 الفك العلوي", 
-                    use_container_width=True, 
-                    type="primary",
-                    help="إضافة واقي ليلي للفك العلوي"
-                ):
-                    upper_teeth = [18,17,16,15,14,13,12,11,21,22,23,24,25,26,27,28]
-                    
-                    teeth_map = {
-                        str(tooth): {
-                            "material": nightguard_material,
-                            "price": nightguard_price,
-                        }
-                        for tooth in upper_teeth
-                    }
-                    
-                    st.session_state.confirmed_items.append({
-                        "teeth": upper_teeth,
-                        "teeth_map": teeth_map,
-                        "material": nightguard_material,
-                        "price": nightguard_price,
-                        "type": "nightguard",
-                        "arch": "الفك العلوي"
-                    })
-                    
-                    st.success(f"✅ تم إضافة Nightguard - الفك العلوي ({nightguard_material})")
-                    st.rerun()
-                
-                # Lower arch button
-                if col_lower.button(
-                    "🦷 الفك السفلي", 
-                    use_container_width=True, 
-                    type="primary",
-                    help="إضافة واقي ليلي للفك السفلي"
-                ):
-                    lower_teeth = [48,47,46,45,44,43,42,41,31,32,33,34,35,36,37,38]
-                    
-                    teeth_map = {
-                        str(tooth): {
-                            "material": nightguard_material,
-                            "price": nightguard_price,
-                        }
-                        for tooth in lower_teeth
-                    }
-                    
-                    st.session_state.confirmed_items.append({
-                        "teeth": lower_teeth,
-                        "teeth_map": teeth_map,
-                        "material": nightguard_material,
-                        "price": nightguard_price,
-                        "type": "nightguard",
-                        "arch": "الفك السفلي"
-                    })
-                    
-                    st.success(f"✅ تم إضافة Nightguard - الفك السفلي ({nightguard_material})")
-                    st.rerun()
-                
-                # Show added nightguards
-                if st.session_state.confirmed_items:
-                    st.write("**✅ الـ Nightguards المضافة:**")
-                    for idx, item in enumerate(st.session_state.confirmed_items):
-                        if item.get('type') == 'nightguard':
-                            col_info, col_delete = st.columns([4, 1])
-                            col_info.markdown(f"• **{item['arch']}** ({item['material']}) - {item['price']:,.0f} ج.م")
-                            if col_delete.button("🗑️", key=f"del_ng_{idx}"):
-                                st.session_state.confirmed_items.pop(idx)
-                                st.rerun()
-            else:
-                st.error("❌ لم يتم العثور على مادة Nightguard في قائمة الأسعار!")
-    
-    # =========================================================================
-    #                    REGULAR MODE - TOOTH MAP
-    # =========================================================================
-    
-    else:
-        st.divider()
-        with st.container(border=True):
-            st.subheader("🦷 خريطة الأسنان - Dental Chart")
-            
-            # Tooth number visibility toggle
-            col_toggle, _ = st.columns([2, 3])
-            show_numbers = col_toggle.checkbox(
-                "إظهار أرقام الأسنان",
-                value=st.session_state.show_tooth_numbers,
-                key="show_tooth_nums"
-            )
-            st.session_state.show_tooth_numbers = show_numbers
-            
-            # CSS for tooth map styling
-            st.markdown("""
-                <style>
-                .v-line { 
-                    border-left: 2px solid #ddd; 
-                    height: 50px; 
-                    margin: auto; 
-                    width: 1px; 
-                }
-                .h-line { 
-                    border-top: 2px solid #ddd; 
-                    margin: 5px 0px; 
-                }
-                </style>
-            """, unsafe_allow_html=True)
-            
-            def draw_tooth(num, col):
-                """Draw individual tooth button with states"""
-                tooth_str = str(num)
-                
-                # Count how many times this tooth is used
-                tooth_used_count = sum(
-                    1 for item in st.session_state.confirmed_items 
-                    if str(num) in [str(t) for t in item.get('teeth', [])]
-                )
-                
-                # Determine button state and label
-                if tooth_str in st.session_state.pending_teeth:
-                    label = f"🦷 {num} ●" if show_numbers else "●"
-                    btn_type = "primary"
-                    help_text = "محدد - اضغط لإلغاء التحديد"
-                elif tooth_used_count > 0:
-                    label = f"🦷 {num} ({tooth_used_count})" if show_numbers else f"({tooth_used_count})"
-                    btn_type = "secondary"
-                    help_text = f"مستخدم في {tooth_used_count} عمل"
-                else:
-                    label = str(num) if show_numbers else "○"
-                    btn_type = "secondary"
-                    help_text = "اضغط للتحديد"
-                
-                if col.button(
-                    label, 
-                    key=f"t_{num}", 
-                    use_container_width=True, 
-                    type=btn_type,
-                    help=help_text
-                ):
-                    if tooth_str in st.session_state.pending_teeth:
-                        del st.session_state.pending_teeth[tooth_str]
-                    else:
-                        st.session_state.pending_teeth[tooth_str] = {"selected": True}
-                    st.rerun()
-            
-            # Upper jaw
-            st.caption("الفك العلوي - Upper Jaw")
-            up_cols = st.columns([1,1,1,1,1,1,1,1, 0.2, 1,1,1,1,1,1,1,1])
-            for i, t in enumerate([18,17,16,15,14,13,12,11]):
-                draw_tooth(t, up_cols[i])
-            up_cols[8].markdown('<div class="v-line"></div>', unsafe_allow_html=True)
-            for i, t in enumerate([21,22,23,24,25,26,27,28]):
-                draw_tooth(t, up_cols[i+9])
-            
-            st.markdown('<div class="h-line"></div>', unsafe_allow_html=True)
-            
-            # Lower jaw
-            st.caption("الفك السفلي - Lower Jaw")
-            lo_cols = st.columns([1,1,1,1,1,1,1,1, 0.2, 1,1,1,1,1,1,1,1])
-            for i, t in enumerate([48,47,46,45,44,43,42,41]):
-                draw_tooth(t, lo_cols[i])
-            lo_cols[8].markdown('<div class="v-line"></div>', unsafe_allow_html=True)
-            for i, t in enumerate([31,32,33,34,35,36,37,38]):
-                draw_tooth(t, lo_cols[i+9])
-            
-            # Quick selection helpers
-            if st.session_state.pending_teeth:
-                st.caption(f"✓ محدد: {len(st.session_state.pending_teeth)} سن")
-                col_clear, _ = st.columns([1, 3])
-                if col_clear.button("🔄 إلغاء التحديد", type="secondary"):
-                    st.session_state.pending_teeth = {}
-                    st.rerun()
-        
-        # =========================================================================
-        #                    MATERIAL SELECTION FOR PENDING TEETH
-        # =========================================================================
-        
-        if st.session_state.pending_teeth:
-            st.divider()
-            with st.container(border=True):
-                st.subheader("⚡ اختيار الخامة للأسنان المحددة")
-                
-                pending_numbers = sorted([int(k) for k in st.session_state.pending_teeth.keys()])
-                
-                # Group consecutive teeth
-                groups = []
-                current_group = []
-                
-                for num in pending_numbers:
-                    if not current_group or num == current_group[-1] + 1:
-                        current_group.append(num)
-                    else:
-                        groups.append(current_group)
-                        current_group = [num]
-                if current_group:
-                    groups.append(current_group)
-                
-                # Process each group
-                for group_idx, group in enumerate(groups):
-                    teeth_str = "-".join(map(str, group))
-                    
-                    # Determine work type
-                    if len(group) >= 2:
-                        work_label = f"🌉 جسر {teeth_str}"
-                        work_type = "bridge"
-                    else:
-                        work_label = f"👑 تاج {teeth_str}"
-                        work_type = "crown"
-                    
-                    with st.expander(work_label, expanded=True):
-                        col_mat, col_price = st.columns([2, 1])
-                        
-                        material = col_mat.selectbox(
-                            "المادة / Material",
-                            materials_list,
-                            key=f"mat_group_{group_idx}",
-                            help="اختر نوع الخامة المطلوبة"
-                        )
-                        
-                        # Get and display price
-                        price_row = prices_df[prices_df['material'] == material]
-                        if not price_row.empty:
-                            unit_price = price_row['price'].values[0]
-                            total_price = unit_price * len(group)
-                            
-                            col_price.metric(
-                                "السعر الإجمالي",
-                                f"{total_price:,.0f} ج.م",
-                                delta=f"{unit_price} × {len(group)}"
-                            )
-                            
-                            # Confirm button
-                            if st.button(
-                                f"✅ تأكيد {work_type.title()} ({material})",
-                                key=f"conf_group_{group_idx}",
-                                type="primary",
-                                use_container_width=True
-                            ):
-                                teeth_map = {
-                                    str(t): {
-                                        "material": material,
-                                        "price": unit_price,
-                                    }
-                                    for t in group
-                                }
-                                
-                                st.session_state.confirmed_items.append({
-                                    "teeth": group,
-                                    "teeth_map": teeth_map,
-                                    "material": material,
-                                    "price": total_price,
-                                    "type": work_type,
-                                    "label": work_label
-                                })
-                                
-                                # Clear pending teeth
-                                for t in group:
-                                    if str(t) in st.session_state.pending_teeth:
-                                        del st.session_state.pending_teeth[str(t)]
-                                
-                                st.success(f"✅ تم تأكيد {work_label} بنجاح!")
-                                st.rerun()
-                        else:
-                            st.error("لم يتم العثور على السعر!")
-    
-    # =========================================================================
-    #                    CASE SUMMARY
-    # =========================================================================
-    
-    if st.session_state.confirmed_items:
-        st.divider()
-        with st.container(border=True):
-            st.subheader("📋 ملخص الحالة - Case Summary")
-            
-            total_price = 0
-            total_teeth = 0
-            
-            for idx, item in enumerate(st.session_state.confirmed_items):
-                col_info, col_price, col_delete = st.columns([3, 1.5, 0.5])
-                
-                if item.get('type') == 'nightguard':
-                    col_info.markdown(f"**{item['arch']}** - {item['material']}")
-                else:
-                    teeth_display = "-".join(map(str, item['teeth']))
-                    col_info.markdown(f"**{item.get('label', teeth_display)}** - {item['material']}")
-                
-                col_price.markdown(f"💰 {item['price']:,.0f} ج.م")
-                
-                if col_delete.button("🗑️", key=f"del_summary_{idx}", help="حذف هذا العنصر"):
-                    st.session_state.confirmed_items.pop(idx)
-                    st.rerun()
-                
-                total_price += item['price']
-                total_teeth += len(item['teeth'])
-            
-            # Display totals
-            st.markdown("---")
-            col_total1, col_total2 = st.columns(2)
-            col_total1.metric("إجمالي الأسنان", total_teeth)
-            col_total2.metric("الإجمالي", f"{total_price:,.0f} ج.م")
+    show_case_works(db, prices, materials_list, selected_entity_id, selected_branch_id)
     
     # =========================================================================
     #                    CASE DETAILS
@@ -577,17 +252,13 @@ def show_entry_page(db):
             help="ارفع أي ملف متعلق بالحالة (اختياري)"
         )
         
-        attachment_path = None
+        # Stored (streamed, deduplicated) only when the case is saved
         if uploaded_file is not None:
-            file_extension = os.path.splitext(uploaded_file.name)[1]
-            safe_filename = f"case_{datetime.now().strftime('%Y%m%d_%H%M%S')}{file_extension}"
-            file_path = os.path.join(UPLOAD_FOLDER, safe_filename)
-            
-            with open(file_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
-            
-            attachment_path = file_path
-            st.success(f"✅ تم رفع الملف: {uploaded_file.name}")
+            max_mb = get_max_file_size_mb(uploaded_file.name)
+            if uploaded_file.size > max_mb * 1024 * 1024:
+                st.error(f"❌ حجم الملف أكبر من {max_mb} ميجابايت")
+            else:
+                st.success(f"✅ تم إرفاق الملف: {uploaded_file.name}")
     
     # =========================================================================
     #                    SAVE BUTTON
@@ -616,6 +287,15 @@ def show_entry_page(db):
                 st.error(error)
             return
         
+        # Store the attachment
+        attachment = None
+        if uploaded_file is not None:
+            try:
+                attachment = db.attachments.store(uploaded_file, uploaded_file.name)
+            except ValueError:
+                st.error(f"❌ حجم الملف أكبر من {get_max_file_size_mb(uploaded_file.name)} ميجابايت")
+                return
+        
         # Prepare data
         combined_teeth_map = {}
         total_price = 0
@@ -633,6 +313,8 @@ def show_entry_page(db):
         # Create case data dictionary
         case_data = {
             'patient': patient_name,
+            'entity_id': selected_entity_id,
+            'branch_id': selected_branch_id,
             'doctor': doctor_value,
             'dental_center': center_value,
             'branch_name': branch_value,
@@ -647,7 +329,7 @@ def show_entry_page(db):
             'try_in_date': str(t_date) if t_date else None,
             'priority': priority_map.get(priority, 'normal'),
             'lab_technician': lab_technician if lab_technician else None,
-            'attachment': attachment_path,
+            'attachment': attachment['path'] if attachment else None,
             'status': 'في المعمل'
         }
         
@@ -655,6 +337,9 @@ def show_entry_page(db):
         case_code = db.add_case(case_data)
         
         if case_code:
+            if attachment:
+                db.attachments.link(case_code, attachment, uploaded_file.name, st.session_state.get('username'))
+            
             st.success(f"""
                 ✅ **تم الحفظ بنجاح!**
                 
@@ -667,14 +352,191 @@ def show_entry_page(db):
             
             # Clear session state
             st.session_state.confirmed_items = []
-            st.session_state.pending_teeth = {}
-            st.session_state.nightguard_mode = False
             
             # Ask if user wants to add another case
             col_new, col_view = st.columns(2)
             if col_new.button("➕ تسجيل حالة جديدة", type="primary", use_container_width=True):
                 st.rerun()
-            if col_view.button("👀 عرض الأرشيف", use_container_width=True):
-                st.switch_page("pages/archive.py")
+            archive_page = st.session_state.get('pages', {}).get("archive")
+            if archive_page:
+                col_view.page_link(archive_page, label="👀 عرض الأرشيف")
         else:
             st.error("❌ حدث خطأ أثناء حفظ الحالة. يرجى المحاولة مرة أخرى.")
+
+
+# =========================================================================
+#                    TOOTH CHART
+# =========================================================================
+
+def build_tooth_usage(confirmed_items) -> Counter:
+    """Tooth number (str) -> number of confirmed works using it, built in one pass"""
+    usage = Counter()
+    for item in confirmed_items:
+        usage.update(str(t) for t in item.get('teeth', []))
+    return usage
+
+
+def build_chart_items(db, teeth_materials, entity_id, branch_id, arch_materials) -> list:
+    """
+    Turn a confirmed {tooth: material} map from the chart into case works
+    
+    Consecutive teeth of one material become a bridge, single teeth a crown;
+    arch materials (nightguard) become one work per arch, priced once.
+    """
+    by_material = defaultdict(list)
+    for tooth, material in teeth_materials.items():
+        by_material[material].append(int(tooth))
+    
+    items = []
+    for material, teeth in by_material.items():
+        if material in arch_materials:
+            for arch_teeth, arch_label in ((ALL_UPPER_TEETH, "الفك العلوي"), (ALL_LOWER_TEETH, "الفك السفلي")):
+                if not set(teeth) & set(arch_teeth):
+                    continue
+                teeth_map = db.price_matrix.resolve_teeth_map(
+                    entity_id, branch_id, {t: material for t in arch_teeth}
+                )
+                items.append({
+                    "teeth": list(arch_teeth),
+                    "teeth_map": teeth_map,
+                    "material": material,
+                    "price": db.price_matrix.get_price(entity_id, material, branch_id),
+                    "type": "nightguard",
+                    "arch": arch_label
+                })
+            continue
+        
+        for group in group_consecutive_teeth(teeth):
+            teeth_str = "-".join(map(str, group))
+            if len(group) >= 2:
+                work_label = f"🌉 جسر {teeth_str}"
+                work_type = "bridge"
+            else:
+                work_label = f"👑 تاج {teeth_str}"
+                work_type = "crown"
+            
+            teeth_map = db.price_matrix.resolve_teeth_map(
+                entity_id, branch_id, {t: material for t in group}
+            )
+            items.append({
+                "teeth": group,
+                "teeth_map": teeth_map,
+                "material": material,
+                "price": sum(tooth['price'] for tooth in teeth_map.values()),
+                "type": work_type,
+                "label": work_label
+            })
+    return items
+
+
+def split_overlapping_items(items, confirmed_items) -> tuple:
+    """
+    (kept, rejected) works of one confirmation
+    
+    A tooth may belong to one work only: works touching a tooth of an
+    already confirmed work, or of a work kept earlier in the same
+    confirmation, are rejected instead of billing the tooth twice.
+    Tooth works are kept before arch works (nightguard) of the same
+    confirmation.
+    """
+    taken = set(build_tooth_usage(confirmed_items))
+    kept, rejected = [], []
+    for item in sorted(items, key=lambda item: item.get('type') == 'nightguard'):
+        teeth = {str(t) for t in item['teeth']}
+        if teeth & taken:
+            rejected.append(item)
+            continue
+        taken |= teeth
+        kept.append(item)
+    return kept, rejected
+
+
+def show_tooth_chart(db, prices, materials_list, entity_id, branch_id):
+    """
+    Dental chart with material assignment
+    
+    Selection (click, drag, whole arch) and per-tooth materials are handled
+    in the browser; the server only sees one value per confirmation.
+    """
+    arch_materials = [mat for mat in materials_list if "nightguard" in mat.lower()]
+    
+    # Applied before drawing so the chart already counts the new works
+    submitted = take_chart_submission()
+    if submitted:
+        items, rejected = split_overlapping_items(
+            build_chart_items(db, submitted, entity_id, branch_id, arch_materials),
+            st.session_state.confirmed_items
+        )
+        st.session_state.confirmed_items.extend(items)
+        if items:
+            st.toast(f"✅ تم تأكيد {len(items)} عمل")
+        for item in rejected:
+            st.warning(
+                f"⚠️ لم يتم إضافة {item.get('arch') or item.get('label')} - {item['material']}: "
+                "بعض الأسنان مستخدمة في عمل آخر، احذفه أولاً"
+            )
+    
+    st.divider()
+    with st.container(border=True):
+        st.subheader("🦷 خريطة الأسنان - Dental Chart")
+        st.caption("اضغط أو اسحب لتحديد الأسنان، ثم عيّن الخامة واضغط تأكيد. "
+                   "خامات الـ Nightguard تغطي الفك كامل. السن المستخدم في عمل لا يدخل في عمل آخر.")
+        dental_chart(
+            materials_list,
+            {material: price for material, (price, _, _) in prices.items()},
+            build_tooth_usage(st.session_state.confirmed_items),
+            arch_materials
+        )
+
+
+@st.fragment
+def show_case_works(db, prices, materials_list, entity_id, branch_id):
+    """
+    Chart and summary of the confirmed works (fragment)
+    
+    Confirming teeth in the chart or deleting a work reruns only this part;
+    the case details form below reads confirmed_items when it is saved.
+    """
+    show_tooth_chart(db, prices, materials_list, entity_id, branch_id)
+    if st.session_state.confirmed_items:
+        show_case_summary()
+
+
+def delete_confirmed_item(idx):
+    """Button callback: drop one confirmed work"""
+    if idx < len(st.session_state.confirmed_items):
+        st.session_state.confirmed_items.pop(idx)
+
+
+def show_case_summary():
+    """Confirmed works and totals"""
+    st.divider()
+    with st.container(border=True):
+        st.subheader("📋 ملخص الحالة - Case Summary")
+
+        total_price = 0
+        total_teeth = 0
+
+        for idx, item in enumerate(st.session_state.confirmed_items):
+            col_info, col_price, col_delete = st.columns([3, 1.5, 0.5])
+
+            if item.get('type') == 'nightguard':
+                col_info.markdown(f"**{item['arch']}** - {item['material']}")
+            else:
+                teeth_display = "-".join(map(str, item['teeth']))
+                col_info.markdown(f"**{item.get('label', teeth_display)}** - {item['material']}")
+
+            col_price.markdown(f"💰 {item['price']:,.0f} ج.م")
+
+            # Removed in the callback, before the fragment reruns and redraws the chart
+            col_delete.button("🗑️", key=f"del_summary_{idx}", help="حذف هذا العنصر",
+                              on_click=delete_confirmed_item, args=(idx,))
+
+            total_price += item['price']
+            total_teeth += len(item['teeth'])
+
+        # Display totals
+        st.markdown("---")
+        col_total1, col_total2 = st.columns(2)
+        col_total1.metric("إجمالي الأسنان", total_teeth)
+        col_total2.metric("الإجمالي", f"{total_price:,.0f} ج.م")
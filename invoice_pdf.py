@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Invoice PDF - fpdf2 layout of customer invoices
+Imported by the invoice page only when a PDF is generated, so the PDF stack
+(fpdf, arabic_reshaper, python-bidi) stays out of the app's start-up
+"""
+
+import json
+import os
+from datetime import datetime
+from fpdf import FPDF
+from arabic_reshaper import reshape
+from bidi.algorithm import get_display
+
+# =============================================================================
+#                 INVOICE PDF CLASS
+# =============================================================================
+class InvoicePDF(FPDF):
+    def __init__(self):
+        super().__init__()
+        possible_paths = [
+            "fonts",
+            "dejavu-fonts-ttf-2.37/ttf",
+            "A1-Dental-Lab/fonts"
+        ]
+        
+        found = False
+        for folder in possible_paths:
+            sans_path = os.path.join(folder, "DejaVuSans.ttf")
+            bold_path = os.path.join(folder, "DejaVuSans-Bold.ttf")
+            
+            if os.path.exists(sans_path) and os.path.exists(bold_path):
+                self.add_font("DejaVu", "", sans_path, uni=True)
+                self.add_font("DejaVu", "B", bold_path, uni=True)
+                found = True
+                break
+        
+        if not found:
+            print("CRITICAL: Font files not found in any expected directory")
+            
+        self.set_right_margin(10)
+        self.set_left_margin(10)
+
+    def header(self):
+        self.set_font("DejaVu", "B", 22)
+        self.set_text_color(0, 0, 0)
+        self.cell(0, 15, 'INVOICE', ln=True, align='R')
+        
+        self.set_font("DejaVu", "B", 18)
+        self.cell(0, 8, "A1 DENTAL LAB", ln=True, align='L')
+        
+        self.set_font("DejaVu", "", 10)
+        self.set_text_color(80, 80, 80)
+        date_str = datetime.now().strftime('%d/%m/%Y')
+        self.cell(0, 5, get_display(reshape(f"تاريخ الإصدار: {date_str}")), ln=True, align='L')
+        self.ln(8)
+
+    def draw_info_grid(self, entity_name, branch_name=None):
+        self.set_fill_color(245, 245, 245)
+        self.set_font("DejaVu", "B", 11)
+        self.set_text_color(0, 0, 0)
+        
+        if branch_name:
+            self.cell(0, 10, get_display(reshape(f"  بيانات: {entity_name} - {branch_name}")), fill=True, ln=1, align='R')
+        else:
+            self.cell(0, 10, get_display(reshape(f"  بيانات: {entity_name}")), fill=True, ln=1, align='R')
+        self.ln(5)
+
+    def draw_table(self, df):
+        self.set_font("DejaVu", "B", 9)
+        self.set_fill_color(40, 40, 40)
+        self.set_text_color(255, 255, 255)
+        
+        cols = [25, 25, 20, 15, 45, 40, 20]
+        headers = ["السعر", "التاريخ", "اللون", "العدد", "الخامة/Material", "المريض", "كود"]
+        
+        for i, h in enumerate(headers):
+            self.cell(cols[i], 12, get_display(reshape(h)), border=1, align='C', fill=True)
+        self.ln()
+
+        self.set_text_color(0, 0, 0)
+        fill = False
+        
+        for _, row in df.iterrows():
+            self.set_fill_color(252, 252, 252)
+            try:
+                t_map = json.loads(row['teeth_map'])
+                mat_counts = {}
+                for t_info in t_map.values():
+                    m = t_info['material']
+                    mat_counts[m] = mat_counts.get(m, 0) + 1
+                
+                mat_list = list(mat_counts.keys())
+                num_materials = len(mat_list)
+
+                for i, mat_name in enumerate(mat_list):
+                    is_first = (i == 0)
+                    is_last = (i == num_materials - 1)
+                    
+                    if num_materials == 1:
+                        border_style = 1
+                    else:
+                        border_style = 'LR'
+                        if is_first: border_style += 'T'
+                        if is_last: border_style += 'B'
+
+                    price_val   = f"{row['price']:,.2f}" if is_first else ""
+                    date_val    = str(row['entry_date']) if is_first else ""
+                    shade_val   = str(row['color']) if is_first else ""
+                    patient_val = get_display(reshape(str(row['patient']))) if is_first else ""
+                    code_val    = str(row['case_code']) if is_first else ""
+
+                    self.set_font("DejaVu", "", 9)
+                    self.cell(cols[0], 10, price_val,   border=border_style, align='C', fill=fill)
+                    self.cell(cols[1], 10, date_val,    border=border_style, align='C', fill=fill)
+                    self.cell(cols[2], 10, shade_val,   border=border_style, align='C', fill=fill)
+                    
+                    self.cell(cols[3], 10, str(mat_counts[mat_name]), border=1, align='C', fill=fill)
+                    self.cell(cols[4], 10, get_display(reshape(mat_name)), border=1, align='C', fill=fill)
+                    
+                    self.set_font("DejaVu", "", 9)
+                    self.cell(cols[5], 10, patient_val, border=border_style, align='C', fill=fill)
+                    
+                    self.set_font("DejaVu", "", 6)
+                    self.cell(cols[6], 10, code_val,    border=border_style, align='C', fill=fill)
+                    self.ln()
+            except Exception as e:
+                self.set_font("DejaVu", "", 9)
+                self.cell(cols[0], 10, f"{row['price']:,.2f}", border=1, align='C', fill=fill)
+                self.cell(cols[1], 10, str(row['entry_date']), border=1, align='C', fill=fill)
+                self.cell(cols[2], 10, str(row['color']), border=1, align='C', fill=fill)
+                self.cell(cols[3], 10, "1", border=1, align='C', fill=fill)
+                self.cell(cols[4], 10, "N/A", border=1, align='C', fill=fill)
+                self.cell(cols[5], 10, get_display(reshape(str(row['patient']))), border=1, align='C', fill=fill)
+                self.set_font("DejaVu", "", 6)
+                self.cell(cols[6], 10, str(row['case_code']), border=1, align='C', fill=fill)
+                self.ln()
+            
+            fill = not fill
+
+    def draw_total(self, total_amount, raseed_sabek=0, sabek_date="", raseed_mostahak=0):
+        self.ln(5)
+        self.set_font("DejaVu", "", 11)
+        
+        # Row 1: Previous Balance
+        text_sabek = f"الرصيد السابق بتاريخ {sabek_date}"
+        self.cell(140, 10, get_display(reshape(text_sabek)), align='R')
+        self.cell(50, 10, f"{raseed_sabek:,.2f}", border=1, align='C')
+        self.ln()
+
+        # Row 2: Due Balance
+        self.cell(140, 10, get_display(reshape("الرصيد المستحق")), align='R')
+        self.cell(50, 10, f"{raseed_mostahak:,.2f}", border=1, align='C')
+        self.ln()
+
+        # Row 3: Current Invoice Subtotal
+        self.cell(140, 10, get_display(reshape("إجمالي الفاتورة الحالية")), align='R')
+        self.cell(50, 10, f"{total_amount:,.2f}", border=1, align='C')
+        self.ln(12)
+
+        # Row 4: Grand Total (Egmaly el Mosta7akat)
+        grand_total = total_amount + raseed_sabek + raseed_mostahak
+        self.set_font("DejaVu", "B", 14)
+        self.set_fill_color(240, 240, 240)
+        self.cell(140, 12, get_display(reshape("إجمالي المستحقات النهائي (ج.م)")), align='R', fill=True)
+        self.cell(50, 12, f"{grand_total:,.2f}", border=1, align='C', fill=True)
@@ -4,8 +4,11 @@ Login Page - User Authentication
 تسجيل الدخول
 """
 
+import json
 import streamlit as st
-from auth_manager import AuthManager
+import streamlit.components.v1 as components
+from auth_manager import get_auth_manager
+from constants import SESSION_COOKIE
 from datetime import datetime
 
 
@@ -47,7 +50,7 @@ def show_login_page():
                 if not username or not password:
                     st.error("❌ يرجى إدخال اسم المستخدم وكلمة المرور")
                 else:
-                    auth = AuthManager()
+                    auth = get_auth_manager()
                     success, error_msg = auth.login(username, password)
                     
                     if success:
@@ -73,9 +76,52 @@ def show_login_page():
         )
 
 
+def set_session_cookie(session_token=None):
+    """
+    Store the session token in a browser cookie (None deletes it)
+    
+    Streamlit cannot send Set-Cookie headers, so a zero-height component
+    writes it: SameSite=Strict, Secure over HTTPS and without an expiry,
+    so it ends with the browser session. The token never appears in the
+    URL, history, bookmarks or Referer headers.
+    """
+    cookie = f"{SESSION_COOKIE}={session_token or ''}; path=/; SameSite=Strict"
+    if not session_token:
+        cookie += "; max-age=0"
+    components.html(
+        f"<script>document.cookie = {json.dumps(cookie)}"
+        " + (location.protocol === 'https:' ? '; Secure' : '');</script>",
+        height=0
+    )
+
+
 def check_authentication():
-    """Check if user is authenticated"""
-    return st.session_state.get('logged_in', False)
+    """
+    Check if user is authenticated
+    
+    The session token is validated (cached, sliding expiry) on every call, so
+    expired or revoked sessions are logged out. Without session state, a valid
+    token in the session cookie resumes the session after a browser refresh.
+    """
+    auth = get_auth_manager()
+    
+    if st.session_state.get('logged_in', False):
+        if auth.validate_session(st.session_state.get('session_token')):
+            return True
+        for key in ('logged_in', 'username', 'full_name', 'role', 'session_token'):
+            st.session_state.pop(key, None)
+        set_session_cookie(None)
+        st.warning("⚠️ انتهت الجلسة، يرجى تسجيل الدخول مرة أخرى")
+        return False
+    
+    # Cookies as sent when the browser opened this connection
+    session_token = st.context.cookies.get(SESSION_COOKIE)
+    if not session_token:
+        return False
+    if auth.resume_session(session_token):
+        return True
+    set_session_cookie(None)
+    return False
 
 
 def get_current_user():
@@ -99,8 +145,8 @@ def logout_button():
         st.sidebar.markdown(f"**الصلاحية:** {get_role_display(user_info['role'])}")
         
         if st.sidebar.button("🚪 تسجيل الخروج", use_container_width=True):
-            auth = AuthManager()
-            auth.logout(st.session_state.username)
+            auth = get_auth_manager()
+            auth.logout(st.session_state.username, st.session_state.get('session_token'))
             st.rerun()
 
 
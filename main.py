@@ -4,24 +4,16 @@ A1 Dental Lab Management System - Main Application
 نظام إدارة معامل الأسنان A1
 """
 
+import importlib
 import streamlit as st
 from datetime import datetime
 
-# Import page functions
-from login_page import show_login_page, check_authentication, logout_button, get_current_user
-from dashboard_page import show_dashboard_page
-from entry_page import show_entry_page
-from checkout_page import show_checkout_page
-from archive_page import show_archive_page
-from invoice_page import show_invoice_page
-from doctors_page import show_doctors_page
-from user_management_page import show_user_management_page
-from activity_log_page import show_activity_log_page
-
-# Import core utilities
-from database import DatabaseManager
-from auth_manager import AuthManager, require_permission
-from constants import PAGE_TITLE, PAGE_ICON, LAYOUT
+# Only what the login screen needs is imported up front; page modules,
+# the database layer (pandas, NumPy, Pillow) and the PDF stack load on
+# first use
+from login_page import show_login_page, check_authentication, logout_button, get_current_user, set_session_cookie
+from auth_manager import get_auth_manager
+from constants import PAGE_TITLE, PAGE_ICON, LAYOUT, SESSION_COOKIE
 
 # ────────────────────────────────────────────────
 #               Page Configuration
@@ -44,18 +36,68 @@ st.set_page_config(
 #               Initialize Session & DB
 # ────────────────────────────────────────────────
 
-# Initialize database connection
-if 'db' not in st.session_state:
-    st.session_state.db = DatabaseManager()
-
 # Initialize auth manager
 if 'auth' not in st.session_state:
-    st.session_state.auth = AuthManager()
+    st.session_state.auth = get_auth_manager()
 
-db = st.session_state.db
 auth = st.session_state.auth
 
 
+@st.cache_resource(show_spinner=False)
+def get_db():
+    """
+    The process-wide DatabaseManager, shared by every session
+
+    Created (and its module imported) on the first page that needs it, so
+    the schema/migration pass runs once per process instead of once per
+    browser session, and the price matrix, entity tree, query monitor and
+    read pool are shared.
+    """
+    from database import DatabaseManager
+    return DatabaseManager()
+
+
+# ────────────────────────────────────────────────
+#               Pages
+# ────────────────────────────────────────────────
+
+# url path -> (title, icon, module, function, roles allowed (None = all), takes db)
+PAGES = {
+    "dashboard": ("لوحة التحكم", "🏠", "dashboard_page", "show_dashboard_page", None, True),
+    "entry": ("تسجيل حالة جديدة", "📥", "entry_page", "show_entry_page", None, True),
+    "checkout": ("تسليم الحالات", "📤", "checkout_page", "show_checkout_page", None, True),
+    "archive": ("أرشيف الحالات", "📂", "archive_page", "show_archive_page", None, True),
+    "invoices": ("الفواتير والمدفوعات", "💳", "invoice_page", "show_invoice_page", None, True),
+    "doctors": ("إعدادات الأطباء والأسعار", "⚙️", "doctors_page", "show_doctors_page", ('admin', 'manager'), True),
+    "users": ("إدارة المستخدمين", "👥", "user_management_page", "show_user_management_page", ('admin',), False),
+    "activity": ("سجل النشاط", "📋", "activity_log_page", "show_activity_log_page", ('admin',), False),
+    "query_stats": ("أداء قاعدة البيانات", "⏱️", "query_stats_page", "show_query_stats_page", ('admin',), True),
+}
+
+# Sidebar sections of the navigation menu
+MAIN_SECTION = "القائمة الرئيسية"
+ADMIN_SECTION = "إدارة النظام"
+
+
+def make_page(url_path: str) -> st.Page:
+    """st.Page whose module is imported the first time the page is opened"""
+    title, icon, module_name, function_name, _, takes_db = PAGES[url_path]
+
+    def render():
+        st.header(f"{title} • {datetime.now().strftime('%Y-%m-%d')}")
+        try:
+            show_page = getattr(importlib.import_module(module_name), function_name)
+            if takes_db:
+                show_page(get_db())
+            else:
+                show_page()
+        except Exception as e:
+            st.error(f"حدث خطأ أثناء عرض الصفحة: {str(e)}")
+            st.exception(e)
+
+    return st.Page(render, title=title, icon=icon, url_path=url_path, default=(url_path == "dashboard"))
+
+
 # ────────────────────────────────────────────────
 #               Main Application Flow
 # ────────────────────────────────────────────────
@@ -63,7 +105,7 @@ auth = st.session_state.auth
 def main():
     # Show login page if not authenticated
     if not check_authentication():
-        show_login_page()
+        st.navigation([st.Page(show_login_page, title="تسجيل الدخول", icon="🔐")], position="hidden").run()
         return
 
     # User is logged in → show sidebar & content
@@ -72,115 +114,37 @@ def main():
         st.error("حدث خطأ في جلب بيانات المستخدم. يرجى تسجيل الدخول مرة أخرى.")
         return
 
-    # Sidebar - User info & navigation
+    # Write the cookie that resumes the session after a refresh once per token: a browser
+    # that blocks or drops it would otherwise get the component on every rerun
+    session_token = st.session_state.get('session_token')
+    if (session_token and st.context.cookies.get(SESSION_COOKIE) != session_token
+            and st.session_state.get('session_cookie_written') != session_token):
+        st.session_state.session_cookie_written = session_token
+        with st.sidebar:
+            set_session_cookie(session_token)
+
+    # Only the pages the role may open are registered, others are not routable
+    sections = {MAIN_SECTION: [], ADMIN_SECTION: []}
+    registered = {}
+    for url_path, (_, _, _, _, roles, _) in PAGES.items():
+        if roles is None or user['role'] in roles:
+            section = ADMIN_SECTION if roles == ('admin',) else MAIN_SECTION
+            registered[url_path] = make_page(url_path)
+            sections[section].append(registered[url_path])
+    page = st.navigation({name: pages for name, pages in sections.items() if pages})
+
+    # Page modules link to other pages through these (st.page_link / st.switch_page)
+    st.session_state.pages = registered
+
+    # Sidebar - User info (below the navigation menu)
     with st.sidebar:
         st.markdown(f"**مرحباً بك** {user['full_name']}")
         st.caption(f"الصلاحية: {get_role_display(user['role'])}")
-        st.markdown("---")
-
-        # Navigation menu
-        st.markdown("### القائمة الرئيسية")
-
-        # Common pages (most roles can access)
-        if st.button("🏠 لوحة التحكم", use_container_width=True, type="secondary"):
-            st.session_state.current_page = "dashboard"
-
-        if st.button("📥 تسجيل حالة جديدة", use_container_width=True, type="secondary"):
-            st.session_state.current_page = "entry"
-
-        if st.button("📤 تسليم الحالات", use_container_width=True, type="secondary"):
-            st.session_state.current_page = "checkout"
-
-        if st.button("📂 الأرشيف", use_container_width=True, type="secondary"):
-            st.session_state.current_page = "archive"
-
-        if st.button("💳 الفواتير والمدفوعات", use_container_width=True, type="secondary"):
-            st.session_state.current_page = "invoices"
-
-        # Settings - doctors & prices (manager & admin)
-        if user['role'] in ['admin', 'manager']:
-            if st.button("⚙️ إعدادات الأطباء والأسعار", use_container_width=True, type="secondary"):
-                st.session_state.current_page = "doctors"
-
-        # Admin-only pages
-        if user['role'] == 'admin':
-            st.markdown("---")
-            st.markdown("### إدارة النظام")
-
-            if st.button("👥 إدارة المستخدمين", use_container_width=True, type="secondary"):
-                st.session_state.current_page = "users"
-
-            if st.button("📋 سجل النشاط", use_container_width=True, type="secondary"):
-                st.session_state.current_page = "activity"
 
         # Logout
-        st.markdown("---")
         logout_button()
 
-    # ────────────────────────────────────────────────
-    #               Main Content Area
-    # ────────────────────────────────────────────────
-
-    # Default page if none selected
-    if 'current_page' not in st.session_state:
-        st.session_state.current_page = "dashboard"
-
-    # Show header with current page title
-    page_titles = {
-        "dashboard": "لوحة التحكم",
-        "entry": "تسجيل حالة جديدة",
-        "checkout": "تسليم الحالات",
-        "archive": "أرشيف الحالات",
-        "invoices": "الفواتير والمدفوعات",
-        "doctors": "إعدادات الأطباء والأسعار",
-        "users": "إدارة المستخدمين",
-        "activity": "سجل النشاط"
-    }
-
-    current_title = page_titles.get(st.session_state.current_page, "الصفحة الرئيسية")
-    st.header(f"{current_title} • {datetime.now().strftime('%Y-%m-%d')}")
-
-    # Show selected page
-    try:
-        if st.session_state.current_page == "dashboard":
-            show_dashboard_page(db)
-
-        elif st.session_state.current_page == "entry":
-            show_entry_page(db)
-
-        elif st.session_state.current_page == "checkout":
-            show_checkout_page(db)
-
-        elif st.session_state.current_page == "archive":
-            show_archive_page(db)
-
-        elif st.session_state.current_page == "invoices":
-            show_invoice_page(db)
-
-        elif st.session_state.current_page == "doctors":
-            # Only manager & admin can access
-            if user['role'] in ['admin', 'manager']:
-                show_doctors_page(db)
-            else:
-                st.error("ليس لديك صلاحية الوصول إلى هذه الصفحة")
-
-        elif st.session_state.current_page == "users":
-            # Admin only
-            if user['role'] == 'admin':
-                show_user_management_page()
-            else:
-                st.error("هذه الصفحة متاحة للمدير فقط")
-
-        elif st.session_state.current_page == "activity":
-            # Admin only (or you can change to manager too)
-            if user['role'] == 'admin':
-                show_activity_log_page()
-            else:
-                st.error("هذه الصفحة متاحة للمدير فقط")
-
-    except Exception as e:
-        st.error(f"حدث خطأ أثناء عرض الصفحة: {str(e)}")
-        st.exception(e)
+    page.run()
 
 
 # ────────────────────────────────────────────────
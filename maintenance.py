@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""
+Database Maintenance - Scheduled housekeeping for the SQLite database
+Features:
+- PRAGMA optimize and ANALYZE of tables whose row count changed
+- WAL checkpoint (TRUNCATE) so the -wal file does not grow forever
+- Incremental vacuum to return free pages left by deletions
+- Attachment garbage collection and cold storage (attachment_gc.py)
+- Runs on a background thread only while the database is idle (statements,
+  logins, activity-log flushes and commits of other processes all count)
+- Before/after page counts and timings recorded in maintenance_log
+"""
+
+import sqlite3
+import threading
+import time
+import weakref
+import os
+from typing import Dict, Optional
+
+import pandas as pd
+
+from attachment_gc import AttachmentGC
+from constants import (
+    MAINTENANCE_INTERVAL_SECONDS,
+    MAINTENANCE_IDLE_SECONDS,
+    MAINTENANCE_CHECK_SECONDS,
+    ANALYZE_CHANGE_RATIO,
+)
+
+_REGISTRY: Dict[str, "MaintenanceScheduler"] = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+class DatabaseMaintenance:
+    """Run maintenance tasks against one database file and log the results"""
+
+    def __init__(self, db_name: str):
+        self.db_name = db_name
+        self._lock = threading.Lock()
+        self._init_tables()
+
+    def _init_tables(self):
+        """Create maintenance tables"""
+        with sqlite3.connect(self.db_name) as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS maintenance_log (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    run_at TEXT DEFAULT (datetime('now')),
+                    task TEXT NOT NULL,
+                    duration_ms REAL,
+                    pages_before INTEGER,
+                    pages_after INTEGER,
+                    free_pages_before INTEGER,
+                    free_pages_after INTEGER,
+                    details TEXT,
+                    error TEXT
+                )
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS maintenance_table_stats (
+                    table_name TEXT PRIMARY KEY,
+                    row_count INTEGER,
+                    analyzed_at TEXT
+                )
+            """)
+            conn.commit()
+
+    @staticmethod
+    def _page_counts(cursor) -> tuple:
+        """(page_count, freelist_count) of the main database"""
+        pages = cursor.execute("PRAGMA page_count").fetchone()[0]
+        free_pages = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+        return pages, free_pages
+
+    def _log(self, cursor, task: str, duration_ms: float, before: tuple, after: tuple,
+             details: str = None, error: str = None):
+        """Append one row to maintenance_log"""
+        cursor.execute("""
+            INSERT INTO maintenance_log (
+                task, duration_ms, pages_before, pages_after,
+                free_pages_before, free_pages_after, details, error
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (task, round(duration_ms, 2), before[0], after[0], before[1], after[1], details, error))
+
+    # =========================================================================
+    #                         TASKS
+    # =========================================================================
+
+    def _changed_tables(self, cursor) -> Dict[str, int]:
+        """User tables whose row count moved more than ANALYZE_CHANGE_RATIO since the last ANALYZE"""
+        tables = [row[0] for row in cursor.execute("""
+            SELECT name FROM sqlite_master
+            WHERE type = 'table' AND name NOT LIKE 'sqlite_%'
+              AND name NOT IN ('maintenance_log', 'maintenance_table_stats')
+        """).fetchall()]
+        analyzed = dict(cursor.execute("SELECT table_name, row_count FROM maintenance_table_stats").fetchall())
+
+        changed = {}
+        for table in tables:
+            count = cursor.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+            previous = analyzed.get(table)
+            if previous is None or abs(count - previous) > max(previous, 1) * ANALYZE_CHANGE_RATIO:
+                changed[table] = count
+        return changed
+
+    def _analyze(self, cursor) -> str:
+        """ANALYZE changed tables, then let PRAGMA optimize handle the rest"""
+        changed = self._changed_tables(cursor)
+        for table, count in changed.items():
+            cursor.execute(f'ANALYZE "{table}"')
+            cursor.execute("""
+                INSERT INTO maintenance_table_stats (table_name, row_count, analyzed_at)
+                VALUES (?, ?, datetime('now'))
+                ON CONFLICT(table_name) DO UPDATE SET
+                    row_count = excluded.row_count,
+                    analyzed_at = excluded.analyzed_at
+            """, (table, count))
+        cursor.execute("PRAGMA optimize")
+        return ", ".join(changed) if changed else "no changed tables"
+
+    def _checkpoint(self, cursor) -> str:
+        """Copy the WAL into the database and truncate it"""
+        busy, wal_frames, checkpointed = cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+        return f"busy={busy}, wal_frames={wal_frames}, checkpointed={checkpointed}"
+
+    def _incremental_vacuum(self, cursor, full_vacuum: bool = False) -> str:
+        """
+        Release every free page back to the file system
+
+        incremental_vacuum only works once auto_vacuum is INCREMENTAL (2).
+        An existing file needs a one-off full VACUUM to change the mode, which
+        rewrites the file under an exclusive lock, so it only happens when
+        full_vacuum is set: in the idle window or from `a1lab maintenance
+        --vacuum`, never at start-up or from a manual run.
+        """
+        if cursor.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            if not full_vacuum:
+                return "auto_vacuum not INCREMENTAL yet, one-off VACUUM skipped"
+            cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            cursor.execute("VACUUM")
+            return "auto_vacuum switched to INCREMENTAL (one-off VACUUM)"
+        cursor.execute("PRAGMA incremental_vacuum").fetchall()
+        return "freelist released"
+
+    def _attachment_gc(self, cursor) -> str:
+        """Delete orphaned uploads and bundle old ones (own connection, it commits as it goes)"""
+        return AttachmentGC(self.db_name).run()
+
+    def run(self, full_vacuum: bool = False) -> pd.DataFrame:
+        """Run all tasks once and return their log rows (full_vacuum: see _incremental_vacuum)"""
+        tasks = [
+            ('analyze', self._analyze),
+            ('attachment_gc', self._attachment_gc),
+            ('wal_checkpoint', self._checkpoint),
+            ('incremental_vacuum', lambda cursor: self._incremental_vacuum(cursor, full_vacuum)),
+        ]
+        if not self._lock.acquire(blocking=False):
+            return pd.DataFrame()
+
+        try:
+            # Autocommit: ANALYZE, checkpoints and vacuum must not run inside a transaction
+            with sqlite3.connect(self.db_name, isolation_level=None) as conn:
+                cursor = conn.cursor()
+                first_id = None
+                for task, func in tasks:
+                    before = self._page_counts(cursor)
+                    start = time.perf_counter()
+                    details, error = None, None
+                    try:
+                        details = func(cursor)
+                    except (sqlite3.Error, OSError) as e:
+                        error = str(e)
+                        print(f"Maintenance error ({task}): {e}")
+                    after = self._page_counts(cursor)
+                    self._log(cursor, task, (time.perf_counter() - start) * 1000, before, after, details, error)
+                    if first_id is None:
+                        first_id = cursor.lastrowid
+                return pd.read_sql_query(
+                    "SELECT * FROM maintenance_log WHERE id >= ? ORDER BY id", conn, params=(first_id,)
+                )
+        finally:
+            self._lock.release()
+
+    def get_log(self, limit: int = 100) -> pd.DataFrame:
+        """Most recent maintenance runs, newest first"""
+        with sqlite3.connect(self.db_name) as conn:
+            return pd.read_sql_query(
+                "SELECT * FROM maintenance_log ORDER BY id DESC LIMIT ?", conn, params=(limit,)
+            )
+
+    def seconds_since_last_run(self) -> Optional[float]:
+        """Seconds since the last logged maintenance run, None if it never ran"""
+        with sqlite3.connect(self.db_name) as conn:
+            row = conn.execute(
+                "SELECT (julianday('now') - julianday(MAX(run_at))) * 86400 FROM maintenance_log"
+            ).fetchone()
+        return row[0] if row else None
+
+
+class MaintenanceScheduler:
+    """
+    Background thread that runs DatabaseMaintenance during idle periods
+
+    Activity is read from the watched sources of this process (QueryMonitors,
+    the AuthManager, the ActivityWriter) and from PRAGMA data_version, which
+    changes whenever another connection or process commits; maintenance runs
+    once the database has been quiet for MAINTENANCE_IDLE_SECONDS and the
+    last run is older than MAINTENANCE_INTERVAL_SECONDS.
+    """
+
+    def __init__(self, db_name: str):
+        self.maintenance = DatabaseMaintenance(db_name)
+        self._sources = weakref.WeakSet()
+        elapsed = self.maintenance.seconds_since_last_run()
+        self._last_run = time.time() - elapsed if elapsed is not None else 0.0
+        # Own connection for PRAGMA data_version, which only sees commits of other connections
+        self._version_conn = sqlite3.connect(db_name, check_same_thread=False)
+        self._version_lock = threading.Lock()
+        self._data_version = None
+        self._last_commit_seen = 0.0
+        self._thread = threading.Thread(target=self._loop, name="a1-db-maintenance", daemon=True)
+        self._thread.start()
+
+    def watch(self, source):
+        """Track activity of anything with a last_activity timestamp (QueryMonitor, AuthManager, ActivityWriter)"""
+        self._sources.add(source)
+
+    def _poll_data_version(self):
+        """Note the time when PRAGMA data_version moved since the previous poll"""
+        with self._version_lock:
+            try:
+                version = self._version_conn.execute("PRAGMA data_version").fetchone()[0]
+            except sqlite3.Error:
+                # Locked or busy: someone is writing right now
+                self._last_commit_seen = time.time()
+                return
+            if self._data_version is not None and version != self._data_version:
+                self._last_commit_seen = time.time()
+            self._data_version = version
+
+    def idle_seconds(self) -> float:
+        """Seconds since the last activity of any watched source or commit to the database"""
+        self._poll_data_version()
+        last_activity = max((s.last_activity for s in list(self._sources)), default=0.0)
+        return time.time() - max(last_activity, self._last_commit_seen)
+
+    def run_now(self, full_vacuum: bool = False) -> pd.DataFrame:
+        """Run maintenance immediately (the one-off VACUUM only with full_vacuum)"""
+        result = self.maintenance.run(full_vacuum)
+        self._last_run = time.time()
+        # Skip over the maintenance run's own commits
+        with self._version_lock:
+            self._data_version = None
+        self._poll_data_version()
+        return result
+
+    def _loop(self):
+        """Wake up periodically and run maintenance when due and idle"""
+        while True:
+            time.sleep(MAINTENANCE_CHECK_SECONDS)
+            try:
+                # Polled every wake-up so commits of other processes are seen within MAINTENANCE_CHECK_SECONDS
+                idle = self.idle_seconds()
+                due = time.time() - self._last_run >= MAINTENANCE_INTERVAL_SECONDS
+                if due and idle >= MAINTENANCE_IDLE_SECONDS:
+                    self.run_now(full_vacuum=True)
+            except Exception as e:
+                print(f"Maintenance scheduler error: {e}")
+
+
+def get_maintenance_scheduler(db_name: str) -> MaintenanceScheduler:
+    """Return the process-wide maintenance scheduler of a database file"""
+    key = os.path.abspath(db_name)
+    with _REGISTRY_LOCK:
+        scheduler = _REGISTRY.get(key)
+        if scheduler is None:
+            scheduler = _REGISTRY[key] = MaintenanceScheduler(db_name)
+        return scheduler
@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""
+Mesh Analyzer - Geometry and quality figures for STL/OBJ scan attachments
+Features:
+- Binary STL memory-mapped with numpy.memmap and a structured triangle dtype
+- ASCII STL and OBJ parsed in streaming chunks
+- Triangle count, bounding box, surface area, volume, watertightness
+- Results stored per content hash in attachment_metadata, analyzed on a worker
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable
+
+import numpy as np
+
+from constants import ALLOWED_3D_EXTENSIONS, MESH_PARSE_CHUNK_BYTES
+
+MESH_EXTENSIONS = tuple(f".{ext}" for ext in ALLOWED_3D_EXTENSIONS)
+
+# Binary STL: 80-byte header, uint32 triangle count, then 50-byte records
+STL_HEADER_BYTES = 84
+STL_TRIANGLE_DTYPE = np.dtype([
+    ('normal', '<f4', (3,)),
+    ('vertices', '<f4', (3, 3)),
+    ('attribute', '<u2'),
+])
+
+
+# =============================================================================
+#                           LOADERS
+# =============================================================================
+
+def is_binary_stl(path: str) -> bool:
+    """Binary STL files are exactly header + count * 50 bytes ("solid" headers are common in both)"""
+    size = os.path.getsize(path)
+    if size < STL_HEADER_BYTES:
+        return False
+    with open(path, "rb") as f:
+        f.seek(80)
+        count = int(np.frombuffer(f.read(4), dtype='<u4')[0])
+    return size == STL_HEADER_BYTES + count * STL_TRIANGLE_DTYPE.itemsize
+
+
+def load_binary_stl(path: str) -> np.ndarray:
+    """(n, 3, 3) float32 view of the triangles, memory-mapped rather than read"""
+    count = (os.path.getsize(path) - STL_HEADER_BYTES) // STL_TRIANGLE_DTYPE.itemsize
+    if count == 0:
+        return np.empty((0, 3, 3), dtype=np.float32)
+    records = np.memmap(path, dtype=STL_TRIANGLE_DTYPE, mode='r', offset=STL_HEADER_BYTES, shape=(count,))
+    return records['vertices']
+
+
+def load_ascii_stl(path: str) -> np.ndarray:
+    """(n, 3, 3) triangles of an ASCII STL, parsed MESH_PARSE_CHUNK_BYTES at a time"""
+    chunks = []
+    with open(path, "rb") as f:
+        while True:
+            lines = f.readlines(MESH_PARSE_CHUNK_BYTES)
+            if not lines:
+                break
+            coords = b" ".join(line.strip()[6:] for line in lines if line.lstrip().startswith(b"vertex"))
+            if coords:
+                chunks.append(np.array(coords.split(), dtype=np.float32))
+    vertices = np.concatenate(chunks) if chunks else np.empty(0, dtype=np.float32)
+    return vertices[:len(vertices) // 9 * 9].reshape(-1, 3, 3)
+
+
+def load_obj(path: str) -> np.ndarray:
+    """(n, 3, 3) triangles of an OBJ, polygons fan-triangulated, parsed in chunks"""
+    vertex_chunks = []
+    vertex_count = 0
+    faces = []
+    with open(path, "rb") as f:
+        while True:
+            lines = f.readlines(MESH_PARSE_CHUNK_BYTES)
+            if not lines:
+                break
+            coords = []
+            for line in lines:
+                if line.startswith(b"v "):
+                    # Only x y z; some exporters append w or vertex colours
+                    coords.append(b" ".join(line.split()[1:4]))
+                    vertex_count += 1
+                elif line.startswith(b"f "):
+                    # "f v/vt/vn ..." with 1-based or negative (relative) indices
+                    indices = [int(token.split(b"/")[0]) for token in line[2:].split()]
+                    indices = [i - 1 if i > 0 else vertex_count + i for i in indices]
+                    faces.extend((indices[0], indices[k], indices[k + 1]) for k in range(1, len(indices) - 1))
+            if coords:
+                vertex_chunks.append(
+                    np.array(b" ".join(coords).split(), dtype=np.float32).reshape(-1, 3)
+                )
+
+    if not faces or not vertex_chunks:
+        return np.empty((0, 3, 3), dtype=np.float32)
+    vertices = np.concatenate(vertex_chunks)
+    return vertices[np.asarray(faces, dtype=np.int64)]
+
+
+def load_mesh(path: str) -> np.ndarray:
+    """(n, 3, 3) triangles of an STL or OBJ file"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".obj":
+        return load_obj(path)
+    if is_binary_stl(path):
+        return load_binary_stl(path)
+    return load_ascii_stl(path)
+
+
+# =============================================================================
+#                           ANALYSIS
+# =============================================================================
+
+def weld_vertices(corners: np.ndarray) -> np.ndarray:
+    """
+    Vertex index of every corner ((m, 3) float32, contiguous), merging identical coordinates
+
+    STL stores every corner separately; exact float equality is what the
+    exporting CAD software produces for shared corners.
+    """
+    # +0.0 folds -0.0 into 0.0 so both get the same bit pattern
+    corners = corners + np.float32(0.0)
+    bits = corners.view(np.uint32).astype(np.uint64)
+    keys = (bits[:, 0] << np.uint64(32)) ^ (bits[:, 1] << np.uint64(16)) ^ bits[:, 2] * np.uint64(0x9E3779B1)
+
+    # np.unique(return_inverse) spelled out around one unstable argsort
+    order = keys.argsort()
+    sorted_keys = keys[order]
+    starts = np.empty(len(keys), dtype=bool)
+    starts[0] = True
+    np.not_equal(sorted_keys[1:], sorted_keys[:-1], out=starts[1:])
+    group = np.cumsum(starts) - 1
+    inverse = np.empty(len(keys), dtype=np.int64)
+    inverse[order] = group
+
+    # Hash first, then confirm every corner matches its group's first corner (in sorted order)
+    sorted_corners = corners[order]
+    if not np.array_equal(sorted_corners[np.flatnonzero(starts)][group], sorted_corners):
+        # Hash collision between different points: fall back to exact row comparison
+        _, inverse = np.unique(corners, axis=0, return_inverse=True)
+    return inverse.reshape(-1)
+
+
+def analyze_triangles(triangles: np.ndarray) -> Dict:
+    """Triangle count, bounding box, area, volume and edge manifoldness of a triangle soup"""
+    count = len(triangles)
+    if count == 0:
+        return {"triangle_count": 0, "is_watertight": 0}
+
+    # One contiguous copy; the memory-mapped records interleave normals and attributes
+    corners = np.ascontiguousarray(triangles, dtype=np.float32).reshape(-1, 3)
+    # Per column: reducing the (m, 3) array along axis 0 is several times slower
+    bbox_min = [corners[:, k].min() for k in range(3)]
+    bbox_max = [corners[:, k].max() for k in range(3)]
+
+    v0, v1, v2 = (corners[k::3].astype(np.float64) for k in range(3))
+    e1 = v1 - v0
+    e2 = v2 - v0
+    area_vectors = np.stack([
+        e1[:, 1] * e2[:, 2] - e1[:, 2] * e2[:, 1],
+        e1[:, 2] * e2[:, 0] - e1[:, 0] * e2[:, 2],
+        e1[:, 0] * e2[:, 1] - e1[:, 1] * e2[:, 0],
+    ], axis=1)
+    surface_area = 0.5 * np.sqrt(np.einsum('ij,ij->i', area_vectors, area_vectors)).sum()
+    # Signed tetrahedron volumes against the origin, v0 . (e1 x e2) == v0 . (v1 x v2);
+    # only meaningful when the mesh is closed
+    volume = abs(np.einsum('ij,ij->', v0, area_vectors)) / 6.0
+
+    # Watertight: every undirected edge is shared by exactly two triangles
+    vertex_ids = weld_vertices(corners).reshape(-1, 3)
+    vertex_count = int(vertex_ids.max()) + 1
+    edge_keys = np.concatenate([
+        np.minimum(vertex_ids[:, a], vertex_ids[:, b]) * vertex_count + np.maximum(vertex_ids[:, a], vertex_ids[:, b])
+        for a, b in ((0, 1), (1, 2), (2, 0))
+    ])
+    _, edge_counts = np.unique(edge_keys, return_counts=True)
+    boundary_edges = int((edge_counts == 1).sum())
+    nonmanifold_edges = int((edge_counts > 2).sum())
+
+    return {
+        "triangle_count": count,
+        "vertex_count": vertex_count,
+        "min_x": float(bbox_min[0]), "min_y": float(bbox_min[1]), "min_z": float(bbox_min[2]),
+        "max_x": float(bbox_max[0]), "max_y": float(bbox_max[1]), "max_z": float(bbox_max[2]),
+        "surface_area": float(surface_area),
+        "volume": float(volume),
+        "boundary_edges": boundary_edges,
+        "nonmanifold_edges": nonmanifold_edges,
+        "is_watertight": int(boundary_edges == 0 and nonmanifold_edges == 0),
+    }
+
+
+def analyze_mesh(path: str) -> Dict:
+    """Load and analyze an STL/OBJ file, with the time it took"""
+    start = time.perf_counter()
+    result = analyze_triangles(load_mesh(path))
+    result["analyze_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return result
+
+
+# =============================================================================
+#                           METADATA STORE
+# =============================================================================
+
+METADATA_COLUMNS = (
+    "triangle_count", "vertex_count",
+    "min_x", "min_y", "min_z", "max_x", "max_y", "max_z",
+    "surface_area", "volume", "boundary_edges", "nonmanifold_edges",
+    "is_watertight", "analyze_ms", "error",
+)
+
+
+class MeshMetadata:
+    """Analyze 3D scan blobs on a worker thread and keep the results per content hash"""
+
+    def __init__(self, db_name: str):
+        self.db_name = db_name
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self._init_tables()
+        self._thread = threading.Thread(target=self._loop, name="a1-mesh-analyzer", daemon=True)
+        self._thread.start()
+
+    def _init_tables(self):
+        """Create the metadata table"""
+        with sqlite3.connect(self.db_name) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS attachment_metadata (
+                    sha256 TEXT PRIMARY KEY,
+                    triangle_count INTEGER,
+                    vertex_count INTEGER,
+                    min_x REAL, min_y REAL, min_z REAL,
+                    max_x REAL, max_y REAL, max_z REAL,
+                    surface_area REAL,
+                    volume REAL,
+                    boundary_edges INTEGER,
+                    nonmanifold_edges INTEGER,
+                    is_watertight INTEGER,
+                    analyze_ms REAL,
+                    error TEXT,
+                    analyzed_at TEXT DEFAULT (datetime('now'))
+                )
+            """)
+            conn.commit()
+
+    @staticmethod
+    def is_mesh(extension: str) -> bool:
+        """Whether blobs of this extension are 3D scans"""
+        return (extension or "").lower() in MESH_EXTENSIONS
+
+    def submit(self, sha256: str, source_path: str, extension: str):
+        """Queue a blob for analysis; duplicates and other file types are ignored"""
+        if not self.is_mesh(extension):
+            return
+        with self._pending_lock:
+            if sha256 in self._pending:
+                return
+            self._pending.add(sha256)
+        self._queue.put((sha256, source_path))
+
+    def submit_missing(self):
+        """Queue every stored 3D scan that was not analyzed yet"""
+        with sqlite3.connect(self.db_name) as conn:
+            rows = conn.execute("""
+                SELECT b.sha256, b.path, b.extension
+                FROM attachment_blobs b
+                WHERE NOT EXISTS (SELECT 1 FROM attachment_metadata m WHERE m.sha256 = b.sha256)
+            """).fetchall()
+        for sha256, path, extension in rows:
+            self.submit(sha256, path, extension)
+
+    def _loop(self):
+        """Analyze queued blobs one at a time"""
+        while True:
+            sha256, source_path = self._queue.get()
+            try:
+                self.analyze(sha256, source_path)
+            except Exception as e:
+                print(f"Mesh analysis error ({sha256[:12]}): {e}")
+            finally:
+                with self._pending_lock:
+                    self._pending.discard(sha256)
+
+    def analyze(self, sha256: str, source_path: str) -> Dict:
+        """Analyze one blob and store the result (or the parse error)"""
+        try:
+            result = analyze_mesh(source_path)
+        except (OSError, ValueError, IndexError) as e:
+            result = {"error": str(e)}
+
+        values = [result.get(column) for column in METADATA_COLUMNS]
+        with sqlite3.connect(self.db_name) as conn:
+            conn.execute(f"""
+                INSERT OR REPLACE INTO attachment_metadata (sha256, {', '.join(METADATA_COLUMNS)})
+                VALUES ({', '.join('?' * (len(METADATA_COLUMNS) + 1))})
+            """, [sha256] + values)
+            conn.commit()
+        return result
+
+    def get_metadata(self, sha256s: Iterable[str]) -> Dict[str, Dict]:
+        """sha256 -> metadata row for the analyzed blobs"""
+        sha256s = list(sha256s)
+        if not sha256s:
+            return {}
+        placeholders = ", ".join("?" * len(sha256s))
+        with sqlite3.connect(self.db_name) as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute(
+                f"SELECT * FROM attachment_metadata WHERE sha256 IN ({placeholders})", sha256s
+            ).fetchall()
+        return {row['sha256']: dict(row) for row in rows}
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Price Matrix - Process-wide cache of material prices
+Features:
+- Whole entity × material price table loaded with a single query
+- Shared by every DatabaseManager (and session) using the same database file
+- Write-through invalidation from the price write paths
+- Hierarchical resolution: branch → center/doctor → material catalog default
+- Batch resolution of whole teeth maps
+"""
+
+import os
+import sqlite3
+import threading
+from typing import Dict, Optional, Tuple
+
+# material -> (price, cost_price)
+PriceRow = Tuple[float, float]
+# material -> (price, cost_price, source)
+ResolvedPrice = Tuple[float, float, str]
+
+# Where a resolved price came from, most specific first
+SOURCE_BRANCH = 'branch'
+SOURCE_ENTITY = 'entity'
+SOURCE_CATALOG = 'catalog'
+
+# Pseudo entity id holding the material_catalog defaults in the matrix
+CATALOG_KEY = 0
+
+_REGISTRY: Dict[str, "PriceMatrix"] = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+class PriceMatrix:
+    """Read-mostly entity × material price table"""
+
+    def __init__(self, db_name: str):
+        self.db_name = db_name
+        self._matrix: Optional[Dict[int, Dict[str, PriceRow]]] = None
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[int, Dict[str, PriceRow]]:
+        """Build the matrix from doctors_prices and material_catalog, reloading once after invalidation"""
+        matrix = self._matrix
+        if matrix is not None:
+            return matrix
+
+        with self._lock:
+            if self._matrix is not None:
+                return self._matrix
+            generation = self._generation
+
+        matrix = {CATALOG_KEY: {}}
+        with sqlite3.connect(self.db_name) as conn:
+            rows = conn.execute("""
+                SELECT entity_id, material, price, cost_price
+                FROM doctors_prices
+                WHERE is_active = 1 AND entity_id IS NOT NULL
+                UNION ALL
+                SELECT ?, material_name, default_price, default_cost
+                FROM material_catalog
+                WHERE is_active = 1
+            """, (CATALOG_KEY,)).fetchall()
+        for entity_id, material, price, cost_price in rows:
+            matrix.setdefault(entity_id, {})[material] = (float(price or 0), float(cost_price or 0))
+
+        with self._lock:
+            # A write during the load makes this snapshot stale, don't keep it
+            if generation == self._generation:
+                self._matrix = matrix
+        return matrix
+
+    def get_prices(self, entity_id: int) -> Dict[str, PriceRow]:
+        """All active material prices set directly on an entity"""
+        return dict(self._load().get(entity_id, {}))
+
+    def resolve_prices(self, entity_id: int, branch_id: Optional[int] = None) -> Dict[str, ResolvedPrice]:
+        """
+        Effective price list of a doctor/center (and branch)
+
+        Catalog defaults are overridden by the entity's own prices, which are
+        overridden by the branch's prices; every entry carries its source.
+        """
+        matrix = self._load()
+        resolved = {}
+        levels = [(CATALOG_KEY, SOURCE_CATALOG), (entity_id, SOURCE_ENTITY)]
+        if branch_id:
+            levels.append((branch_id, SOURCE_BRANCH))
+        for key, source in levels:
+            for material, (price, cost_price) in matrix.get(key, {}).items():
+                resolved[material] = (price, cost_price, source)
+        return resolved
+
+    def resolve_teeth_map(self, entity_id: int, branch_id: Optional[int],
+                          teeth_materials: Dict[str, str]) -> Dict[str, Dict]:
+        """Price a whole {tooth: material} map in one pass"""
+        resolved = self.resolve_prices(entity_id, branch_id)
+        teeth_map = {}
+        for tooth, material in teeth_materials.items():
+            price, cost_price, source = resolved.get(material, (0.0, 0.0, None))
+            teeth_map[str(tooth)] = {
+                "material": material,
+                "price": price,
+                "cost": cost_price,
+                "source": source,
+            }
+        return teeth_map
+
+    def get_price(self, entity_id: int, material: str, branch_id: Optional[int] = None) -> float:
+        """Effective price of one material, 0 when not priced anywhere"""
+        matrix = self._load()
+        for key in (branch_id, entity_id, CATALOG_KEY):
+            if key is not None and material in matrix.get(key, {}):
+                return matrix[key][material][0]
+        return 0.0
+
+    def invalidate(self):
+        """Drop the cached matrix, the next read reloads it"""
+        with self._lock:
+            self._generation += 1
+            self._matrix = None
+
+
+def get_price_matrix(db_name: str) -> PriceMatrix:
+    """Return the process-wide price matrix of a database file"""
+    key = os.path.abspath(db_name)
+    with _REGISTRY_LOCK:
+        matrix = _REGISTRY.get(key)
+        if matrix is None:
+            matrix = _REGISTRY[key] = PriceMatrix(db_name)
+        return matrix
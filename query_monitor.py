@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+Query Monitor - Statement instrumentation for DatabaseManager
+Features:
+- Duration, row count and calling page of every statement
+- Bounded in-memory ring buffer of recent statements
+- Rotating query log file
+- Automatic EXPLAIN QUERY PLAN capture for slow statements
+- Per-statement p50/p95/p99 summary
+"""
+
+import sqlite3
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+from typing import Optional, Dict, List, Tuple, Any
+
+import pandas as pd
+
+from constants import (
+    QUERY_LOG_FOLDER,
+    QUERY_LOG_MAX_BYTES,
+    QUERY_LOG_BACKUPS,
+    QUERY_BUFFER_SIZE,
+    SLOW_QUERY_THRESHOLD_MS,
+)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_LOGGER_LOCK = threading.Lock()
+
+
+def normalize_statement(query: str) -> str:
+    """Collapse whitespace so the same statement always groups together"""
+    return _WHITESPACE_RE.sub(" ", query).strip()
+
+
+def find_calling_page() -> str:
+    """Return the page module (e.g. 'invoice_page') that issued the statement"""
+    frame = sys._getframe(1)
+    fallback = None
+    while frame is not None:
+        filename = os.path.basename(frame.f_code.co_filename)
+        if filename.endswith("_page.py"):
+            return filename[:-3]
+        if fallback is None and frame.f_code.co_name.startswith("show_"):
+            fallback = frame.f_code.co_name
+        frame = frame.f_back
+    return fallback or "-"
+
+
+def _get_query_logger(log_folder: str) -> logging.Logger:
+    """Create the rotating file logger once per process"""
+    logger = logging.getLogger("a1lab.queries")
+    with _LOGGER_LOCK:
+        if not logger.handlers:
+            os.makedirs(log_folder, exist_ok=True)
+            handler = RotatingFileHandler(
+                os.path.join(log_folder, "queries.log"),
+                maxBytes=QUERY_LOG_MAX_BYTES,
+                backupCount=QUERY_LOG_BACKUPS,
+                encoding="utf-8",
+            )
+            handler.setFormatter(logging.Formatter("%(asctime)s | %(levelname)s | %(message)s"))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+    return logger
+
+
+class QueryMonitor:
+    """Record and summarize every statement executed by a DatabaseManager"""
+
+    # Re-capture the plan of a slow statement at most this often
+    PLAN_REFRESH_SECONDS = 600
+
+    def __init__(self, db_name: str, log_folder: str = QUERY_LOG_FOLDER,
+                 buffer_size: int = QUERY_BUFFER_SIZE,
+                 slow_threshold_ms: float = SLOW_QUERY_THRESHOLD_MS):
+        self.db_name = db_name
+        self.slow_threshold_ms = slow_threshold_ms
+        self._records = deque(maxlen=buffer_size)
+        self._plans: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self.logger = _get_query_logger(log_folder)
+        # Wall-clock time of the last recorded statement, used for idle detection
+        self.last_activity = 0.0
+
+    # =========================================================================
+    #                         RECORDING
+    # =========================================================================
+
+    def record(self, query: str, params: Tuple, kind: str, duration_ms: float,
+               row_count: int, page: str, error: Optional[str] = None):
+        """Store one executed statement and capture its plan if it was slow"""
+        statement = normalize_statement(query)
+        entry = {
+            'timestamp': datetime.now().isoformat(timespec='milliseconds'),
+            'statement': statement,
+            'kind': kind,
+            'duration_ms': round(duration_ms, 3),
+            'row_count': row_count,
+            'page': page,
+            'error': error,
+        }
+
+        with self._lock:
+            self._records.append(entry)
+        self.last_activity = time.time()
+
+        message = f"{page} | {kind} | {duration_ms:.1f} ms | {row_count} rows | {statement}"
+        if error:
+            self.logger.error(f"{message} | {error}")
+        elif duration_ms >= self.slow_threshold_ms:
+            self.logger.warning(f"SLOW | {message}")
+            if kind != 'transaction':
+                self._capture_plan(statement, query, params, duration_ms)
+        else:
+            self.logger.info(message)
+
+    def _capture_plan(self, statement: str, query: str, params: Tuple, duration_ms: float):
+        """Run EXPLAIN QUERY PLAN for a slow statement and keep the result"""
+        with self._lock:
+            existing = self._plans.get(statement)
+            if existing and time.time() - existing['captured_ts'] < self.PLAN_REFRESH_SECONDS:
+                existing['duration_ms'] = max(existing['duration_ms'], duration_ms)
+                return
+
+        try:
+            with sqlite3.connect(self.db_name) as conn:
+                rows = conn.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()
+            plan = "\n".join(f"{'  ' * self._plan_depth(rows, row)}{row[3]}" for row in rows)
+        except Exception as e:
+            plan = f"EXPLAIN failed: {e}"
+
+        with self._lock:
+            self._plans[statement] = {
+                'statement': statement,
+                'plan': plan,
+                'duration_ms': round(duration_ms, 3),
+                'captured_at': datetime.now().isoformat(timespec='seconds'),
+                'captured_ts': time.time(),
+            }
+        self.logger.warning(f"PLAN | {statement}\n{plan}")
+
+    @staticmethod
+    def _plan_depth(rows: List[Tuple], row: Tuple) -> int:
+        """Indentation depth of an EXPLAIN QUERY PLAN row (id, parent, notused, detail)"""
+        parents = {r[0]: r[1] for r in rows}
+        depth, parent = 0, row[1]
+        while parent in parents and depth < 20:
+            depth += 1
+            parent = parents[parent]
+        return depth
+
+    # =========================================================================
+    #                         REPORTING
+    # =========================================================================
+
+    def get_recent(self, limit: int = 200) -> pd.DataFrame:
+        """Most recent statements, newest first"""
+        with self._lock:
+            records = list(self._records)[-limit:]
+        return pd.DataFrame(list(reversed(records)))
+
+    def get_summary(self) -> pd.DataFrame:
+        """Per-statement call count and p50/p95/p99 latency from the ring buffer"""
+        with self._lock:
+            records = list(self._records)
+
+        if not records:
+            return pd.DataFrame()
+
+        df = pd.DataFrame(records)
+        grouped = df.groupby('statement')
+        summary = grouped['duration_ms'].agg(
+            calls='count',
+            p50=lambda d: d.quantile(0.50),
+            p95=lambda d: d.quantile(0.95),
+            p99=lambda d: d.quantile(0.99),
+            max='max',
+            total='sum',
+        )
+        summary['avg_rows'] = grouped['row_count'].mean()
+        summary['errors'] = grouped['error'].count()
+        summary['pages'] = grouped['page'].agg(lambda p: ", ".join(sorted(set(p))))
+        summary = summary.reset_index().sort_values('p95', ascending=False)
+        return summary.round({'p50': 2, 'p95': 2, 'p99': 2, 'max': 2, 'total': 1, 'avg_rows': 1})
+
+    def get_slow_plans(self) -> List[Dict[str, Any]]:
+        """Captured plans of slow statements, slowest first"""
+        with self._lock:
+            plans = [dict(p) for p in self._plans.values()]
+        return sorted(plans, key=lambda p: p['duration_ms'], reverse=True)
+
+    def clear(self):
+        """Forget all recorded statements and plans"""
+        with self._lock:
+            self._records.clear()
+            self._plans.clear()
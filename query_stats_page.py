@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Query Statistics Page - Database Performance Monitor
+أداء قاعدة البيانات
+"""
+
+import streamlit as st
+from auth_manager import require_permission
+
+
+@require_permission('reports', 'view')
+def show_query_stats_page(db):
+    """Per-statement latency percentiles, slow query plans, recent statements and maintenance runs"""
+
+    st.header("⏱️ أداء قاعدة البيانات - Query Performance")
+
+    monitor = db.monitor
+    summary = monitor.get_summary()
+
+    st.caption(
+        f"حد الاستعلام البطيء: {monitor.slow_threshold_ms:.0f} ms | "
+        f"السجل الكامل في ملف logs/queries.log"
+    )
+
+    # =========================================================================
+    #                    KEY METRICS
+    # =========================================================================
+
+    if not summary.empty:
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("عدد الاستعلامات", int(summary['calls'].sum()))
+        col2.metric("الاستعلامات المختلفة", len(summary))
+        col3.metric("أبطأ p95", f"{summary['p95'].max():,.1f} ms")
+        col4.metric("الأخطاء", int(summary['errors'].sum()))
+
+        if st.button("🔄 مسح الإحصائيات"):
+            monitor.clear()
+            st.rerun()
+
+    st.divider()
+
+    tab1, tab2, tab3, tab4 = st.tabs([
+        "📊 ملخص الاستعلامات", "🐢 الاستعلامات البطيئة", "📜 آخر الاستعلامات", "🧹 صيانة قاعدة البيانات"
+    ])
+
+    # =========================================================================
+    #                    TAB 1: PERCENTILE SUMMARY
+    # =========================================================================
+
+    with tab1:
+        if summary.empty:
+            st.info("لا توجد استعلامات مسجلة بعد")
+        summary_display = summary.rename(columns={
+            'statement': 'الاستعلام',
+            'calls': 'المرات',
+            'p50': 'p50 (ms)',
+            'p95': 'p95 (ms)',
+            'p99': 'p99 (ms)',
+            'max': 'الأقصى (ms)',
+            'total': 'الإجمالي (ms)',
+            'avg_rows': 'متوسط الصفوف',
+            'errors': 'الأخطاء',
+            'pages': 'الصفحات'
+        })
+        st.dataframe(summary_display, use_container_width=True, hide_index=True)
+
+    # =========================================================================
+    #                    TAB 2: SLOW QUERY PLANS
+    # =========================================================================
+
+    with tab2:
+        plans = monitor.get_slow_plans()
+
+        if not plans:
+            st.success("✅ لا توجد استعلامات أبطأ من الحد المسموح")
+
+        for plan in plans:
+            with st.expander(f"🐢 {plan['duration_ms']:,.1f} ms | {plan['statement'][:90]}"):
+                st.code(plan['statement'], language="sql")
+                st.markdown(f"**خطة التنفيذ (EXPLAIN QUERY PLAN)** - {plan['captured_at']}")
+                st.code(plan['plan'], language="text")
+
+    # =========================================================================
+    #                    TAB 3: RECENT STATEMENTS
+    # =========================================================================
+
+    with tab3:
+        recent = monitor.get_recent(limit=200)
+        st.dataframe(recent, use_container_width=True, hide_index=True)
+
+    # =========================================================================
+    #                    TAB 4: MAINTENANCE
+    # =========================================================================
+
+    with tab4:
+        scheduler = db.maintenance
+        st.caption(
+            "يتم تشغيل ANALYZE و PRAGMA optimize و WAL checkpoint و incremental vacuum "
+            "تلقائياً أثناء فترات عدم النشاط"
+        )
+
+        col_idle, col_run = st.columns([3, 1])
+        col_idle.metric("مدة عدم النشاط", f"{scheduler.idle_seconds() / 60:,.1f} دقيقة")
+
+        if col_run.button("▶️ تشغيل الصيانة الآن", use_container_width=True):
+            with st.spinner("جاري تنفيذ الصيانة..."):
+                result = scheduler.run_now()
+            if result.empty:
+                st.warning("الصيانة قيد التنفيذ بالفعل")
+            else:
+                st.success("✅ تمت الصيانة")
+
+        maintenance_log = scheduler.maintenance.get_log(limit=100)
+        if maintenance_log.empty:
+            st.info("لم يتم تشغيل الصيانة بعد")
+        else:
+            log_display = maintenance_log.drop(columns=['id']).rename(columns={
+                'run_at': 'الوقت (UTC)',
+                'task': 'المهمة',
+                'duration_ms': 'المدة (ms)',
+                'pages_before': 'الصفحات قبل',
+                'pages_after': 'الصفحات بعد',
+                'free_pages_before': 'الصفحات الفارغة قبل',
+                'free_pages_after': 'الصفحات الفارغة بعد',
+                'details': 'التفاصيل',
+                'error': 'الخطأ'
+            })
+            st.dataframe(log_display, use_container_width=True, hide_index=True)
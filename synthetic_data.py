@@ -0,0 +1,723 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic Data - Seeded, realistic datasets for scale testing
+Features:
+- Doctors, centers with branches, entity and branch doctors_prices
+- Cases with FDI teeth_map JSON as the entry page builds it (crowns, bridges, nightguards)
+- Status lifecycle (in lab → after try-in → delivered) from the entry and delivery dates
+- Monthly invoices (a few cancelled and re-issued), payments and matching balances
+- Activity log with its rollups, attachments from a pool of generated photos and scans
+- Same seed, same data; chunked bulk inserts with secondary indexes rebuilt at the end
+"""
+
+import io
+import json
+import random
+import sqlite3
+import struct
+import time
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from constants import (
+    UPPER_RIGHT_TEETH,
+    UPPER_LEFT_TEETH,
+    LOWER_LEFT_TEETH,
+    LOWER_RIGHT_TEETH,
+    ALL_UPPER_TEETH,
+    ALL_LOWER_TEETH,
+    STATUS_IN_LAB,
+    STATUS_IN_LAB_AFTER_TRYIN,
+    STATUS_DELIVERED,
+)
+
+# Password of every generated user (test databases only)
+SYNTHETIC_PASSWORD = "synthetic123"
+
+# Rows per executemany/commit while loading
+CHUNK_ROWS = 50_000
+
+FIRST_NAMES = [
+    "أحمد", "محمد", "محمود", "مصطفى", "عمر", "خالد", "يوسف", "كريم", "حسن", "طارق",
+    "سارة", "منى", "نورا", "هبة", "ياسمين", "مريم", "دينا", "رانيا", "إيمان", "شيماء",
+]
+LAST_NAMES = [
+    "عبد الله", "السيد", "حسين", "إبراهيم", "فاروق", "الشريف", "منصور", "سليمان",
+    "عادل", "فهمي", "رشدي", "الجمال", "نصار", "شاكر", "البنا", "زكي",
+]
+CENTER_NAMES = [
+    "سمايل", "دنتا كير", "بيرل", "كريستال", "لايف", "الشفاء", "النور", "رويال",
+    "بريميوم", "سبارك", "وايت", "جولد",
+]
+DISTRICTS = [
+    "مدينة نصر", "المعادي", "الدقي", "الشيخ زايد", "التجمع الخامس", "المهندسين",
+    "مصر الجديدة", "6 أكتوبر", "الزمالك", "حلوان", "شبرا", "الهرم",
+]
+SHADES = ["A1", "A2", "A3", "A3.5", "B1", "B2", "B3", "C1", "C2", "D2", "BL2"]
+CASE_NOTES = [
+    "مراجعة اللون مع الدكتور", "تعديل الإطباق", "المريض مسافر", "إعادة طبعة",
+    "تسليم صباحاً", "مع الموديل", "شفافية عالية في الحافة",
+]
+# (method, weight); non-cash methods carry a reference number
+PAYMENT_METHODS = [("نقدي", 0.5), ("تحويل بنكي", 0.3), ("شيك", 0.1), ("إنستاباي", 0.1)]
+PRIORITIES = [("normal", 0.8), ("important", 0.12), ("urgent", 0.08)]
+
+# Generated users: (username, full name, role)
+SYNTHETIC_USERS = [
+    ("tech1", "فني - أحمد سمير", "technician"),
+    ("tech2", "فني - محمود علي", "technician"),
+    ("tech3", "فني - كريم حسن", "technician"),
+    ("tech4", "فني - مينا عادل", "technician"),
+    ("accountant1", "محاسب - هبة فؤاد", "accountant"),
+    ("manager1", "مدير - خالد منصور", "manager"),
+]
+
+QUADRANTS = [UPPER_RIGHT_TEETH, UPPER_LEFT_TEETH, LOWER_LEFT_TEETH, LOWER_RIGHT_TEETH]
+
+
+class SyntheticDataGenerator:
+    """Fill an empty database with a reproducible multi-year history"""
+
+    def __init__(self, db_name: str, seed: int = 42, years: int = 5, end_date: Optional[date] = None):
+        self.db_name = db_name
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.rng = np.random.default_rng(seed)
+        self.end_date = end_date or date.today()
+        self.start_date = self.end_date - timedelta(days=365 * years)
+        self.days = (self.end_date - self.start_date).days
+        # Day offset -> ISO date, looked up instead of formatting a million dates
+        self._iso = [(self.start_date + timedelta(days=d)).isoformat() for d in range(self.days + 120)]
+        self.stats: Dict[str, float] = {}
+        self.db = None
+
+    # =========================================================================
+    #                         HELPERS
+    # =========================================================================
+
+    def _timestamp(self, day: int, start_hour: int = 9, end_hour: int = 18) -> str:
+        """'YYYY-MM-DD HH:MM:SS' at a random working-hours time of a day offset"""
+        seconds = self.random.randrange(start_hour * 3600, end_hour * 3600)
+        return f"{self._iso[day]} {seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+    def _working_day(self, day: int) -> int:
+        """The day itself or the next one that is not a Friday"""
+        return day + 1 if (self.start_date + timedelta(days=day)).weekday() == 4 else day
+
+    def _unique_names(self, count: int, make) -> List[str]:
+        """count distinct names from make(), numbered once the combinations run out"""
+        names, seen = [], set()
+        while len(names) < count:
+            name = make()
+            if name in seen:
+                name = f"{name} {len(names) + 1}"
+            seen.add(name)
+            names.append(name)
+        return names
+
+    def _insert(self, conn, table: str, columns: List[str], rows: List[Tuple]):
+        """
+        executemany into table in CHUNK_ROWS slices
+
+        Each slice is recorded on the query monitor like other bulk writes,
+        which also keeps the maintenance scheduler from starting mid-load.
+        """
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        for start in range(0, len(rows), CHUNK_ROWS):
+            began = time.perf_counter()
+            conn.executemany(sql, rows[start:start + CHUNK_ROWS])
+            conn.commit()
+            self.db.monitor.record(f"synthetic {table}", (), 'transaction',
+                                   (time.perf_counter() - began) * 1000, len(rows[start:start + CHUNK_ROWS]),
+                                   "synthetic_data")
+
+    def _drop_indexes(self, conn, tables: List[str]) -> List[str]:
+        """Drop the secondary indexes of tables, returning their CREATE statements"""
+        placeholders = ", ".join("?" * len(tables))
+        indexes = conn.execute(f"""
+            SELECT name, sql FROM sqlite_master
+            WHERE type = 'index' AND sql IS NOT NULL AND tbl_name IN ({placeholders})
+        """, tables).fetchall()
+        for name, _ in indexes:
+            conn.execute(f"DROP INDEX {name}")
+        return [sql for _, sql in indexes]
+
+    # =========================================================================
+    #                         PEOPLE AND PRICES
+    # =========================================================================
+
+    def _create_users(self) -> List[Dict]:
+        """Lab staff through AuthManager (the admin user already exists)"""
+        from auth_manager import get_auth_manager
+        auth = get_auth_manager(self.db_name)
+        for username, full_name, role in SYNTHETIC_USERS:
+            auth.create_user(username, SYNTHETIC_PASSWORD, full_name, role, created_by='admin',
+                             notes='synthetic')
+        return [{'username': u, 'full_name': n, 'role': r} for u, n, r in SYNTHETIC_USERS]
+
+    def _create_entities(self, conn, doctors: int, centers: int, max_branches: int) -> List[Dict]:
+        """
+        Root doctors and centers with their branches
+
+        Returns the billing accounts: {entity_id, branch_id, entity_name,
+        branch_name, is_center}, one per doctor, per branch and per center
+        without branches.
+        """
+        doctor_names = self._unique_names(
+            doctors, lambda: f"د. {self.random.choice(FIRST_NAMES)} {self.random.choice(LAST_NAMES)}"
+        )
+        center_names = self._unique_names(centers, lambda: f"مركز {self.random.choice(CENTER_NAMES)}")
+        created_at = f"{self._iso[0]} 09:00:00"
+
+        # Numbered codes: every generated name starts with the same title ("د. ", "مركز")
+        rows = []
+        for number, name in enumerate(doctor_names, 1):
+            phone = f"01{self.random.choice('0125')}{self.random.randrange(10**7, 10**8)}"
+            rows.append((name, f"D-{number:04d}", phone, None, 0, None, None, created_at, created_at))
+        for number, name in enumerate(center_names, 1):
+            phone = f"02{self.random.randrange(10**7, 10**8)}"
+            rows.append((name, f"C-{number:04d}", phone, None, 1, None, None, created_at, created_at))
+        self._insert(conn, "doctors_list", [
+            "name", "doc_code", "phone", "email", "is_center", "parent_id", "center_parent",
+            "created_at", "updated_at"
+        ], rows)
+        ids = dict(conn.execute("SELECT name, id FROM doctors_list").fetchall())
+
+        branch_rows = []
+        for center in center_names:
+            # Some centers bill as a whole, without branches
+            count = self.random.randint(0, max_branches) if self.random.random() > 0.2 else 0
+            for district in self.random.sample(DISTRICTS, min(count, len(DISTRICTS))):
+                name = f"{center} - {district}"
+                branch_rows.append((name, f"B-{len(branch_rows) + 1:04d}", None, None, 0, ids[center], center,
+                                    created_at, created_at))
+        self._insert(conn, "doctors_list", [
+            "name", "doc_code", "phone", "email", "is_center", "parent_id", "center_parent",
+            "created_at", "updated_at"
+        ], branch_rows)
+
+        accounts = [{'entity_id': ids[n], 'branch_id': None, 'entity_name': n, 'branch_name': None,
+                     'is_center': 0} for n in doctor_names]
+        for center in center_names:
+            branches = conn.execute(
+                "SELECT id, name FROM doctors_list WHERE parent_id = ? ORDER BY id", (ids[center],)
+            ).fetchall()
+            for branch_id, branch_name in branches or [(None, None)]:
+                accounts.append({'entity_id': ids[center], 'branch_id': branch_id, 'entity_name': center,
+                                 'branch_name': branch_name, 'is_center': 1})
+        return accounts
+
+    def _create_prices(self, conn, accounts: List[Dict]) -> Dict[str, Tuple[float, float]]:
+        """
+        Negotiated prices per doctor/center, a few branch overrides
+
+        Returns the catalog, material -> (default price, default cost). Each
+        account gets 'resolved': material -> teeth_map entry, resolved like
+        PriceMatrix.resolve_teeth_map (branch → entity → catalog).
+        """
+        catalog = {name: (float(price), float(cost)) for name, price, cost in conn.execute(
+            "SELECT material_name, default_price, default_cost FROM material_catalog WHERE is_active = 1"
+        ).fetchall()}
+
+        entity_prices: Dict[int, Dict[str, Tuple[float, float]]] = {}
+        branch_prices: Dict[int, Dict[str, Tuple[float, float]]] = {}
+        rows = []
+        for account in accounts:
+            entity_id, branch_id = account['entity_id'], account['branch_id']
+            if entity_id not in entity_prices:
+                prices = entity_prices[entity_id] = {}
+                for material, (price, cost) in catalog.items():
+                    # A few materials stay on the catalog price
+                    if self.random.random() < 0.15:
+                        continue
+                    prices[material] = (round(price * self.random.uniform(0.8, 1.25) / 50) * 50, cost)
+                    rows.append((entity_id, account['entity_name'], material, prices[material][0], cost))
+            if branch_id and self.random.random() < 0.3:
+                prices = branch_prices[branch_id] = {}
+                for material in self.random.sample(sorted(catalog), 2):
+                    base = entity_prices[entity_id].get(material, catalog[material])[0]
+                    prices[material] = (round(base * self.random.uniform(0.9, 1.1) / 50) * 50, catalog[material][1])
+                    rows.append((branch_id, account['branch_name'], material, prices[material][0],
+                                 catalog[material][1]))
+        self._insert(conn, "doctors_prices", ["entity_id", "doc_name", "material", "price", "cost_price"], rows)
+
+        for account in accounts:
+            resolved = {}
+            levels = [(catalog, 'catalog'), (entity_prices[account['entity_id']], 'entity'),
+                      (branch_prices.get(account['branch_id'], {}), 'branch')]
+            for prices, source in levels:
+                for material, (price, cost) in prices.items():
+                    resolved[material] = {"material": material, "price": float(price), "cost": cost, "source": source}
+            account['resolved'] = resolved
+        return catalog
+
+    # =========================================================================
+    #                         CASES
+    # =========================================================================
+
+    def _case_works(self, resolved: Dict[str, Dict], crown_materials: List[str],
+                    bridge_materials: List[str], arch_materials: List[str]) -> Tuple[Dict, float, int]:
+        """
+        teeth_map, price and tooth count of one case, combined like the entry page
+
+        Nightguards cover a whole arch and are priced once; crowns and
+        bridges are priced per tooth. Works of one case never share a tooth.
+        """
+        teeth_map, price, count = {}, 0.0, 0
+        if arch_materials and self.random.random() < 0.08:
+            material = self.random.choice(arch_materials)
+            arches = [ALL_UPPER_TEETH, ALL_LOWER_TEETH] if self.random.random() < 0.3 else \
+                [self.random.choice([ALL_UPPER_TEETH, ALL_UPPER_TEETH, ALL_LOWER_TEETH])]
+            entry = resolved[material]
+            for arch in arches:
+                for tooth in arch:
+                    teeth_map[str(tooth)] = entry
+                price += entry['price']
+                count += len(arch)
+            return teeth_map, price, count
+
+        works = self.random.choices((1, 2, 3), weights=(70, 22, 8))[0]
+        used = set()
+        for _ in range(works):
+            quadrant = self.random.choice(QUADRANTS)
+            # Positions 1-7 from the midline, third molars are rarely restored
+            if self.random.random() < 0.35:
+                length = self.random.choices((3, 4, 5, 6), weights=(70, 20, 7, 3))[0]
+                materials = bridge_materials
+            else:
+                length, materials = 1, crown_materials
+            start = self.random.randint(1, 8 - length)
+            teeth = [quadrant[0] // 10 * 10 + position for position in range(start, start + length)]
+            if used.intersection(teeth):
+                continue
+            used.update(teeth)
+            entry = resolved[self.random.choice(materials)]
+            for tooth in teeth:
+                teeth_map[str(tooth)] = entry
+            price += entry['price'] * length
+            count += length
+        return teeth_map, price, count
+
+    def _create_cases(self, conn, accounts: List[Dict], catalog: Dict, users: List[Dict],
+                      cases: int, pool: List[Dict], attachment_ratio: float) -> pd.DataFrame:
+        """
+        Insert cases (with their create/deliver activity and attachments)
+
+        Returns id, account, delivery day and price of every case for
+        invoicing.
+        """
+        rng = self.rng
+        # Business grows over the period: entry density rises linearly to twice the start
+        u = rng.random(cases)
+        growth = 1.0
+        offsets = (np.sqrt(1 + 2 * growth * (1 + growth / 2) * u) - 1) / growth
+        entry_day = np.sort((offsets * self.days).astype(np.int64))
+        fridays = (entry_day + self.start_date.weekday()) % 7 == 4
+        entry_day[fridays] -= 1
+        entry_day = np.clip(entry_day, 0, self.days)
+
+        # Few big customers, many small ones
+        weights = 1.0 / np.arange(1, len(accounts) + 1) ** 0.8
+        account = rng.permutation(len(accounts))[rng.choice(len(accounts), size=cases, p=weights / weights.sum())]
+
+        priority = rng.choice(len(PRIORITIES), size=cases, p=[w for _, w in PRIORITIES])
+        turnaround = np.where(priority == 2, rng.integers(2, 5, cases), rng.integers(4, 11, cases))
+        expected_day = entry_day + turnaround
+        is_try_in = rng.random(cases) < 0.25
+        try_in_day = entry_day + np.maximum(turnaround // 2, 1)
+        delivery_day = np.maximum(expected_day + rng.integers(-2, 4, cases), entry_day + 1)
+        delivered = delivery_day <= self.days
+        delivery_day = np.where(delivered, delivery_day, -1)
+        has_attachment = rng.random(cases) < attachment_ratio
+
+        # Case codes keep the app's A1-yymmdd... form: per-day sequence instead of the minute
+        _, first_of_day, per_day = np.unique(entry_day, return_index=True, return_counts=True)
+        sequence = np.arange(cases) - np.repeat(first_of_day, per_day)
+        width = max(4, len(str(int(per_day.max()))))
+
+        crown_materials = [m for m in catalog if "nightguard" not in m.lower() and "bridge" not in m.lower()]
+        bridge_materials = [m for m in catalog if "bridge" in m.lower()] + \
+            [m for m in crown_materials if m in ("Zircon", "Metal-Ceramic", "PMMA")]
+        arch_materials = [m for m in catalog if "nightguard" in m.lower()]
+        technicians = [u for u in users if u['role'] == 'technician'] or users
+        technician_names = [u['full_name'].split(" - ")[-1] for u in technicians]
+        patients = [f"{f} {l}" for f in FIRST_NAMES for l in LAST_NAMES]
+
+        case_columns = [
+            "id", "case_code", "patient", "entity_id", "branch_id", "doctor_id", "doctor", "dental_center",
+            "branch_name", "entry_date", "expected_delivery", "color", "teeth_map", "notes", "price", "count",
+            "is_try_in", "try_in_date", "priority", "lab_technician", "attachment", "status",
+            "delivery_date", "created_at", "updated_at"
+        ]
+        activity_columns = ["username", "action_type", "module", "description", "record_id", "timestamp"]
+        attachment_columns = ["case_code", "sha256", "original_name", "uploaded_by", "created_at"]
+        prices = np.zeros(cases)
+        next_id = (conn.execute("SELECT COALESCE(MAX(id), 0) FROM cases").fetchone()[0] or 0) + 1
+
+        for chunk_start in range(0, cases, CHUNK_ROWS):
+            case_rows, activity_rows, attachment_rows = [], [], []
+            for i in range(chunk_start, min(chunk_start + CHUNK_ROWS, cases)):
+                acc = accounts[account[i]]
+                teeth_map, price, count = self._case_works(
+                    acc['resolved'], crown_materials, bridge_materials, arch_materials
+                )
+                prices[i] = price
+                case_id = next_id + i
+                day = int(entry_day[i])
+                case_code = f"A1-{self._iso[day][2:].replace('-', '')}{int(sequence[i]):0{width}d}"
+                technician = self.random.randrange(len(technicians))
+                created_at = self._timestamp(day)
+
+                if delivered[i]:
+                    status = STATUS_DELIVERED
+                elif is_try_in[i] and try_in_day[i] <= self.days:
+                    status = STATUS_IN_LAB_AFTER_TRYIN
+                else:
+                    status = STATUS_IN_LAB
+                delivery = self._iso[int(delivery_day[i])] if delivered[i] else None
+
+                attachment = None
+                if has_attachment[i] and pool:
+                    blob = pool[self.random.randrange(len(pool))]
+                    attachment = blob['path']
+                    attachment_rows.append((case_code, blob['sha256'], blob['name'],
+                                            technicians[technician]['username'], created_at))
+
+                doctor = acc['entity_name']
+                case_rows.append((
+                    case_id, case_code, self.random.choice(patients), acc['entity_id'], acc['branch_id'],
+                    acc['entity_id'], doctor, doctor if acc['is_center'] else None, acc['branch_name'],
+                    self._iso[day], self._iso[int(expected_day[i])], self.random.choice(SHADES),
+                    json.dumps(teeth_map), self.random.choice(CASE_NOTES) if self.random.random() < 0.1 else "",
+                    price, count, int(is_try_in[i]), self._iso[int(try_in_day[i])] if is_try_in[i] else None,
+                    PRIORITIES[priority[i]][0], technician_names[technician], attachment, status,
+                    delivery, created_at, f"{delivery} 17:00:00" if delivery else created_at
+                ))
+                activity_rows.append((technicians[technician]['username'], 'create', 'cases',
+                                      f"إضافة حالة جديدة: {case_code}", case_id, created_at))
+                if delivered[i]:
+                    activity_rows.append((technicians[technician]['username'], 'update', 'cases',
+                                          f"تسليم الحالة: {case_code}", case_id,
+                                          self._timestamp(int(delivery_day[i]))))
+
+            self._insert(conn, "cases", case_columns, case_rows)
+            self._insert(conn, "activity_log", activity_columns, activity_rows)
+            self._insert(conn, "attachments", attachment_columns, attachment_rows)
+
+        return pd.DataFrame({
+            'case_id': np.arange(next_id, next_id + cases),
+            'account': account,
+            'delivery_day': delivery_day,
+            'price': prices,
+        })
+
+    # =========================================================================
+    #                         ATTACHMENTS
+    # =========================================================================
+
+    def _photo(self) -> bytes:
+        """Small JPEG standing in for an intra-oral photo"""
+        height, width = 240, 320
+        base = self.rng.integers(120, 230, size=3)
+        gradient = np.linspace(0.7, 1.1, width)[None, :, None] * base[None, None, :]
+        noise = self.rng.normal(0, 12, size=(height, width, 3))
+        pixels = np.clip(gradient + noise, 0, 255).astype(np.uint8)
+        out = io.BytesIO()
+        Image.fromarray(pixels, "RGB").save(out, "JPEG", quality=80)
+        return out.getvalue()
+
+    def _scan(self) -> bytes:
+        """Binary STL of a bumpy closed surface standing in for a scan"""
+        rings, segments = 24, 48
+        theta = np.linspace(0, np.pi, rings + 1)
+        phi = np.linspace(0, 2 * np.pi, segments, endpoint=False)
+        radius = 10 * (1 + 0.08 * self.rng.standard_normal((rings + 1, segments)))
+        radius[0, :], radius[-1, :] = radius[0].mean(), radius[-1].mean()
+        points = np.stack([
+            radius * np.sin(theta)[:, None] * np.cos(phi)[None, :] * 2.5,
+            radius * np.sin(theta)[:, None] * np.sin(phi)[None, :],
+            radius * np.cos(theta)[:, None] * 0.6,
+        ], axis=-1).astype(np.float32)
+        # One shared point per pole: sin(pi) is not exactly 0 in float32, so the computed ring would not weld
+        points[0, :] = (0, 0, radius[0, 0] * 0.6)
+        points[-1, :] = (0, 0, -radius[-1, 0] * 0.6)
+
+        triangles = []
+        for r in range(rings):
+            for s in range(segments):
+                a, b = points[r, s], points[r, (s + 1) % segments]
+                c, d = points[r + 1, s], points[r + 1, (s + 1) % segments]
+                if r > 0:
+                    triangles.append((a, c, b))
+                if r < rings - 1:
+                    triangles.append((b, c, d))
+        out = io.BytesIO()
+        out.write(b"synthetic scan".ljust(80, b" "))
+        out.write(struct.pack("<I", len(triangles)))
+        for triangle in triangles:
+            out.write(struct.pack("<3f", 0, 0, 0))
+            out.write(np.asarray(triangle, dtype="<f4").tobytes())
+            out.write(b"\0\0")
+        return out.getvalue()
+
+    def _create_attachment_pool(self, count: int) -> List[Dict]:
+        """
+        count distinct files through the attachment store (previews and scan
+        analysis are queued as for uploads)
+
+        Cases share these blobs, so a million attachments cost only the
+        pool on disk, the way identical uploads are stored once.
+        """
+        from attachment_store import get_attachment_store
+        store = get_attachment_store(self.db_name)
+        pool = []
+        for index in range(count):
+            if index % 4 == 3:
+                name, data = f"scan_{index:04d}.stl", self._scan()
+            else:
+                name, data = f"IMG_{index:04d}.jpg", self._photo()
+            blob = store.store(io.BytesIO(data), name)
+            pool.append({'sha256': blob['sha256'], 'path': blob['path'], 'name': name})
+        return pool
+
+    # =========================================================================
+    #                         INVOICES, PAYMENTS, BALANCES
+    # =========================================================================
+
+    def _create_invoices(self, conn, accounts: List[Dict], cases: pd.DataFrame,
+                         users: List[Dict]) -> List[Dict]:
+        """
+        One invoice per account and delivery month, issued early the next month
+
+        About 2% of the months stay uninvoiced, 1% of the invoices are
+        cancelled and re-issued. Returns the valid invoices for payments.
+        """
+        accountants = [u['username'] for u in users if u['role'] == 'accountant'] or ['admin']
+        delivered = cases[cases['delivery_day'] >= 0].copy()
+        dates = pd.to_datetime(self.start_date) + pd.to_timedelta(delivered['delivery_day'], unit="D")
+        delivered['month'] = dates.dt.year * 12 + dates.dt.month - 1
+
+        invoice_rows, link_rows, activity_rows, invoices = [], [], [], []
+        sequence: Dict[str, int] = {}
+        next_id = (conn.execute("SELECT COALESCE(MAX(id), 0) FROM invoices").fetchone()[0] or 0) + 1
+
+        groups = delivered.groupby(['month', 'account'], sort=True)
+        for (month, account_index), group in groups:
+            issue = date(int(month // 12), int(month % 12) + 1, 1) + timedelta(days=32)
+            issue_day = self._working_day((issue.replace(day=self.random.randint(1, 3)) - self.start_date).days)
+            if issue_day > self.days or self.random.random() < 0.02:
+                continue
+            acc = accounts[account_index]
+            total = float(group['price'].sum())
+            discount = round(total * 0.05) if self.random.random() < 0.1 else 0.0
+            case_ids = group['case_id'].tolist()
+            accountant = self.random.choice(accountants)
+
+            cancel = self.random.random() < 0.01
+            for cancelled in ([True, False] if cancel else [False]):
+                year_month = self._iso[issue_day][:7].replace('-', '')
+                sequence[year_month] = sequence.get(year_month, 0) + 1
+                number = f"INV-{year_month}-{sequence[year_month]:04d}"
+                timestamp = self._timestamp(issue_day)
+                invoice_rows.append((
+                    next_id, number, acc['entity_id'], acc['branch_id'], acc['entity_name'],
+                    acc['entity_name'] if acc['is_center'] else None, acc['branch_name'],
+                    total, discount, 0.0, total - discount, self._iso[issue_day], timestamp[11:], accountant,
+                    None, int(cancelled), timestamp if cancelled else None, accountant if cancelled else None,
+                    "خطأ في بيانات الفاتورة" if cancelled else None, timestamp
+                ))
+                link_rows.extend((next_id, case_id) for case_id in case_ids)
+                activity_rows.append((accountant, 'create', 'invoices', f"إنشاء فاتورة: {number}", next_id, timestamp))
+                if cancelled:
+                    activity_rows.append((accountant, 'delete', 'invoices', f"إلغاء فاتورة: {number}",
+                                          next_id, timestamp))
+                else:
+                    invoices.append({'id': next_id, 'account': account_index, 'day': issue_day,
+                                     'amount': total - discount, 'number': number})
+                next_id += 1
+
+        self._insert(conn, "invoices", [
+            "id", "invoice_number", "entity_id", "branch_id", "doctor_name", "dental_center", "branch_name",
+            "total_amount", "discount", "tax", "final_amount", "issue_date", "issue_time", "created_by",
+            "notes", "is_cancelled", "cancelled_at", "cancelled_by", "cancellation_reason", "created_at"
+        ], invoice_rows)
+        self._insert(conn, "invoice_cases", ["invoice_id", "case_id"], link_rows)
+        self._insert(conn, "activity_log", ["username", "action_type", "module", "description",
+                                            "record_id", "timestamp"], activity_rows)
+        # Invoiced cases are paid from the app's point of view (create_invoice)
+        conn.execute("""
+            UPDATE cases SET is_paid = 1
+            WHERE id IN (
+                SELECT ic.case_id FROM invoice_cases ic
+                JOIN invoices i ON i.id = ic.invoice_id
+                WHERE i.is_cancelled = 0
+            )
+        """)
+        conn.commit()
+        self.stats['invoices'] = len(invoice_rows)
+        return invoices
+
+    def _create_payments(self, conn, accounts: List[Dict], invoices: List[Dict], users: List[Dict]):
+        """Most invoices paid within weeks, in one or two instalments; recent ones often still open"""
+        accountants = [u['username'] for u in users if u['role'] == 'accountant'] or ['admin']
+        methods, method_weights = zip(*PAYMENT_METHODS)
+        rows, activity_rows = [], []
+        for invoice in invoices:
+            age = self.days - invoice['day']
+            if self.random.random() > (0.95 if age > 60 else 0.6):
+                continue
+            amount = invoice['amount']
+            if self.random.random() < 0.05:
+                amount = round(amount * self.random.uniform(0.5, 0.9), -1)
+            parts = [amount] if self.random.random() < 0.8 else [round(amount / 2, -1), amount - round(amount / 2, -1)]
+            day = invoice['day']
+            acc = accounts[invoice['account']]
+            for part in parts:
+                day += self.random.randint(3, 30)
+                if day > self.days or part <= 0:
+                    break
+                method = self.random.choices(methods, weights=method_weights)[0]
+                reference = None if method == "نقدي" else f"REF-{self.random.randrange(10**6, 10**7)}"
+                accountant = self.random.choice(accountants)
+                timestamp = self._timestamp(day)
+                rows.append((acc['entity_id'], acc['branch_id'], acc['entity_name'], acc['branch_name'], part,
+                             method, reference, self._iso[day], f"سداد {invoice['number']}", accountant, timestamp))
+                activity_rows.append((accountant, 'create', 'payments', f"تسجيل دفعة: {part:,.0f}",
+                                      None, timestamp))
+
+        self._insert(conn, "payments", [
+            "entity_id", "branch_id", "entity_name", "branch_name", "amount", "payment_method",
+            "reference_number", "payment_date", "notes", "created_by", "created_at"
+        ], rows)
+        self._insert(conn, "activity_log", ["username", "action_type", "module", "description",
+                                            "record_id", "timestamp"], activity_rows)
+        self.stats['payments'] = len(rows)
+
+    def _create_balances(self, conn, accounts: List[Dict]):
+        """One balance row per account, totals taken from the generated ledger"""
+        conn.execute("""
+            INSERT INTO balances (
+                entity_id, branch_id, entity_name, entity_type, branch_name,
+                previous_balance, outstanding_balance, total_invoiced, total_paid
+            )
+            SELECT a.entity_id, a.branch_id, a.entity_name, a.entity_type, a.branch_name,
+                   0, COALESCE(i.invoiced, 0) - COALESCE(p.paid, 0), COALESCE(i.invoiced, 0), COALESCE(p.paid, 0)
+            FROM (SELECT json_extract(value, '$.entity_id') AS entity_id,
+                         json_extract(value, '$.branch_id') AS branch_id,
+                         json_extract(value, '$.entity_name') AS entity_name,
+                         json_extract(value, '$.entity_type') AS entity_type,
+                         json_extract(value, '$.branch_name') AS branch_name
+                  FROM json_each(?)) a
+            LEFT JOIN (SELECT entity_id, COALESCE(branch_id, 0) AS branch_key, SUM(final_amount) AS invoiced
+                       FROM invoices WHERE is_cancelled = 0 GROUP BY 1, 2) i
+                   ON i.entity_id = a.entity_id AND i.branch_key = COALESCE(a.branch_id, 0)
+            LEFT JOIN (SELECT entity_id, COALESCE(branch_id, 0) AS branch_key, SUM(amount) AS paid
+                       FROM payments GROUP BY 1, 2) p
+                   ON p.entity_id = a.entity_id AND p.branch_key = COALESCE(a.branch_id, 0)
+        """, (json.dumps([{
+            'entity_id': a['entity_id'], 'branch_id': a['branch_id'], 'entity_name': a['entity_name'],
+            'entity_type': 'center' if a['is_center'] else 'doctor', 'branch_name': a['branch_name'],
+        } for a in accounts], ensure_ascii=False),))
+        conn.commit()
+
+    # =========================================================================
+    #                         ACTIVITY
+    # =========================================================================
+
+    def _create_logins(self, conn, users: List[Dict]):
+        """A login and logout per user and working day"""
+        rows = []
+        for day in range(self.days + 1):
+            if (self.start_date + timedelta(days=day)).weekday() == 4:
+                continue
+            for user in users + [{'username': 'admin'}]:
+                if self.random.random() < 0.1:
+                    continue  # Day off
+                rows.append((user['username'], 'login', 'system', 'تسجيل دخول ناجح', None,
+                             self._timestamp(day, 8, 10)))
+                rows.append((user['username'], 'logout', 'system', 'تسجيل خروج', None,
+                             self._timestamp(day, 17, 20)))
+        self._insert(conn, "activity_log", ["username", "action_type", "module", "description",
+                                            "record_id", "timestamp"], rows)
+
+    @staticmethod
+    def _rebuild_rollups(conn):
+        """Recount the hourly/daily rollups the activity writer keeps for single events"""
+        for table, bucket_format in (('activity_rollup_hourly', '%Y-%m-%d %H:00:00'),
+                                     ('activity_rollup_daily', '%Y-%m-%d')):
+            conn.execute(f"DELETE FROM {table}")
+            conn.execute(f"""
+                INSERT INTO {table} (bucket, username, module, action_type, event_count)
+                SELECT strftime('{bucket_format}', timestamp), username, module, action_type, COUNT(*)
+                FROM activity_log
+                WHERE timestamp IS NOT NULL
+                GROUP BY 1, 2, 3, 4
+            """)
+        conn.commit()
+
+    # =========================================================================
+    #                         RUN
+    # =========================================================================
+
+    def generate(self, doctors: int = 200, centers: int = 40, max_branches: int = 5, cases: int = 100_000,
+                 attachment_files: int = 200, attachment_ratio: float = 0.3) -> Dict[str, float]:
+        """
+        Generate everything into the (empty) database; returns row counts and seconds
+
+        Raises ValueError when the database already has doctors or cases:
+        synthetic rows are never mixed into real data.
+        """
+        # Creates the schema, the admin user and the attachment store
+        from database import DatabaseManager
+        self.db = DatabaseManager(self.db_name)
+        with sqlite3.connect(self.db_name) as conn:
+            existing = conn.execute(
+                "SELECT (SELECT COUNT(*) FROM doctors_list) + (SELECT COUNT(*) FROM cases)"
+            ).fetchone()[0]
+        if existing:
+            raise ValueError(f"{self.db_name} already has data, use a new database file")
+
+        started = time.perf_counter()
+        users = self._create_users()
+        pool = self._create_attachment_pool(attachment_files)
+        self.stats['attachment_files'] = len(pool)
+
+        with sqlite3.connect(self.db_name, timeout=30) as conn:
+            # Bulk load: no fsync per commit, indexes rebuilt once at the end
+            conn.execute("PRAGMA synchronous = OFF")
+            indexes = self._drop_indexes(conn, [
+                "doctors_list", "doctors_prices", "cases", "invoices", "invoice_cases",
+                "payments", "balances", "activity_log", "attachments"
+            ])
+
+            accounts = self._create_entities(conn, doctors, centers, max_branches)
+            catalog = self._create_prices(conn, accounts)
+            self.stats['accounts'] = len(accounts)
+
+            step = time.perf_counter()
+            case_frame = self._create_cases(conn, accounts, catalog, users, cases, pool, attachment_ratio)
+            self.stats['cases'] = cases
+            self.stats['cases_seconds'] = round(time.perf_counter() - step, 1)
+
+            invoices = self._create_invoices(conn, accounts, case_frame, users)
+            self._create_payments(conn, accounts, invoices, users)
+            self._create_balances(conn, accounts)
+            self._create_logins(conn, users)
+
+            step = time.perf_counter()
+            for sql in indexes:
+                conn.execute(sql)
+            self._rebuild_rollups(conn)
+            conn.execute("ANALYZE")
+            conn.commit()
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self.stats['index_seconds'] = round(time.perf_counter() - step, 1)
+
+            self.stats['activity_rows'] = conn.execute("SELECT COUNT(*) FROM activity_log").fetchone()[0]
+            self.stats['attachments'] = conn.execute("SELECT COUNT(*) FROM attachments").fetchone()[0]
+        self.stats['seconds'] = round(time.perf_counter() - started, 1)
+        return self.stats
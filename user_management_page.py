@@ -6,7 +6,7 @@ User Management Page - Admin Only
 
 import streamlit as st
 import pandas as pd
-from auth_manager import AuthManager, require_permission
+from auth_manager import get_auth_manager, require_permission
 from datetime import datetime
 
 
@@ -16,7 +16,7 @@ def show_user_management_page():
     
     st.header("👥 إدارة المستخدمين - User Management")
     
-    auth = AuthManager()
+    auth = get_auth_manager()
     current_user = st.session_state.username
     current_role = st.session_state.role
     